@@ -0,0 +1,305 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import crawler
+import fake_api
+import serializers
+from ratelimit import KeyPool, RateLimiter
+from records import Book
+from storage import STORAGE_BACKENDS
+
+BENCHMARKS = ['backfill', 'dedup', 'save', 'join']
+WEEK_SIZE = 30
+
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def timed(run, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    return (time.perf_counter() - start) / repeat
+
+
+def synthetic_books(count, category=None, offset=0):
+    return [
+        Book(
+            f'Author {number % 500}', f'Book {number}',
+            f'{2008 + number % 17}-06-07', category, [f'978{number:010d}']
+        )
+        for number in range(offset, offset + count)
+    ]
+
+
+def synthetic_best_sellers(count):
+    # Half of the audio best sellers are also number ones
+    return crawler.BestSellers({
+        'number_ones': synthetic_books(count),
+        'audio_best_sellers': synthetic_books(
+            count, 'Fiction', offset=count // 2
+        )
+    })
+
+
+def bench_backfill(args):
+    start = datetime.date.fromisoformat(args.start)
+    end = (start + datetime.timedelta(weeks=args.weeks - 1)).isoformat()
+    fake = fake_api.FakeNytBooks(
+        args.start, end, lists=args.lists, latency=args.latency,
+        error_rate=args.error_rate
+    )
+    server = fake.serve()
+    crawler.API_BASE = fake_api.base_url(server)
+    crawler.SESSION = None
+    crawler.RESPONSE_CACHE = None
+    crawler.WORKERS = args.workers
+    crawler.ENGINE = args.engine
+    if args.rate_limit:
+        crawler.RATE_LIMITER = KeyPool(
+            [f'benchmark-{key}' for key in range(args.keys)],
+            [(args.rate_limit, 60)]
+        )
+    else:
+        crawler.RATE_LIMITER = RateLimiter([(sys.maxsize, 1)])
+    crawler.STORAGE = STORAGE_BACKENDS[args.storage]()
+    best_sellers = crawler.BestSellers({
+        'number_ones': [],
+        'audio_best_sellers': [],
+        '_number_ones_last_updated': args.start,
+        '_audio_best_sellers_last_updated': args.start
+    })
+    try:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                wall_time = timed(lambda: crawler.run_pipeline(best_sellers))
+    finally:
+        crawler.STORAGE.close()
+        server.shutdown()
+        server.server_close()
+    return {
+        'weeks': args.weeks,
+        'lists': args.lists,
+        'workers': args.workers,
+        'keys': args.keys,
+        'engine': args.engine,
+        'storage': args.storage,
+        'latency': args.latency,
+        'error_rate': args.error_rate,
+        'wall_time': wall_time,
+        'calls': fake.calls,
+        'throttled_calls': fake.errors,
+        'calls_per_second': fake.calls / wall_time,
+        'number_ones': len(best_sellers['number_ones']),
+        'audio_best_sellers': len(best_sellers['audio_best_sellers']),
+        'reading_list': len(best_sellers['reading_list']),
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+
+def bench_dedup(args):
+    results = []
+    for size in args.sizes:
+        history = synthetic_books(size)
+        # A week repeats half of its books from the history
+        week = synthetic_books(WEEK_SIZE, offset=size - WEEK_SIZE // 2)
+        index_time = timed(lambda: crawler.index_books(history))
+        index = crawler.index_books(history)
+        week_times = []
+        for _ in range(args.repeat):
+            # new_books adds the new half to the index, so every
+            # repetition starts from a fresh copy
+            week_index = dict(index)
+            week_times.append(
+                timed(lambda: crawler.new_books(week, week_index))
+            )
+        results.append({
+            'history': size,
+            'index_time': index_time,
+            'week_time': sum(week_times) / len(week_times),
+            'peak_rss_kb': peak_rss_kb()
+        })
+    return results
+
+
+def bench_save(args):
+    results = []
+    for backend in args.backends:
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as workdir:
+                with contextlib.chdir(workdir):
+                    storage = STORAGE_BACKENDS[backend]()
+                    best_sellers = synthetic_best_sellers(size)
+                    first_save_time = timed(
+                        lambda: storage.save(best_sellers)
+                    )
+                    week_times = []
+                    for week in range(args.repeat):
+                        best_sellers['number_ones'].extend(synthetic_books(
+                            WEEK_SIZE, offset=size + week * WEEK_SIZE
+                        ))
+                        best_sellers['_number_ones_last_updated'] = str(week)
+                        week_times.append(
+                            timed(lambda: storage.save(best_sellers))
+                        )
+                    storage.close()
+                    file_bytes = sum(
+                        os.path.getsize(name) for name in os.listdir()
+                    )
+            results.append({
+                'storage': backend,
+                'history': size,
+                'first_save_time': first_save_time,
+                'week_save_time': sum(week_times) / len(week_times),
+                'file_bytes': file_bytes,
+                'peak_rss_kb': peak_rss_kb()
+            })
+    return results
+
+
+def bench_join(args):
+    results = []
+    for size in args.sizes:
+        best_sellers = synthetic_best_sellers(size)
+        matches = []
+        join_time = timed(
+            lambda: matches.append(
+                len(list(crawler.iter_reading_list(best_sellers)))
+            ),
+            args.repeat
+        )
+        # One week of new books joined into the existing reading list
+        reading_list = list(crawler.iter_reading_list(best_sellers))
+        number_ones = best_sellers['number_ones'] + synthetic_books(
+            WEEK_SIZE, offset=size
+        )
+        audio_best_sellers = best_sellers['audio_best_sellers'] + (
+            synthetic_books(WEEK_SIZE, 'Fiction', offset=size + size // 2)
+        )
+        incremental_time = timed(
+            lambda: crawler.update_reading_list(
+                list(reading_list), number_ones, audio_best_sellers, size,
+                size
+            ),
+            args.repeat
+        )
+        results.append({
+            'history': size,
+            'join_time': join_time,
+            'incremental_join_time': incremental_time,
+            'matches': matches[-1],
+            'peak_rss_kb': peak_rss_kb()
+        })
+    return results
+
+
+def run(args):
+    report = {
+        'started_at': datetime.datetime.now(
+            datetime.timezone.utc
+        ).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'orjson': serializers.orjson is not None,
+        'msgpack': serializers.msgpack is not None,
+        'sizes': args.sizes,
+    }
+    benchmarks = {
+        'backfill': bench_backfill,
+        'dedup': bench_dedup,
+        'save': bench_save,
+        'join': bench_join,
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        with contextlib.chdir(workdir):
+            for name in args.only or BENCHMARKS:
+                report[name] = benchmarks[name](args)
+    report['peak_rss_kb'] = peak_rss_kb()
+    return report
+
+
+def sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the crawler against a local fake NYT Books '
+        'API and print the results as JSON'
+    )
+    parser.add_argument(
+        '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='write the JSON results to this file instead of stdout'
+    )
+    parser.add_argument(
+        '--only', nargs='+', choices=BENCHMARKS, metavar='BENCHMARK',
+        help=f"run only these benchmarks ({', '.join(BENCHMARKS)})"
+    )
+    parser.add_argument(
+        '--start', default='2008-06-08',
+        help='first published date served by the fake API'
+    )
+    parser.add_argument(
+        '--weeks', type=int, default=52,
+        help='weeks served by the fake API for the backfill'
+    )
+    parser.add_argument(
+        '--lists', type=int, default=18,
+        help='lists in each overview response'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='seconds the fake API waits before each response'
+    )
+    parser.add_argument(
+        '--error-rate', type=float, default=0.0,
+        help='fraction of fake API calls answered with a 429'
+    )
+    parser.add_argument(
+        '--rate-limit', type=int, metavar='CALLS',
+        help='calls per minute allowed during the backfill (unlimited by '
+        'default)'
+    )
+    parser.add_argument(
+        '--keys', type=int, default=1,
+        help='API keys in the pool, each with its own --rate-limit'
+    )
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument(
+        '--engine', choices=['async', 'sync'], default='sync'
+    )
+    parser.add_argument(
+        '--storage', choices=sorted(STORAGE_BACKENDS), default='json',
+        help='storage backend used by the backfill'
+    )
+    parser.add_argument(
+        '--backends', type=lambda value: value.split(','),
+        default=sorted(STORAGE_BACKENDS),
+        help='comma-separated storage backends for the save benchmark'
+    )
+    parser.add_argument(
+        '--sizes', type=sizes, default=[1000, 10000, 100000],
+        help='comma-separated history sizes for the dedup, save and join '
+        'benchmarks'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='repetitions averaged for each timing'
+    )
+    args = parser.parse_args(argv)
+    json.dump(run(args), args.output, indent=4)
+    args.output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import time
+import urllib.parse
+from serializers import atomic_write
+
+CACHE_DIR = 'cache'
+RECENT_PERIOD = datetime.timedelta(days=14)
+RECENT_TTL = datetime.timedelta(days=1)
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+VALIDATORS = {'ETag': 'If-None-Match', 'Last-Modified': 'If-Modified-Since'}
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+def request_key(url):
+    # The api-key is dropped so that responses are shared between keys and
+    # never written to disk
+    parsed = urllib.parse.urlsplit(url)
+    params = sorted(
+        (name, value)
+        for name, value in urllib.parse.parse_qsl(parsed.query)
+        if name != 'api-key'
+    )
+    key = parsed.path
+    if params:
+        key += '?' + urllib.parse.urlencode(params)
+    return key
+
+
+def published_request_key(key, entry):
+    if not entry.get('published_date'):
+        return key
+    return DATE_PATTERN.sub(entry['published_date'], key, count=1)
+
+
+def conditional_headers(entry):
+    # Request headers that let the server answer 304 Not Modified when the
+    # response a cache entry was stored from is still current
+    if entry is None:
+        return {}
+    validators = entry.get('validators', {})
+    return {
+        VALIDATORS[name]: value for name, value in validators.items()
+        if name in VALIDATORS
+    }
+
+
+class ResponseCache:
+    # Raw response bodies are stored once under the sha256 of their content
+    # in objects/, and requests/ maps the sha256 of each request key to the
+    # content hash it last returned. A week's list is cached forever once it
+    # was fetched more than RECENT_PERIOD after its published date and a
+    # later list had been published; anything else may still change and
+    # expires after RECENT_TTL. Without a next_published_date the list is
+    # the newest one, and a crawl reading it forever would never move on.
+    # Entries can keep the ETag and Last-Modified validators of their
+    # response for conditional requests.
+
+    def __init__(self, path=CACHE_DIR, clock=time.time):
+        self.path = path
+        self.clock = clock
+
+    def entry_path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, 'requests', digest[:2], digest)
+
+    def object_path(self, content_hash):
+        return os.path.join(
+            self.path, 'objects', content_hash[:2], content_hash
+        )
+
+    def write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, content)
+
+    def entry(self, url):
+        try:
+            with open(self.entry_path(request_key(url))) as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return None
+
+    def is_fresh(self, entry):
+        published_date = entry.get('published_date')
+        if published_date is None:
+            match = DATE_PATTERN.search(entry['request'])
+            published_date = match and match.group()
+        if published_date and entry.get('next_published_date'):
+            published_at = datetime.datetime.fromisoformat(
+                published_date
+            ).replace(tzinfo=datetime.timezone.utc)
+            if entry['fetched_at'] >= (
+                published_at + RECENT_PERIOD
+            ).timestamp():
+                return True
+        return self.clock() - entry['fetched_at'] < RECENT_TTL.total_seconds()
+
+    def get(self, url, allow_stale=False):
+        entry = self.entry(url)
+        if entry is None:
+            return None
+        if not allow_stale and not self.is_fresh(entry):
+            return None
+        try:
+            with open(self.object_path(entry['content']), 'rb') as infile:
+                return infile.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, content, validators=None, results=None):
+        # results are the decoded results of the response, whose dates
+        # decide how long the entry stays fresh
+        key = request_key(url)
+        content_hash = hashlib.sha256(content).hexdigest()
+        object_path = self.object_path(content_hash)
+        if not os.path.isfile(object_path):
+            self.write(object_path, content)
+        entry = {
+            'request': key,
+            'content': content_hash,
+            'fetched_at': self.clock()
+        }
+        if validators:
+            entry['validators'] = validators
+        for name in ['published_date', 'next_published_date']:
+            if isinstance(results, dict) and name in results:
+                entry[name] = results[name]
+        self.write(self.entry_path(key), json.dumps(entry).encode())
+        # A requested date is searched forward to the closest list, so the
+        # entry is also filed under the date the list was published, which
+        # is the date a walk following next_published_date asks for
+        published_key = published_request_key(key, entry)
+        if published_key != key:
+            entry['request'] = published_key
+            self.write(
+                self.entry_path(published_key), json.dumps(entry).encode()
+            )
+        return content_hash
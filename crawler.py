@@ -1,151 +1,1545 @@
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import csv
 import datetime
-import json
+import functools
 import os
-import requests
+import random
+import serializers
+import sys
+import threading
 import time
-from titlecase import titlecase
+import urllib.parse
+from cache import (
+    VALIDATORS, CacheMiss, ResponseCache, conditional_headers, request_key
+)
+from matching import BookMatcher
+from metrics import Metrics
+from ratelimit import KeyPool, RateLimiter, key_id, pool_state_file
+from records import SECTIONS, Book, to_books
+from storage import (
+    STORAGE_BACKENDS, JournalStorage, JsonStorage, NullStorage, RankingStore,
+    SqliteStorage, book_key
+)
 
-API_KEY = os.environ['NYT_API_KEY']
-API_CALLS = []
+API_BASE = 'https://api.nytimes.com/svc/books/v3'
+# Keys are only needed to crawl, which checks for them, so read-only
+# commands run without any
+API_KEY = os.environ.get('NYT_API_KEY')
+API_KEYS = [
+    api_key
+    for api_key in (os.environ.get('NYT_API_KEYS') or API_KEY or '').split(',')
+    if api_key
+]
+if API_KEY is None and API_KEYS:
+    API_KEY = API_KEYS[0]
 MAX_CALLS = 10
 RATE_LIMIT_PERIOD = datetime.timedelta(seconds=60)
+MAX_DAILY_CALLS = 4000
+RATE_LIMITER = KeyPool(API_KEYS, [
+    (MAX_CALLS, RATE_LIMIT_PERIOD.total_seconds()),
+    (MAX_DAILY_CALLS, datetime.timedelta(days=1).total_seconds())
+])
+UNAUTHORIZED_BENCH_PERIOD = datetime.timedelta(hours=1)
+RATE_LIMIT_FILE = 'rate_limit.json'
 FIRST_NYT_N1_DATE = "2008-06-07"
 FIRST_NYT_ABS_DATE = "2018-03-11"
+AUDIO_CATEGORIES = ['Fiction', 'Nonfiction']
+NORMALIZE_CACHE_SIZE = 16384
+SCHEDULE_INTERVAL = datetime.timedelta(days=7)
+WORKERS = 1
+ENGINE = 'sync'
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+MAX_RETRIES = 5
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+SESSION = None
+RESPONSE_CACHE = None
+OFFLINE = False
+READING_LIST_OUTPUT = None
+STORAGE = JsonStorage()
+STATE_LOCK = threading.RLock()
+SHARD_DIR = 'shards'
+ALL_LISTS = 'all'
+RANKED_LISTS = None
+RANKINGS = None
+REFRESH = False
+METRICS = Metrics()
+METRICS.describe(
+    'nyt_api_calls_total', 'API calls that reached the network by status'
+)
+METRICS.describe('nyt_api_call_seconds', 'Latency of API calls')
+METRICS.describe(
+    'nyt_api_response_bytes_total', 'Bytes received from the API'
+)
+METRICS.describe('nyt_api_retries_total', 'API calls retried by reason')
+METRICS.describe(
+    'nyt_cache_hits_total', 'API calls answered from the response cache'
+)
+METRICS.describe('nyt_api_key_calls_total', 'API calls made with each key')
+METRICS.describe(
+    'nyt_api_key_benched_total', 'Times a key was benched by status'
+)
+METRICS.describe(
+    'crawl_phase_seconds_total',
+    'Seconds spent waiting on the rate limit, fetching, backing off, '
+    'normalizing and saving'
+)
+METRICS.describe(
+    'crawl_records_total', 'Records found by the crawl, added or deduped'
+)
+METRICS_FILE = None
 
 
-def api_call(call_url):
-    while len(API_CALLS) >= MAX_CALLS:
-        elapsed_time = datetime.datetime.now() - API_CALLS[0]
-        if elapsed_time >= RATE_LIMIT_PERIOD:
-            API_CALLS.pop(0)
-        else:
-            sleep_time = (RATE_LIMIT_PERIOD - elapsed_time).total_seconds()
-            print(
-                f'Sleeping {sleep_time} seconds to avoid being '
-                f'rate-limited'
+class BestSellers(dict):
+    # best_sellers.json contents, with books held as Book records, plus
+    # (author, title) -> book dedup indexes built once per section on first
+    # use
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for section in SECTIONS:
+            if section in self:
+                self[section] = to_books(self[section])
+        self.indexes = {}
+
+    def index(self, section):
+        if section not in self.indexes:
+            self.indexes[section] = index_books(self.get(section, []))
+        return self.indexes[section]
+
+
+def index_books(books):
+    index = {}
+    for book in books:
+        index.setdefault(book_key(book), book)
+    return index
+
+
+def book_index(best_sellers, section):
+    if isinstance(best_sellers, BestSellers):
+        return best_sellers.index(section)
+    return index_books(best_sellers.get(section, []))
+
+
+def get_session():
+    # requests and the network stack behind it are only imported by the
+    # first call, so read-only commands never load them. The number ones
+    # and audio best sellers stages share the session and run at once,
+    # each with up to WORKERS requests in flight
+    global SESSION
+    import requests
+    if SESSION is None:
+        SESSION = requests.Session()
+        SESSION.headers['Accept-Encoding'] = 'gzip'
+        SESSION.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=2 * max(WORKERS, 1)
+        ))
+    return SESSION
+
+
+def retry_delay(attempt, headers=None):
+    retry_after = (headers or {}).get('Retry-After')
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            import email.utils
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            return max((retry_at - now).total_seconds(), 0)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def cached_content(call_url):
+    if RESPONSE_CACHE is None:
+        return None
+    content = RESPONSE_CACHE.get(call_url, allow_stale=OFFLINE)
+    if content is None and OFFLINE:
+        raise CacheMiss(f'{request_key(call_url)} is not cached')
+    return content
+
+
+def cache_content(call_url, content, value):
+    if RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.put(call_url, content, results=value.get('results'))
+
+
+def endpoint_name(call_url):
+    path = urllib.parse.urlsplit(call_url).path
+    return path.rsplit('/', 1)[-1].removesuffix('.json')
+
+
+def record_call(call_url, status, started, content=b''):
+    endpoint = endpoint_name(call_url)
+    elapsed = METRICS.clock() - started
+    METRICS.inc('nyt_api_calls_total', endpoint=endpoint, status=status)
+    METRICS.observe('nyt_api_call_seconds', elapsed, endpoint=endpoint)
+    METRICS.inc('nyt_api_response_bytes_total', len(content))
+    METRICS.inc('crawl_phase_seconds_total', elapsed, phase='fetch')
+    METRICS.log(
+        'api_call', endpoint=endpoint, status=status, seconds=elapsed,
+        bytes=len(content)
+    )
+
+
+def record_retry(reason, delay):
+    METRICS.inc('nyt_api_retries_total', reason=reason)
+    METRICS.log('retry', reason=reason, delay=delay)
+    print(f'{reason}, retrying in {delay:.1f} seconds')
+
+
+def with_api_key(call_url, api_key):
+    # Swaps the api-key of a url for one handed out by the key pool
+    parsed = urllib.parse.urlsplit(call_url)
+    params = urllib.parse.parse_qsl(parsed.query)
+    if not any(name == 'api-key' for name, _ in params):
+        return call_url
+    query = urllib.parse.urlencode([
+        (name, api_key if name == 'api-key' else value)
+        for name, value in params
+    ])
+    return urllib.parse.urlunsplit(parsed._replace(query=query))
+
+
+def bench_key(api_key, status, attempt, headers):
+    # Takes a throttled (429) or rejected (401) key out of the pool for a
+    # while and returns whether the call can be retried on the pool
+    if status == 429:
+        seconds = retry_delay(attempt, headers)
+    elif status == 401:
+        seconds = UNAUTHORIZED_BENCH_PERIOD.total_seconds()
+    else:
+        return False
+    RATE_LIMITER.bench(api_key, seconds)
+    METRICS.inc(
+        'nyt_api_key_benched_total', key=key_id(api_key), status=status
+    )
+    print(f'Benching key {key_id(api_key)} for {seconds:.1f} seconds')
+    return status == 429 or bool(RATE_LIMITER.usable())
+
+
+def keyed_url(call_url, api_key):
+    if api_key is None:
+        return call_url
+    METRICS.inc('nyt_api_key_calls_total', key=key_id(api_key))
+    return with_api_key(call_url, api_key)
+
+
+def retry_after(call_url, api_key, attempt, started, response=None,
+                error=None):
+    # Records one attempt of a call made by either engine and returns None
+    # when its response (successful or 304 Not Modified) can be used, or
+    # the delay before the next attempt. Raises once the call cannot be
+    # retried.
+    if error is not None:
+        reason = type(error).__name__
+        record_call(call_url, reason, started)
+        if attempt == MAX_RETRIES:
+            raise error
+        delay = retry_delay(attempt)
+    else:
+        record_call(
+            call_url, response.status_code, started, response.content
+        )
+        if response.status_code < 400:
+            return None
+        benched = api_key is not None and bench_key(
+            api_key, response.status_code, attempt, response.headers
+        )
+        if (
+            (response.status_code not in RETRY_STATUSES and not benched)
+            or attempt == MAX_RETRIES
+        ):
+            response.raise_for_status()
+        reason = f'HTTP {response.status_code}'
+        # The pool waits out a benched key, or moves on to another one
+        delay = 0 if benched else retry_delay(attempt, response.headers)
+    record_retry(reason, delay)
+    return delay
+
+
+def fetch_response(call_url, headers=None):
+    # Returns the first usable response, retrying throttling, server and
+    # connection errors with backoff. With a key pool, each attempt uses
+    # the key it hands out.
+    import requests
+    options = {'timeout': (CONNECT_TIMEOUT, READ_TIMEOUT)}
+    if headers:
+        options['headers'] = headers
+    for attempt in range(MAX_RETRIES + 1):
+        with METRICS.timer('crawl_phase_seconds_total', phase='rate_limit'):
+            api_key = RATE_LIMITER.acquire()
+        request_url = keyed_url(call_url, api_key)
+        started = METRICS.clock()
+        try:
+            response = get_session().get(request_url, **options)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            delay = retry_after(
+                call_url, api_key, attempt, started, error=error
             )
-            time.sleep(sleep_time)
-    API_CALLS.append(datetime.datetime.now())
-    return json.loads(requests.get(call_url).text)
+        else:
+            delay = retry_after(call_url, api_key, attempt, started, response)
+            if delay is None:
+                return response
+        with METRICS.timer('crawl_phase_seconds_total', phase='backoff'):
+            time.sleep(delay)
+
+
+def api_call(call_url):
+    content = cached_content(call_url)
+    if content is not None:
+        METRICS.inc('nyt_cache_hits_total')
+        return serializers.loads(content)
+    response = fetch_response(call_url)
+    value = serializers.loads(response.content)
+    cache_content(call_url, response.content, value)
+    return value
+
+
+def refresh_call(call_url):
+    # Always asks the API, conditionally when the cached response has
+    # validators, and returns the results with whether their content
+    # changed since they were last cached
+    entry = None if RESPONSE_CACHE is None else RESPONSE_CACHE.entry(call_url)
+    response = fetch_response(call_url, conditional_headers(entry))
+    content = response.content
+    if response.status_code == 304:
+        content = RESPONSE_CACHE.get(call_url, allow_stale=True)
+        if content is None:
+            response = fetch_response(call_url)
+            content = response.content
+    results = serializers.loads(content)['results']
+    if RESPONSE_CACHE is None:
+        return results, True
+    validators = {
+        name: response.headers[name] for name in VALIDATORS
+        if name in response.headers
+    }
+    content_hash = RESPONSE_CACHE.put(call_url, content, validators, results)
+    changed = entry is None or entry['content'] != content_hash
+    return results, changed
 
 
 def save_best_seller_file(best_sellers):
-    with open('best_sellers.json', 'w') as outfile:
-        outfile.write(json.dumps(best_sellers, sort_keys=True, indent=4))
+    with METRICS.timer('crawl_phase_seconds_total', phase='save'):
+        STORAGE.save(best_sellers)
 
 
-def load_best_seller_file():
-    if os.path.isfile('best_sellers.json'):
-        with open('best_sellers.json') as infile:
-            best_sellers = json.load(infile)
-    else:
+def load_best_seller_file(sections=None):
+    # sections limits which lists are read from backends that can load
+    # lazily; cursors are always loaded
+    best_sellers = STORAGE.load(sections)
+    if best_sellers is None:
         best_sellers = {
             'number_ones': [],
             'audio_best_sellers': []
         }
-    retrieve_number_ones(best_sellers)
+    return BestSellers(best_sellers)
 
 
-def retrieve_number_ones(best_sellers):
-    published_date = best_sellers.get(
-        '_number_ones_last_updated', FIRST_NYT_N1_DATE
-    )
-    while published_date:
+def overview_url(published_date):
+    url = f'{API_BASE}/lists/overview.json'
+    url += f'?published_date={published_date}&api-key={API_KEY}'
+    return url
+
+
+def current_overview_url():
+    return f'{API_BASE}/lists/overview.json?api-key={API_KEY}'
+
+
+def full_overview_url(published_date):
+    url = f'{API_BASE}/lists/full-overview.json'
+    url += f'?published_date={published_date}&api-key={API_KEY}'
+    return url
+
+
+def list_url(published_date, list_name):
+    url = f"{API_BASE}/lists/{published_date}/{list_name}.json"
+    url += f"?api-key={API_KEY}"
+    return url
+
+
+def audio_url(published_date, category):
+    return list_url(published_date, f'audio-{category}')
+
+
+def weekly_schedule(start, end=None):
+    date = datetime.date.fromisoformat(start)
+    if end is None:
+        end = datetime.date.today()
+    else:
+        end = datetime.date.fromisoformat(end)
+    while date <= end:
+        yield date.isoformat()
+        date += SCHEDULE_INTERVAL
+
+
+def fetch_in_order(urls, workers):
+    # Keeps at most 2 * workers calls in flight and yields responses in the
+    # order their urls were given, however they complete
+    executor = concurrent.futures.ThreadPoolExecutor(workers)
+    pending = collections.deque()
+    try:
+        for url in urls:
+            pending.append(executor.submit(api_call, url))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def fetch_pages(urls):
+    # Scheduled crawls get their responses in url order from worker threads
+    # or from the async engine
+    if ENGINE == 'async':
+        return async_fetch_in_order(urls)
+    return fetch_in_order(urls, WORKERS)
+
+
+def uses_schedule():
+    # Offline reads follow next_published_date, which finds every cached
+    # week whichever mode fetched it
+    return not OFFLINE and (WORKERS > 1 or ENGINE == 'async')
+
+
+def iter_scheduled_number_one_pages(published_date, end, applied):
+    dates = list(weekly_schedule(published_date, end))
+    pages = fetch_pages(map(overview_url, dates))
+    # A scheduled date is searched forward to the closest list, so a week
+    # is labelled with the date it was published and a page that resolved
+    # to an already applied week is skipped
+    try:
+        for page in pages:
+            results = page['results']
+            if results['published_date'] > applied:
+                applied = results['published_date']
+                print(f'Getting number ones from {applied}')
+                yield applied, results
+            if not results['next_published_date']:
+                break
+    finally:
+        pages.close()
+
+
+def iter_number_one_pages(published_date, end=None):
+    # The first week is always fetched on its own. A scheduled crawl then
+    # starts from its next_published_date, the date a sequential walk asks
+    # for next, so both modes request and cache the same weekly dates.
+    applied = ''
+    while published_date and (end is None or published_date <= end):
+        if applied and uses_schedule():
+            yield from iter_scheduled_number_one_pages(
+                published_date, end, applied
+            )
+            return
         print(f'Getting number ones from {published_date}')
+        results = api_call(overview_url(published_date))['results']
+        applied = results['published_date']
+        yield applied, results
+        published_date = results['next_published_date']
+
+
+def iter_scheduled_audio_best_seller_pages(published_date, end, applied,
+                                           categories):
+    dates = list(weekly_schedule(published_date, end))
+    pages = fetch_pages(
+        audio_url(published_date, category)
+        for published_date in dates for category in categories
+    )
+    try:
+        for _ in dates:
+            results = [
+                (category, next(pages)['results'])
+                for category in categories
+            ]
+            if results[-1][1]['published_date'] > applied:
+                applied = results[-1][1]['published_date']
+                print(f'Getting audio best sellers from {applied}')
+                yield applied, results
+            if not results[-1][1]['next_published_date']:
+                break
+    finally:
+        pages.close()
+
+
+def iter_audio_best_seller_pages(
+    published_date, end=None, categories=AUDIO_CATEGORIES
+):
+    applied = ''
+    while published_date and (end is None or published_date <= end):
+        if applied and uses_schedule():
+            yield from iter_scheduled_audio_best_seller_pages(
+                published_date, end, applied, categories
+            )
+            return
+        print(f'Getting audio best sellers from {published_date}')
+        results = []
+        for category in categories:
+            page = api_call(audio_url(published_date, category))
+            results.append((category, page['results']))
+        applied = results[-1][1]['published_date']
+        yield applied, results
+        published_date = results[-1][1]['next_published_date']
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_book(contributor, title):
+    from titlecase import titlecase
+    author = contributor.strip()
+    title = titlecase(title.strip())
+
+    if author.startswith('by '):
+        author = author[3:].strip()
 
-        url = 'https://api.nytimes.com/svc/books/v3/lists/overview.json'
-        url += f'?published_date={published_date}&api-key={API_KEY}'
+    return author, title
 
-        results = api_call(url)['results']
 
+def book_isbns(book):
+    isbns = {book.get('primary_isbn13')}
+    isbns.update(isbn.get('isbn13') for isbn in book.get('isbns', []))
+    return sorted(isbn for isbn in isbns if isbn)
+
+
+def normalization_stats():
+    cache_info = normalize_book.cache_info()
+    lookups = cache_info.hits + cache_info.misses
+    return {
+        'hits': cache_info.hits,
+        'misses': cache_info.misses,
+        'hit_rate': cache_info.hits / lookups if lookups else 0.0,
+        'size': cache_info.currsize
+    }
+
+
+def overview_records(published_date, results):
+    records = []
+    with METRICS.timer('crawl_phase_seconds_total', phase='normalize'):
         for list_ in results['lists']:
-            author = list_['books'][0]['contributor'].strip()
-            title = titlecase(list_['books'][0]['title'].strip())
+            book = list_['books'][0]
+            author, title = normalize_book(book['contributor'], book['title'])
+            records.append(
+                Book(author, title, published_date, isbns=book_isbns(book))
+            )
+    return records
 
-            if author.startswith('by '):
-                author = author[3:].strip()
 
-            if not any(
-                number_one['author'] == author and number_one['title'] == title
-                for number_one in best_sellers['number_ones']
-            ):
-                best_sellers['number_ones'].append({
-                    'author': author,
-                    'title': title,
-                    'date': published_date
-                })
+def audio_records(published_date, results):
+    records = []
+    with METRICS.timer('crawl_phase_seconds_total', phase='normalize'):
+        for category, category_results in results:
+            for book in category_results['books']:
+                author, title = normalize_book(
+                    book['contributor'], book['title']
+                )
+                records.append(Book(
+                    author, title, published_date, category, book_isbns(book)
+                ))
+    return records
+
+
+def iter_overview_weeks(start=FIRST_NYT_N1_DATE, end=None):
+    for published_date, results in iter_number_one_pages(start, end):
+        yield published_date, overview_records(published_date, results)
+
+
+def iter_audio_weeks(category=None, start=FIRST_NYT_ABS_DATE, end=None):
+    categories = AUDIO_CATEGORIES if category is None else [category]
+    pages = iter_audio_best_seller_pages(start, end, categories)
+    for published_date, results in pages:
+        yield published_date, audio_records(published_date, results)
+
+
+def new_books(books, index):
+    new = []
+    for book in books:
+        key = book_key(book)
+        if key not in index:
+            index[key] = book
+            new.append(book)
+    return new
+
+
+def dedup_week(section, published_date, books, index):
+    new = new_books(books, index)
+    deduped = len(books) - len(new)
+    METRICS.inc(
+        'crawl_records_total', len(new), section=section, outcome='added'
+    )
+    METRICS.inc(
+        'crawl_records_total', deduped, section=section, outcome='deduped'
+    )
+    METRICS.log(
+        'week', section=section, published_date=published_date,
+        added=len(new), deduped=deduped
+    )
+    return new
+
+
+def iter_new_books(weeks, index, section=None):
+    # With a section, each week's added and deduped records are counted
+    for published_date, books in weeks:
+        if section is None:
+            yield published_date, new_books(books, index)
+        else:
+            yield published_date, dedup_week(
+                section, published_date, books, index
+            )
+
+
+def add_number_ones(best_sellers, published_date, books):
+    with STATE_LOCK:
+        best_sellers['number_ones'].extend(books)
         best_sellers['_number_ones_last_updated'] = published_date
         save_best_seller_file(best_sellers)
-        published_date = results['next_published_date']
-    retrieve_audio_best_sellers(best_sellers)
 
 
-def retrieve_audio_best_sellers(best_sellers):
+def add_audio_best_sellers(best_sellers, published_date, books):
+    with STATE_LOCK:
+        best_sellers['audio_best_sellers'].extend(books)
+        best_sellers['_audio_best_sellers_last_updated'] = published_date
+        save_best_seller_file(best_sellers)
+
+
+def retrieve_number_ones(best_sellers, end=None):
+    published_date = best_sellers.get(
+        '_number_ones_last_updated', FIRST_NYT_N1_DATE
+    )
+    index = book_index(best_sellers, 'number_ones')
+    weeks = iter_new_books(
+        iter_overview_weeks(published_date, end), index, 'number_ones'
+    )
+    try:
+        for published_date, books in weeks:
+            add_number_ones(best_sellers, published_date, books)
+    except CacheMiss as error:
+        print(f'Stopping number ones: {error}')
+
+
+def retrieve_audio_best_sellers(best_sellers, end=None):
     published_date = best_sellers.get(
         '_audio_best_sellers_last_updated', FIRST_NYT_ABS_DATE
     )
-    while published_date:
-        print(f'Getting audio best sellers from {published_date}')
-        for category in ['Fiction', 'Nonfiction']:
+    index = book_index(best_sellers, 'audio_best_sellers')
+    weeks = iter_new_books(
+        iter_audio_weeks(start=published_date, end=end), index,
+        'audio_best_sellers'
+    )
+    try:
+        for published_date, books in weeks:
+            add_audio_best_sellers(best_sellers, published_date, books)
+    except CacheMiss as error:
+        print(f'Stopping audio best sellers: {error}')
+
+
+def is_up_to_date(published_date, cursor, changed):
+    # The week at the cursor is only applied again if its content changed
+    return published_date < cursor or (
+        published_date == cursor and not changed
+    )
+
+
+def walked_to(best_sellers, cursor_key, previous_published_date):
+    # A walk that stopped early (a cache miss, or a cached week without a
+    # next date) would leave a gap if the newest week were applied after it
+    cursor = best_sellers.get(cursor_key)
+    if cursor is not None and cursor >= previous_published_date:
+        return True
+    print(f'Missed weeks stop at {cursor}, before {previous_published_date}; '
+          'not applying the newest week')
+    return False
+
+
+def refresh_number_ones(best_sellers):
+    # Jumps to the newest overview instead of walking from the cursor;
+    # weeks missed since the last run are still walked
+    cursor = best_sellers.get('_number_ones_last_updated', FIRST_NYT_N1_DATE)
+    print('Refreshing number ones')
+    results, changed = refresh_call(current_overview_url())
+    published_date = results['published_date']
+    if is_up_to_date(published_date, cursor, changed):
+        print(f'Number ones are up to date ({published_date})')
+        return
+    previous_published_date = results['previous_published_date']
+    if previous_published_date > cursor:
+        retrieve_number_ones(best_sellers, previous_published_date)
+        if not walked_to(best_sellers, '_number_ones_last_updated',
+                         previous_published_date):
+            return
+    books = overview_records(published_date, results)
+    add_number_ones(best_sellers, published_date, dedup_week(
+        'number_ones', published_date, books,
+        book_index(best_sellers, 'number_ones')
+    ))
+
+
+def refresh_audio_best_sellers(best_sellers):
+    cursor = best_sellers.get(
+        '_audio_best_sellers_last_updated', FIRST_NYT_ABS_DATE
+    )
+    print('Refreshing audio best sellers')
+    results = []
+    changed = False
+    for category in AUDIO_CATEGORIES:
+        category_results, category_changed = refresh_call(
+            audio_url('current', category)
+        )
+        results.append((category, category_results))
+        changed = changed or category_changed
+    published_date = results[-1][1]['published_date']
+    if is_up_to_date(published_date, cursor, changed):
+        print(f'Audio best sellers are up to date ({published_date})')
+        return
+    previous_published_date = results[-1][1]['previous_published_date']
+    if previous_published_date > cursor:
+        retrieve_audio_best_sellers(best_sellers, previous_published_date)
+        if not walked_to(best_sellers, '_audio_best_sellers_last_updated',
+                         previous_published_date):
+            return
+    books = audio_records(published_date, results)
+    add_audio_best_sellers(best_sellers, published_date, dedup_week(
+        'audio_best_sellers', published_date, books,
+        book_index(best_sellers, 'audio_best_sellers')
+    ))
+
 
-            url = f"https://api.nytimes.com/svc/books/v3/lists/"
-            url += f"{published_date}/audio-{category}.json?api-key={API_KEY}"
+def get_rankings():
+    global RANKINGS
+    if RANKINGS is None:
+        RANKINGS = RankingStore().load()
+    return RANKINGS
 
-            results = api_call(url)['results']
 
-            for book in results['books']:
-                author = book['contributor'].strip()
-                title = titlecase(book['title'].strip())
+def ranking_rows(books):
+    rows = []
+    for book in books:
+        author, title = normalize_book(book['contributor'], book['title'])
+        rows.append({
+            'rank': book['rank'],
+            'weeks_on_list': book['weeks_on_list'],
+            'isbn13': book.get('primary_isbn13') or '',
+            'author': author,
+            'title': title
+        })
+    return rows
 
-                if author.startswith('by '):
-                    author = author[3:].strip()
 
-                if not any(
-                    audio_best_seller['author'] == author and
-                    audio_best_seller['title'] == title
-                    for audio_best_seller in best_sellers['audio_best_sellers']
+def uses_full_overview(lists):
+    # full-overview.json returns every weekly list in one call, so it wins
+    # as soon as more than one list is wanted; a single list is the same
+    # one call through its own, much smaller, endpoint
+    return lists == ALL_LISTS or len(lists) > 1
+
+
+def fetch_ranked_lists(published_date, lists, rankings):
+    fetched = {}
+    next_published_date = ''
+    results = None
+    if uses_full_overview(lists):
+        results = api_call(full_overview_url(published_date))['results']
+        next_published_date = results['next_published_date']
+        for list_ in results['lists']:
+            list_name = list_['list_name_encoded']
+            if lists == ALL_LISTS or list_name in lists:
+                fetched[list_name] = (
+                    results['published_date'], ranking_rows(list_['books'])
+                )
+    if lists != ALL_LISTS:
+        # Lists missing from the overview, e.g. monthly lists between
+        # their publication dates, are fetched one by one unless the list
+        # they would return is already stored. Without an overview the
+        # first list is always fetched, as its page has the next week.
+        for list_name in lists:
+            if list_name in fetched or (
+                results is not None and rankings.has(list_name, published_date)
+            ):
+                continue
+            results = api_call(list_url(published_date, list_name))['results']
+            next_published_date = (
+                next_published_date or results['next_published_date']
+            )
+            fetched[list_name] = (
+                results['published_date'], ranking_rows(results['books'])
+            )
+    return next_published_date, fetched
+
+
+def iter_ranking_weeks(lists, start=FIRST_NYT_N1_DATE, end=None,
+                       rankings=None):
+    if rankings is None:
+        rankings = get_rankings()
+    published_date = start
+    while published_date and (end is None or published_date <= end):
+        print(f'Getting ranked lists from {published_date}')
+        next_published_date, fetched = fetch_ranked_lists(
+            published_date, lists, rankings
+        )
+        yield published_date, fetched
+        published_date = next_published_date
+
+
+def retrieve_rankings(best_sellers):
+    if RANKED_LISTS is None:
+        return
+    rankings = get_rankings()
+    published_date = best_sellers.get(
+        '_rankings_last_updated', FIRST_NYT_N1_DATE
+    )
+    weeks = iter_ranking_weeks(RANKED_LISTS, published_date, None, rankings)
+    try:
+        for published_date, lists in weeks:
+            rankings.append_week(published_date, lists)
+            with STATE_LOCK:
+                best_sellers['_rankings_last_updated'] = published_date
+                save_best_seller_file(best_sellers)
+    except CacheMiss as error:
+        print(f'Stopping rankings: {error}')
+
+
+class AsyncApi:
+
+    def __init__(self, client, workers):
+        import asyncio
+        self.client = client
+        self.workers = workers
+        self.in_flight = asyncio.Semaphore(workers)
+
+    async def call(self, call_url):
+        import asyncio
+        import httpx
+        content = cached_content(call_url)
+        if content is not None:
+            METRICS.inc('nyt_cache_hits_total')
+            return serializers.loads(content)
+        for attempt in range(MAX_RETRIES + 1):
+            async with self.in_flight:
+                with METRICS.timer(
+                    'crawl_phase_seconds_total', phase='rate_limit'
                 ):
-                    best_sellers['audio_best_sellers'].append({
-                        'author': author,
-                        'title': title,
-                        'date': published_date,
-                        'category': category
-                    })
-        best_sellers['_audio_best_sellers_last_updated'] = published_date
-        save_best_seller_file(best_sellers)
-        published_date = results['next_published_date']
-    create_reading_list(best_sellers)
+                    api_key = await RATE_LIMITER.acquire_async()
+                request_url = keyed_url(call_url, api_key)
+                started = METRICS.clock()
+                try:
+                    response = await self.client.get(request_url)
+                except httpx.TransportError as error:
+                    delay = retry_after(
+                        call_url, api_key, attempt, started, error=error
+                    )
+                else:
+                    delay = retry_after(
+                        call_url, api_key, attempt, started, response
+                    )
+                    if delay is None:
+                        value = serializers.loads(response.content)
+                        cache_content(call_url, response.content, value)
+                        return value
+            with METRICS.timer('crawl_phase_seconds_total', phase='backoff'):
+                await asyncio.sleep(delay)
+
+    async def fetch_in_order(self, urls):
+        import asyncio
+        pending = collections.deque()
+        try:
+            for url in urls:
+                pending.append(asyncio.ensure_future(self.call(url)))
+                if len(pending) >= 2 * self.workers:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+def async_fetch_in_order(urls):
+    # The async engine as a plain iterator: the event loop runs whenever
+    # the next response is asked for, and requests keep flying in the
+    # background in the meantime, so the crawl loop is the same for both
+    # engines
+    import asyncio
+    import httpx
+    loop = asyncio.new_event_loop()
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=WORKERS)
+    )
+    pages = AsyncApi(client, WORKERS).fetch_in_order(urls)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(pages.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(pages.aclose())
+        # Let the calls cancelled by an early stop finish unwinding
+        cancelled = asyncio.all_tasks(loop)
+        if cancelled:
+            loop.run_until_complete(asyncio.wait(cancelled))
+        loop.run_until_complete(client.aclose())
+        loop.close()
+
+
+def crawl_number_ones(best_sellers):
+    if REFRESH:
+        refresh_number_ones(best_sellers)
+    else:
+        retrieve_number_ones(best_sellers)
+
+
+def crawl_audio_best_sellers(best_sellers):
+    if REFRESH:
+        refresh_audio_best_sellers(best_sellers)
+    else:
+        retrieve_audio_best_sellers(best_sellers)
+
+
+MATCH_PRECEDENCE = {'fuzzy': 0, 'exact': 1, 'isbn': 2}
+
 
+def reading_list_entry(audio_best_seller, match):
+    number_one, confidence, method = match
+    return {
+        'author': audio_best_seller['author'],
+        'title': audio_best_seller['title'],
+        'date': max(number_one['date'], audio_best_seller['date']),
+        'category': audio_best_seller['category'],
+        'match': method,
+        'confidence': confidence
+    }
 
-def create_reading_list(best_sellers):
-    reading_list = []
+
+def iter_reading_list(best_sellers):
+    number_ones = BookMatcher(best_sellers['number_ones'])
     for audio_best_seller in best_sellers['audio_best_sellers']:
-        if any(
-            number_one['author'] == audio_best_seller['author'] and
-            number_one['title'] == audio_best_seller['title']
-            for number_one in best_sellers['number_ones']
-        ):
-            number_one = next(
-                number_one for number_one in best_sellers['number_ones']
-                if number_one['author'] == audio_best_seller['author'] and
-                number_one['title'] == audio_best_seller['title']
-            )
-            reading_list.append({
-                'author': audio_best_seller['author'],
-                'title': audio_best_seller['title'],
-                'date': max(number_one['date'], audio_best_seller['date']),
-                'category': audio_best_seller['category']
-            })
-
-    for book in reading_list:
-        print(
-            f"{book['author']}, {book['title']}, {book['date']}, "
-            f"{book['category']}"
+        match = number_ones.match(audio_best_seller)
+        if match is not None:
+            yield reading_list_entry(audio_best_seller, match)
+
+
+def is_better_match(match, entry):
+    # ISBN matches beat exact ones, which beat fuzzy ones, and fuzzy ones
+    # are compared on confidence. A tie keeps the entry, whose number one
+    # came first, as a full rebuild would.
+    if match is None:
+        return False
+    if entry is None:
+        return True
+    _, confidence, method = match
+    return (MATCH_PRECEDENCE[method], confidence) > (
+        MATCH_PRECEDENCE[entry.get('match', 'exact')],
+        entry.get('confidence', 1.0)
+    )
+
+
+def audio_indexes(reading_list, audio_best_sellers):
+    # The reading list follows audio order, so each entry is taken to be
+    # the first audio best seller with its key after the previous entry's
+    occurrences = {}
+    for index, audio_best_seller in enumerate(audio_best_sellers):
+        occurrences.setdefault(book_key(audio_best_seller), []).append(index)
+    indexes = []
+    for entry in reading_list:
+        previous = indexes[-1] if indexes else -1
+        candidates = occurrences.get(book_key(entry), [])
+        position = bisect.bisect_right(candidates, previous)
+        indexes.append(
+            candidates[position] if position < len(candidates) else previous
         )
+    return indexes
+
+
+def update_reading_list(reading_list, number_ones, audio_best_sellers,
+                        number_ones_done=0, audio_best_sellers_done=0):
+    # The first number_ones_done number ones and audio_best_sellers_done
+    # audio best sellers are already joined into reading_list. The new
+    # number ones are probed against an index of the audio best sellers
+    # seen before, and only those they find are matched again. New audio
+    # best sellers are matched against all number ones. Entries are
+    # added or replaced where a full rebuild would put them, and the
+    # changes are returned as (entry, updated) pairs.
+    changes = []
+    if number_ones_done < len(number_ones):
+        old_audio_best_sellers = audio_best_sellers[:audio_best_sellers_done]
+        audio_index = BookMatcher(old_audio_best_sellers)
+        found = set()
+        for number_one in number_ones[number_ones_done:]:
+            found.update(map(id, audio_index.matched_by(number_one)))
+        rematched = [
+            index for index, audio_best_seller
+            in enumerate(old_audio_best_sellers)
+            if id(audio_best_seller) in found
+        ]
+        if rematched:
+            new_number_ones = BookMatcher(number_ones[number_ones_done:])
+            indexes = audio_indexes(reading_list, audio_best_sellers)
+        for index in rematched:
+            audio_best_seller = audio_best_sellers[index]
+            position = bisect.bisect_left(indexes, index)
+            entry = None
+            if position < len(indexes) and indexes[position] == index:
+                entry = reading_list[position]
+            if entry is not None and entry.get('match', 'exact') == 'isbn':
+                continue
+            match = new_number_ones.match(audio_best_seller)
+            if not is_better_match(match, entry):
+                continue
+            new_entry = reading_list_entry(audio_best_seller, match)
+            if entry is None:
+                reading_list.insert(position, new_entry)
+                indexes.insert(position, index)
+            else:
+                reading_list[position] = new_entry
+            changes.append((new_entry, entry is not None))
+    if audio_best_sellers_done < len(audio_best_sellers):
+        all_number_ones = BookMatcher(number_ones)
+        for audio_best_seller in audio_best_sellers[audio_best_sellers_done:]:
+            match = all_number_ones.match(audio_best_seller)
+            if match is not None:
+                entry = reading_list_entry(audio_best_seller, match)
+                reading_list.append(entry)
+                changes.append((entry, False))
+    return changes
+
+
+def reading_list_line(book):
+    line = (
+        f"{book['author']}, {book['title']}, {book['date']}, "
+        f"{book['category']}"
+    )
+    if book.get('match') == 'fuzzy':
+        line += f" (fuzzy match, confidence {book['confidence']})"
+    return line
+
+
+def create_reading_list(best_sellers, outfile=None):
+    # Only books added since the reading list was last built are joined,
+    # and only the entries this adds or updates are printed. Anything that
+    # can't be continued, e.g. lists that were merged from shards, is
+    # rebuilt from scratch.
+    if outfile is None:
+        outfile = READING_LIST_OUTPUT
+    number_ones = best_sellers['number_ones']
+    audio_best_sellers = best_sellers['audio_best_sellers']
+    reading_list = best_sellers.get('reading_list')
+    # Counts come back as strings from the sqlite cursors table
+    number_ones_done = int(best_sellers.get('_reading_list_number_ones', -1))
+    audio_best_sellers_done = int(
+        best_sellers.get('_reading_list_audio_best_sellers', -1)
+    )
+    if (
+        reading_list is None or
+        not 0 <= number_ones_done <= len(number_ones) or
+        not 0 <= audio_best_sellers_done <= len(audio_best_sellers)
+    ):
+        reading_list, number_ones_done, audio_best_sellers_done = [], 0, 0
+    changes = update_reading_list(
+        reading_list, number_ones, audio_best_sellers, number_ones_done,
+        audio_best_sellers_done
+    )
+    for book, updated in changes:
+        line = reading_list_line(book)
+        if updated:
+            line += ' (updated)'
+        print(line, file=outfile)
+
+    with STATE_LOCK:
+        best_sellers['reading_list'] = reading_list
+        best_sellers['_reading_list_number_ones'] = len(number_ones)
+        best_sellers['_reading_list_audio_best_sellers'] = len(
+            audio_best_sellers
+        )
+        save_best_seller_file(best_sellers)
+
+
+Stage = collections.namedtuple(
+    'Stage', ['run', 'depends_on', 'sections', 'default'], defaults=[True]
+)
+
+STAGES = {
+    'number-ones': Stage(crawl_number_ones, [], ['number_ones']),
+    'audio-best-sellers': Stage(
+        crawl_audio_best_sellers, [], ['audio_best_sellers']
+    ),
+    'reading-list': Stage(
+        create_reading_list, ['number-ones', 'audio-best-sellers'],
+        ['number_ones', 'audio_best_sellers', 'reading_list']
+    ),
+    'rankings': Stage(retrieve_rankings, [], [], default=False),
+}
+
+
+def default_stages():
+    return [name for name, stage in STAGES.items() if stage.default]
+
+
+def stage_sections(only):
+    return {
+        section for name in only for section in STAGES[name].sections
+    }
+
+
+def write_metrics():
+    if METRICS_FILE is not None:
+        METRICS.write_textfile(METRICS_FILE)
+
+
+def run_stage(best_sellers, name):
+    print(f'Running stage {name}')
+    started = METRICS.clock()
+    STAGES[name].run(best_sellers)
+    METRICS.log('stage', name=name, seconds=METRICS.clock() - started)
+    write_metrics()
+
+
+def run_pipeline(best_sellers, only=None):
+    # Stages run in waves: every stage whose dependencies within the
+    # selected set have completed runs concurrently with the others in its
+    # wave. Dependencies left out with only are assumed to be up to date in
+    # storage.
+    if only is None:
+        only = default_stages()
+    selected = [name for name in STAGES if name in only]
+    completed = set()
+    with concurrent.futures.ThreadPoolExecutor(len(selected) or 1) as pool:
+        while len(completed) < len(selected):
+            wave = [
+                name for name in selected
+                if name not in completed and all(
+                    dependency in completed or dependency not in selected
+                    for dependency in STAGES[name].depends_on
+                )
+            ]
+            for future in [
+                pool.submit(run_stage, best_sellers, name) for name in wave
+            ]:
+                future.result()
+            completed.update(wave)
 
-    best_sellers['reading_list'] = reading_list
+
+def rebuild_offline(only):
+    # The lists crawled by the selected stages are rebuilt from cached
+    # responses in memory. They replace the stored ones only once every
+    # rebuilt crawl has caught up with its stored cursor, so history that
+    # was never cached can't be lost; otherwise storage is left untouched.
+    global STORAGE
+    print('Rebuilding best sellers from cached responses only')
+    stored = STORAGE.load() or {}
+    rebuilt = stage_sections(name for name in only if name != 'reading-list')
+    cursors = {section: f'_{section}_last_updated' for section in rebuilt}
+    # The reading list is rebuilt in full from the new lists
+    dropped = {*rebuilt, *cursors.values(), 'reading_list'}
+    best_sellers = BestSellers({
+        key: value for key, value in stored.items()
+        if key not in dropped and not key.startswith('_reading_list_')
+    })
+    for section in SECTIONS:
+        best_sellers.setdefault(section, [])
+    storage, STORAGE = STORAGE, NullStorage()
+    try:
+        run_pipeline(best_sellers, only)
+    finally:
+        STORAGE = storage
+    behind = [
+        f"{section} ({best_sellers.get(cursor) or 'nothing'} of "
+        f"{stored[cursor]})"
+        for section, cursor in sorted(cursors.items())
+        if best_sellers.get(cursor, '') < stored.get(cursor, '')
+    ]
+    if behind:
+        sys.exit(
+            f"The cache could not rebuild {', '.join(behind)}; stored best "
+            f"sellers were left untouched"
+        )
+    STORAGE.reset()
     save_best_seller_file(best_sellers)
+    return best_sellers
+
+
+def shard_ranges(start, end, shards):
+    # The API searches forward to the closest list on or after a requested
+    # date, so each shard ends the day before the next one starts and every
+    # list falls in exactly one shard
+    dates = list(weekly_schedule(start, end))
+    shards = max(min(shards, len(dates)), 1)
+    starts = [dates[len(dates) * shard // shards] for shard in range(shards)]
+    ends = [
+        (
+            datetime.date.fromisoformat(next_start) - datetime.timedelta(1)
+        ).isoformat()
+        for next_start in starts[1:]
+    ] + [end]
+    return list(zip(starts, ends))
+
+
+def shard_path(shard):
+    return os.path.join(SHARD_DIR, f'shard-{shard}.json')
+
+
+def init_shard_worker(api_keys, keys, workers, use_cache):
+    # Each worker owns one key and keeps its state in the file the key
+    # pool of a normal crawl with the same keys would use
+    global API_KEY, RATE_LIMITER, RESPONSE_CACHE, WORKERS
+    API_KEY = api_keys.get()
+    WORKERS = workers
+    RESPONSE_CACHE = ResponseCache() if use_cache else None
+    RATE_LIMITER = RateLimiter(RATE_LIMITER.limits)
+    RATE_LIMITER.persist_to(pool_state_file(RATE_LIMIT_FILE, API_KEY, keys))
+
+
+def run_shard(shard, shards, end):
+    global STORAGE
+    number_ones_ranges = shard_ranges(FIRST_NYT_N1_DATE, end, shards)
+    number_ones_start, number_ones_end = number_ones_ranges[shard]
+    audio_ranges = shard_ranges(FIRST_NYT_ABS_DATE, end, shards)
+    audio_start, audio_end = audio_ranges[shard]
+    STORAGE = JsonStorage(shard_path(shard))
+    best_sellers = STORAGE.load() or {
+        'number_ones': [],
+        'audio_best_sellers': [],
+        '_number_ones_last_updated': number_ones_start,
+        '_audio_best_sellers_last_updated': audio_start
+    }
+    best_sellers = BestSellers(best_sellers)
+    print(
+        f'Shard {shard}: number ones {number_ones_start} to '
+        f'{number_ones_end}, audio best sellers {audio_start} to {audio_end}'
+    )
+    retrieve_number_ones(best_sellers, number_ones_end)
+    retrieve_audio_best_sellers(best_sellers, audio_end)
+    best_sellers['_completed'] = True
+    save_best_seller_file(best_sellers)
+
+
+def run_shards(shards, only=None, end=None):
+    if end is None:
+        end = datetime.date.today().isoformat()
+    import multiprocessing
+    selected = range(shards) if only is None else [only]
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    api_keys = multiprocessing.Queue()
+    for api_key in API_KEYS:
+        api_keys.put(api_key)
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        min(len(API_KEYS), len(selected)),
+        initializer=init_shard_worker,
+        initargs=(api_keys, len(API_KEYS), WORKERS, RESPONSE_CACHE is not None)
+    ) as pool:
+        futures = {
+            pool.submit(run_shard, shard, shards, end): shard
+            for shard in selected
+        }
+        for future in concurrent.futures.as_completed(futures):
+            shard = futures[future]
+            try:
+                future.result()
+            except Exception as error:
+                failed.append(shard)
+                print(
+                    f'Shard {shard} failed ({error!r}), rerun it with '
+                    f'--shards {shards} --shard {shard}'
+                )
+    return sorted(failed)
+
+
+def merge_shards(best_sellers, shards):
+    # The earliest date wins for books found by more than one shard. Cursors
+    # only advance over the leading run of completed shards, so a failed
+    # shard is recrawled by the next normal run if it is not rerun
+    shard_states = [
+        JsonStorage(shard_path(shard)).load() for shard in range(shards)
+    ]
+    for section in ['number_ones', 'audio_best_sellers']:
+        index = index_books(best_sellers.get(section, []))
+        for shard_state in shard_states:
+            if shard_state is None:
+                continue
+            for book in to_books(shard_state[section]):
+                key = book_key(book)
+                if key not in index or book['date'] < index[key]['date']:
+                    index[key] = book
+        best_sellers[section] = sorted(
+            index.values(), key=lambda book: book['date']
+        )
+        cursor = f'_{section}_last_updated'
+        for shard_state in shard_states:
+            if shard_state is None or not shard_state.get('_completed'):
+                break
+            best_sellers[cursor] = max(
+                best_sellers.get(cursor, ''), shard_state[cursor]
+            )
+    if isinstance(best_sellers, BestSellers):
+        best_sellers.indexes.clear()
+    # Merged lists are re-sorted, so the reading list is rebuilt in full
+    best_sellers.pop('_reading_list_number_ones', None)
+    best_sellers.pop('_reading_list_audio_best_sellers', None)
+    STORAGE.reset()
+    save_best_seller_file(best_sellers)
+
+
+def crawl(args):
+    global ENGINE, METRICS_FILE, OFFLINE, RANKED_LISTS, READING_LIST_OUTPUT
+    global REFRESH, RESPONSE_CACHE, WORKERS
+    READING_LIST_OUTPUT = args.output
+    WORKERS = args.workers
+    RATE_LIMITER.persist_to(RATE_LIMIT_FILE)
+    ENGINE = args.engine
+    if args.lists == ALL_LISTS:
+        RANKED_LISTS = ALL_LISTS
+    elif args.lists:
+        RANKED_LISTS = args.lists.split(',')
+    OFFLINE = args.offline
+    REFRESH = args.refresh
+    if not args.no_cache:
+        RESPONSE_CACHE = ResponseCache()
+    METRICS_FILE = args.metrics_file
+    METRICS.log_stream = args.log_file
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = METRICS.serve(args.metrics_port)
+    try:
+        if args.compact:
+            JournalStorage().compact()
+        else:
+            if args.shards:
+                best_sellers = load_best_seller_file()
+                run_shards(args.shards, args.shard)
+                merge_shards(best_sellers, args.shards)
+                run_pipeline(best_sellers, ['reading-list'])
+            else:
+                only = args.only or default_stages()
+                if args.lists and not args.only:
+                    only.append('rankings')
+                if args.offline:
+                    best_sellers = rebuild_offline(only)
+                else:
+                    best_sellers = load_best_seller_file(stage_sections(only))
+                    run_pipeline(best_sellers, only)
+            STORAGE.compact(best_sellers)
+            cache_stats = normalization_stats()
+            print(
+                f"Normalization cache: {cache_stats['hits']} hits, "
+                f"{cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.0%})"
+            )
+    finally:
+        if RANKINGS is not None:
+            RANKINGS.close()
+        if args.output is not None:
+            args.output.close()
+        write_metrics()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        if args.log_file is not None:
+            args.log_file.close()
+
+
+def print_reading_list(args):
+    best_sellers = STORAGE.load(['reading_list'], seed=False) or {}
+    for book in best_sellers.get('reading_list', []):
+        print(reading_list_line(book), file=args.output)
+
+
+def export(args):
+    best_sellers = STORAGE.load([args.section], seed=False) or {}
+    books = best_sellers.get(args.section, [])
+    if args.format == 'json':
+        args.output.write(serializers.dumps(books, pretty=True).decode())
+        args.output.write('\n')
+        return
+    columns = SqliteStorage.COLUMNS[args.section]
+    writer = csv.writer(args.output)
+    writer.writerow(columns)
+    for book in books:
+        writer.writerow([
+            ' '.join(book.get(column, ())) if column == 'isbns'
+            else book.get(column, '')
+            for column in columns
+        ])
+
+
+def stats(args):
+    best_sellers = STORAGE.load(seed=False) or {}
+    report = {
+        section: len(best_sellers.get(section, []))
+        for section in [*SECTIONS, 'reading_list']
+    }
+    report.update(
+        (key, value) for key, value in best_sellers.items()
+        if key.startswith('_')
+    )
+    print(serializers.dumps(report, pretty=True).decode())
+
+
+COMMANDS = {
+    'crawl': crawl,
+    'reading-list': print_reading_list,
+    'export': export,
+    'stats': stats,
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description='Find NYT number ones that are also audio best sellers'
+    )
+    storage_parser = argparse.ArgumentParser(add_help=False)
+    storage_parser.add_argument(
+        '--storage', choices=sorted(STORAGE_BACKENDS), default='json',
+        help='json rewrites best_sellers.json on every save, journal appends '
+        'new records to a journal that is compacted at the end of the run, '
+        'snapshot keeps a binary best_sellers.snapshot that is loaded lazily, '
+        'sqlite keeps everything in best_sellers.db'
+    )
+    commands = parser.add_subparsers(
+        dest='command', required=True, metavar='COMMAND'
+    )
+    crawl_parser = commands.add_parser(
+        'crawl', parents=[storage_parser],
+        help='crawl new best sellers and update the reading list (the '
+        'default when only options are given)'
+    )
+    crawl_parser.add_argument(
+        '-o', '--output', type=argparse.FileType('w'),
+        help='stream the reading list to this file instead of stdout'
+    )
+    crawl_parser.add_argument(
+        '--compact', action='store_true',
+        help='fold the journal back into best_sellers.json and exit'
+    )
+    crawl_parser.add_argument(
+        '-w', '--workers', type=int, default=1,
+        help='fetch up to this many weeks ahead in parallel, within the rate '
+        'limit, instead of following next_published_date one call at a time'
+    )
+    crawl_parser.add_argument(
+        '--engine', choices=['async', 'sync'], default='sync',
+        help='async crawls with asyncio and httpx, keeping up to WORKERS '
+        'requests in flight'
+    )
+    crawl_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='do not read or write the on-disk cache of API responses'
+    )
+    crawl_parser.add_argument(
+        '--offline', action='store_true',
+        help='rebuild everything from cached responses without any network '
+        'calls'
+    )
+    crawl_parser.add_argument(
+        '--refresh', action='store_true',
+        help='jump straight to the newest lists with conditional requests '
+        'instead of walking forward from the last crawled week'
+    )
+    crawl_parser.add_argument(
+        '--only', nargs='+', choices=list(STAGES), metavar='STAGE',
+        help=f"run only these stages ({', '.join(STAGES)}), e.g. --only "
+        f"reading-list to rebuild the reading list without crawling"
+    )
+    crawl_parser.add_argument(
+        '--shards', type=int, metavar='N',
+        help='backfill the whole history in N date-range shards run in '
+        'parallel processes, one per key in NYT_API_KEYS, then merge them'
+    )
+    crawl_parser.add_argument(
+        '--shard', type=int, metavar='I',
+        help='with --shards, rerun only shard I (e.g. after it failed)'
+    )
+    crawl_parser.add_argument(
+        '--lists', metavar='LIST[,LIST...]',
+        help="also crawl full ranked entries of these lists (their "
+        "list_name_encoded, e.g. hardcover-fiction,audio-fiction) or of "
+        "'all' weekly lists into rankings.jsonl"
+    )
+    crawl_parser.add_argument(
+        '--metrics-file', metavar='PATH',
+        help='write crawl metrics in the Prometheus text format to PATH after '
+        'every stage, e.g. for the node_exporter textfile collector'
+    )
+    crawl_parser.add_argument(
+        '--metrics-port', type=int, metavar='PORT',
+        help='serve crawl metrics on http://127.0.0.1:PORT/metrics while the '
+        'run lasts'
+    )
+    crawl_parser.add_argument(
+        '--log-file', type=argparse.FileType('a'),
+        help='append structured crawl events (API calls, retries, weeks, '
+        'stages) to this file as JSON lines'
+    )
+    reading_list_parser = commands.add_parser(
+        'reading-list', parents=[storage_parser],
+        help='print the stored reading list'
+    )
+    reading_list_parser.add_argument(
+        '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='write the reading list to this file instead of stdout'
+    )
+    export_parser = commands.add_parser(
+        'export', parents=[storage_parser],
+        help='export a stored list as CSV or JSON'
+    )
+    export_parser.add_argument(
+        'section', nargs='?', default='reading_list',
+        choices=[*SECTIONS, 'reading_list'],
+        help='the list to export (reading_list by default)'
+    )
+    export_parser.add_argument(
+        '--format', choices=['csv', 'json'], default='csv'
+    )
+    export_parser.add_argument(
+        '-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+        help='write the export to this file instead of stdout'
+    )
+    commands.add_parser(
+        'stats', parents=[storage_parser],
+        help='print the size of each stored list and the cursors as JSON'
+    )
+    return parser
+
+
+def main(argv=None):
+    # Only crawl needs an API key or imports the network stack, so the
+    # read-only commands start quickly, e.g. from hooks and cron
+    global STORAGE
+    parser = build_parser()
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv or (
+        argv[0].startswith('-') and argv[0] not in ['-h', '--help']
+    ):
+        # Bare options run a crawl, as they did before there were commands
+        argv = ['crawl', *argv]
+    args = parser.parse_args(argv)
+    if args.command == 'crawl':
+        if args.offline and args.no_cache:
+            parser.error('--offline needs the response cache')
+        if args.shard is not None and not args.shards:
+            parser.error('--shard needs --shards')
+        if args.shards and args.offline:
+            parser.error('--shards cannot be combined with --offline')
+        if args.refresh and (args.offline or args.shards):
+            parser.error(
+                '--refresh cannot be combined with --offline or --shards'
+            )
+        offline = args.offline or args.compact or (
+            args.only and set(args.only) <= {'reading-list'}
+        )
+        if not API_KEYS and not offline:
+            parser.error('crawl needs NYT_API_KEY or NYT_API_KEYS to be set')
+    STORAGE = STORAGE_BACKENDS[args.storage]()
+    try:
+        COMMANDS[args.command](args)
+    finally:
+        STORAGE.close()
 
 
 if __name__ == '__main__':
-    load_best_seller_file()
+    main()
@@ -0,0 +1,178 @@
+import datetime
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+WEEK = datetime.timedelta(days=7)
+OVERVIEW_PATH = re.compile(r'/svc/books/v3/lists/(full-)?overview\.json$')
+LIST_PATH = re.compile(
+    r'/svc/books/v3/lists/(current|\d{4}-\d{2}-\d{2})/([\w-]+)\.json$'
+)
+
+
+class FakeNytBooks:
+    # Synthetic stand-in for the NYT Books API serving weekly lists between
+    # start and end. Like the real API, a published_date is searched
+    # forward to the closest list on or after it. Books stay on a list for
+    # a few weeks, and the audio lists reuse the titles of the first
+    # overview lists, so the reading-list join has matches to find. Without
+    # a published_date, or with 'current', the newest week is served.
+    # Responses carry an ETag and a matching If-None-Match gets a 304.
+
+    def __init__(self, start='2008-06-08', end=None, lists=18, books=15,
+                 audio_books=15, latency=0.0, error_rate=0.0, retry_after=0,
+                 seed=0):
+        self.start = datetime.date.fromisoformat(start)
+        if end is None:
+            self.end = datetime.date.today()
+        else:
+            self.end = datetime.date.fromisoformat(end)
+        self.lists = lists
+        self.books = books
+        self.audio_books = audio_books
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def week(self, published_date):
+        if published_date == 'current':
+            return max((self.end - self.start) // WEEK, 0)
+        date = datetime.date.fromisoformat(published_date)
+        if date <= self.start:
+            return 0
+        week = -((self.start - date) // WEEK)
+        return week if self.start + week * WEEK <= self.end else None
+
+    def date(self, week):
+        return (self.start + week * WEEK).isoformat()
+
+    def previous_date(self, week):
+        return self.date(week - 1) if week else ''
+
+    def next_date(self, week):
+        if self.start + (week + 1) * WEEK > self.end:
+            return ''
+        return self.date(week + 1)
+
+    def book(self, shelf, rank, week):
+        number = (week + rank) // 4
+        title = f'BOOK {shelf}-{number}'
+        isbn13 = f'978{shelf:04d}{number:06d}'
+        return {
+            'rank': rank + 1,
+            'weeks_on_list': week % 4 + 1,
+            'contributor': f'by Author {(shelf * 7919 + number) % 500}',
+            'title': title,
+            'primary_isbn13': isbn13,
+            'isbns': [{'isbn10': isbn13[3:], 'isbn13': isbn13}]
+        }
+
+    def overview(self, week, full=False):
+        return {
+            'published_date': self.date(week),
+            'previous_published_date': self.previous_date(week),
+            'next_published_date': self.next_date(week),
+            'lists': [
+                {
+                    'list_name_encoded': f'list-{shelf}',
+                    'books': [
+                        self.book(shelf, rank, week)
+                        for rank in range(self.books if full else 1)
+                    ]
+                }
+                for shelf in range(self.lists)
+            ]
+        }
+
+    def list_(self, week, list_name):
+        if list_name.startswith('audio-'):
+            shelf = 0 if list_name == 'audio-Fiction' else 1
+            count = self.audio_books
+        else:
+            shelf = int(list_name.rsplit('-', 1)[-1])
+            count = self.books
+        return {
+            'published_date': self.date(week),
+            'previous_published_date': self.previous_date(week),
+            'next_published_date': self.next_date(week),
+            'list_name_encoded': list_name,
+            'books': [self.book(shelf, rank, week) for rank in range(count)]
+        }
+
+    def respond(self, url, headers=None):
+        # Returns (status, headers, body) for a request path, query and
+        # request headers
+        parsed = urllib.parse.urlsplit(url)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        with self.lock:
+            self.calls += 1
+            throttled = self.random.random() < self.error_rate
+            if throttled:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            return 429, {'Retry-After': str(self.retry_after)}, b'{}'
+        overview = OVERVIEW_PATH.match(parsed.path)
+        list_match = LIST_PATH.match(parsed.path)
+        if overview is not None:
+            week = self.week(query.get('published_date', 'current'))
+            results = None if week is None else self.overview(
+                week, full=overview.group(1) is not None
+            )
+        elif list_match is not None:
+            week = self.week(list_match.group(1))
+            results = None if week is None else self.list_(
+                week, list_match.group(2)
+            )
+        else:
+            return 404, {}, b'{"fault": "not found"}'
+        if results is None:
+            return 404, {}, b'{"fault": "no list found"}'
+        body = json.dumps({'status': 'OK', 'results': results}).encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if (headers or {}).get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'ETag': etag}, body
+
+    def serve(self, host='127.0.0.1', port=0):
+        # Starts a threaded HTTP server in the background and returns it;
+        # its base url is base_url(server)
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, headers, body = fake.respond(
+                    self.path, self.headers
+                )
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}/svc/books/v3'
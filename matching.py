@@ -0,0 +1,151 @@
+import functools
+import re
+import unicodedata
+
+FUZZY_THRESHOLD = 0.8
+TITLE_WEIGHT = 0.7
+STOPWORDS = frozenset({'a', 'an', 'and', 'of', 'the'})
+NAME_SUFFIXES = frozenset({'jr', 'sr', 'ii', 'iii', 'iv', 'md', 'phd'})
+NARRATORS = re.compile(
+    r'[;,(]?\s*\b(read|narrated|performed)\s+by\b.*$', re.IGNORECASE
+)
+AUTHOR_SEPARATORS = re.compile(
+    r'\s*(?:,|;|&|\band\b|\bwith\b)\s*', re.IGNORECASE
+)
+WORDS = re.compile(r'[a-z0-9]+')
+SURNAME_CACHE_SIZE = 16384
+
+
+def words(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ascii', 'ignore').decode().lower().replace("'", '')
+    return WORDS.findall(text)
+
+
+def tokens(text):
+    return frozenset(word for word in words(text) if word not in STOPWORDS)
+
+
+def author_names(author):
+    return AUTHOR_SEPARATORS.split(NARRATORS.sub('', author))
+
+
+def author_tokens(author):
+    return frozenset().union(*map(tokens, author_names(author)))
+
+
+@functools.lru_cache(maxsize=SURNAME_CACHE_SIZE)
+def surnames(author):
+    # Blocking keys: only books sharing an author surname are ever compared.
+    # Cached as authors repeat across thousands of books.
+    keys = set()
+    for name in author_names(author):
+        name_words = [
+            word for word in words(name) if word not in NAME_SUFFIXES
+        ]
+        if name_words:
+            keys.add(name_words[-1])
+    return frozenset(keys)
+
+
+def dice(a, b):
+    if not a and not b:
+        return 1.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def similarity(title, author, other_title, other_author):
+    # Arguments are token sets as returned by tokens and author_tokens
+    return (
+        TITLE_WEIGHT * dice(title, other_title) +
+        (1 - TITLE_WEIGHT) * dice(author, other_author)
+    )
+
+
+class BookMatcher:
+    # Indexes one side of the reading-list join. A book is matched on any
+    # shared ISBN first, then on its exact (author, title), and otherwise
+    # against the indexed books sharing one of its author surnames, scored
+    # on title and author tokens. Blocking keeps the fuzzy pass close to
+    # linear as only a handful of books share a surname. Indexed books are
+    # only tokenized the first time they are compared, so probing a few
+    # books against a large index stays cheap.
+
+    def __init__(self, books=()):
+        self.by_isbn = {}
+        self.by_key = {}
+        self.blocks = {}
+        self.tokens = {}
+        for book in books:
+            self.add(book)
+
+    def add(self, book):
+        for isbn in book.get('isbns', ()):
+            self.by_isbn.setdefault(isbn, []).append(book)
+        self.by_key.setdefault((book['author'], book['title']), []).append(
+            book
+        )
+        for surname in surnames(book['author']):
+            self.blocks.setdefault(surname, []).append(book)
+
+    def book_tokens(self, book):
+        # Keyed by id, which is safe as the blocks keep every book alive
+        if id(book) not in self.tokens:
+            self.tokens[id(book)] = (
+                tokens(book['title']), author_tokens(book['author'])
+            )
+        return self.tokens[id(book)]
+
+    def scores(self, book):
+        # Yields (indexed book, similarity) for every indexed book sharing
+        # one of book's author surnames
+        blocks = [
+            self.blocks[surname] for surname in surnames(book['author'])
+            if surname in self.blocks
+        ]
+        if not blocks:
+            return
+        title_tokens = tokens(book['title'])
+        book_author_tokens = author_tokens(book['author'])
+        seen = set()
+        for block in blocks:
+            for candidate in block:
+                if id(candidate) in seen:
+                    continue
+                seen.add(id(candidate))
+                candidate_title, candidate_author = self.book_tokens(candidate)
+                yield candidate, similarity(
+                    title_tokens, book_author_tokens,
+                    candidate_title, candidate_author
+                )
+
+    def match(self, book):
+        # Returns (matched book, confidence, method) or None
+        for isbn in book.get('isbns', ()):
+            if isbn in self.by_isbn:
+                return self.by_isbn[isbn][0], 1.0, 'isbn'
+        exact = self.by_key.get((book['author'], book['title']))
+        if exact is not None:
+            return exact[0], 1.0, 'exact'
+        best, best_score = None, 0.0
+        for candidate, score in self.scores(book):
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is None or best_score < FUZZY_THRESHOLD:
+            return None
+        return best, round(best_score, 3), 'fuzzy'
+
+    def matched_by(self, book):
+        # Returns every indexed book that would find book if book were
+        # indexed instead, i.e. the join run the other way round. ISBN,
+        # exact and fuzzy matches are all symmetric.
+        found = {}
+        for isbn in book.get('isbns', ()):
+            for candidate in self.by_isbn.get(isbn, ()):
+                found[id(candidate)] = candidate
+        for candidate in self.by_key.get((book['author'], book['title']), ()):
+            found[id(candidate)] = candidate
+        for candidate, score in self.scores(book):
+            if score >= FUZZY_THRESHOLD:
+                found[id(candidate)] = candidate
+        return list(found.values())
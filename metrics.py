@@ -0,0 +1,137 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+from serializers import atomic_write
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def render_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{value}"' for name, value in pairs
+    ) + '}'
+
+
+class Metrics:
+    # Counters and histograms for the crawl, keyed by name and labels and
+    # rendered in the Prometheus text format, plus an optional stream of
+    # structured events written as JSON lines. Safe to share between
+    # threads.
+
+    def __init__(self, clock=time.perf_counter, wall_clock=time.time):
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.help = {}
+        self.log_stream = None
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        with self.lock:
+            series = self.histograms.setdefault(name, (buckets, {}))[1]
+            key = label_key(labels)
+            counts, total = series.get(key, ([0] * (len(buckets) + 1), 0))
+            counts[bisect.bisect_left(buckets, value)] += 1
+            series[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        # Adds the seconds spent in the block to the counter name
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.inc(name, self.clock() - start, **labels)
+
+    def log(self, event, **fields):
+        if self.log_stream is None:
+            return
+        line = json.dumps(
+            {'time': self.wall_clock(), 'event': event, **fields}
+        )
+        with self.lock:
+            self.log_stream.write(line + '\n')
+            self.log_stream.flush()
+
+    def value(self, name, **labels):
+        with self.lock:
+            return self.counters.get(name, {}).get(label_key(labels), 0)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                if name in self.help:
+                    lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} counter')
+                for labels, value in sorted(series.items()):
+                    lines.append(f'{name}{render_labels(labels)} {value}')
+            for name, (buckets, series) in sorted(self.histograms.items()):
+                if name in self.help:
+                    lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, (counts, total) in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip([*buckets, '+Inf'], counts):
+                        cumulative += count
+                        lines.append(
+                            f'{name}_bucket'
+                            f'{render_labels(labels, [("le", bound)])} '
+                            f'{cumulative}'
+                        )
+                    lines.append(f'{name}_sum{render_labels(labels)} {total}')
+                    lines.append(
+                        f'{name}_count{render_labels(labels)} {cumulative}'
+                    )
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        # For node_exporter's textfile collector, which must never see a
+        # partly written file
+        atomic_write(path, self.render().encode())
+
+    def serve(self, port, host='127.0.0.1'):
+        import http.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header(
+                    'Content-Type', 'text/plain; version=0.0.4'
+                )
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
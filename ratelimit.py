@@ -0,0 +1,174 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from serializers import atomic_write, dumps
+
+
+def key_id(api_key):
+    # Short, stable and safe to log or put in a file name
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+def key_state_file(state_file, api_key):
+    root, extension = os.path.splitext(state_file)
+    return f'{root}.{key_id(api_key)}{extension}'
+
+
+def pool_state_file(state_file, api_key, keys):
+    # A single key keeps state_file, several keys keep one file each
+    if keys > 1:
+        return key_state_file(state_file, api_key)
+    return state_file
+
+
+class RateLimiter:
+    # Sliding-window limiter for any number of (max_calls, period) limits at
+    # once. Calls are timestamped on the monotonic clock, so wall-clock jumps
+    # cannot shorten or stretch a wait. A call reserves its slot under a
+    # lock and then sleeps outside it, which makes the same limiter safe to
+    # share between threads and coroutines. With a state file, timestamps
+    # are saved as wall-clock times so back-to-back runs share one budget.
+
+    def __init__(self, limits, clock=time.monotonic, wall_clock=time.time):
+        self.limits = [
+            (max_calls, float(period)) for max_calls, period in limits
+        ]
+        self.longest_period = max(period for _, period in self.limits)
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.calls = collections.deque()
+        self.lock = threading.Lock()
+        self.state_file = None
+
+    def persist_to(self, state_file):
+        self.state_file = state_file
+        if not os.path.isfile(state_file):
+            return
+        with open(state_file) as infile:
+            wall_calls = json.load(infile)['calls']
+        with self.lock:
+            offset = self.clock() - self.wall_clock()
+            self.calls = collections.deque(sorted([
+                *self.calls, *(wall_call + offset for wall_call in wall_calls)
+            ]))
+
+    def save(self):
+        offset = self.wall_clock() - self.clock()
+        atomic_write(self.state_file, dumps(
+            {'calls': [call + offset for call in self.calls]}
+        ))
+
+    def next_slot(self, now):
+        # The earliest time the next call can be made; the lock must be held
+        while self.calls and self.calls[0] <= now - self.longest_period:
+            self.calls.popleft()
+        slot = now
+        for max_calls, period in self.limits:
+            if len(self.calls) >= max_calls:
+                slot = max(slot, self.calls[-max_calls] + period)
+        return slot
+
+    def reserve(self, not_before=None):
+        with self.lock:
+            now = self.clock()
+            slot = self.next_slot(now)
+            if not_before is not None:
+                slot = max(slot, not_before)
+            self.calls.append(slot)
+            if self.state_file is not None:
+                self.save()
+            return slot - now
+
+    def acquire(self):
+        sleep_time = self.reserve()
+        if sleep_time > 0:
+            print(f'Sleeping {sleep_time} seconds to avoid being rate-limited')
+            time.sleep(sleep_time)
+
+    async def acquire_async(self):
+        sleep_time = self.reserve()
+        if sleep_time > 0:
+            import asyncio
+            print(f'Sleeping {sleep_time} seconds to avoid being rate-limited')
+            await asyncio.sleep(sleep_time)
+
+
+class KeyPool:
+    # Spreads calls over several API keys, each with its own RateLimiter
+    # and so its own per-minute and daily budget. A call goes to the key
+    # that can make it soonest and, between keys that can make it now, to
+    # the one with the fewest calls in its longest window, which spreads
+    # the load and leaves every key the most headroom. acquire returns the
+    # key to use. A key that is throttled or rejected is benched for a
+    # while; when every key is benched calls wait for the first to return.
+
+    def __init__(self, api_keys, limits, clock=time.monotonic,
+                 wall_clock=time.time):
+        self.api_keys = list(api_keys)
+        self.limits = limits
+        self.clock = clock
+        self.limiters = {
+            api_key: RateLimiter(limits, clock, wall_clock)
+            for api_key in self.api_keys
+        }
+        self.benched = {}
+        self.lock = threading.Lock()
+
+    def persist_to(self, state_file):
+        for api_key, limiter in self.limiters.items():
+            limiter.persist_to(
+                pool_state_file(state_file, api_key, len(self.limiters))
+            )
+
+    def readiness(self, api_key, now):
+        limiter = self.limiters[api_key]
+        with limiter.lock:
+            slot = limiter.next_slot(now)
+            calls = len(limiter.calls)
+        return max(slot, self.benched.get(api_key, now)), calls
+
+    def reserve(self):
+        with self.lock:
+            now = self.clock()
+            for api_key, until in list(self.benched.items()):
+                if until <= now:
+                    del self.benched[api_key]
+            api_key = min(
+                self.api_keys, key=lambda key: self.readiness(key, now)
+            )
+            return api_key, self.limiters[api_key].reserve(
+                self.benched.get(api_key)
+            )
+
+    def acquire(self):
+        api_key, sleep_time = self.reserve()
+        if sleep_time > 0:
+            print(f'Sleeping {sleep_time} seconds to avoid being rate-limited')
+            time.sleep(sleep_time)
+        return api_key
+
+    async def acquire_async(self):
+        api_key, sleep_time = self.reserve()
+        if sleep_time > 0:
+            import asyncio
+            print(f'Sleeping {sleep_time} seconds to avoid being rate-limited')
+            await asyncio.sleep(sleep_time)
+        return api_key
+
+    def bench(self, api_key, seconds):
+        with self.lock:
+            self.benched[api_key] = max(
+                self.benched.get(api_key, 0), self.clock() + seconds
+            )
+
+    def usable(self):
+        # Keys that are not benched
+        with self.lock:
+            now = self.clock()
+            return [
+                api_key for api_key in self.api_keys
+                if self.benched.get(api_key, now) <= now
+            ]
@@ -0,0 +1,72 @@
+import sys
+
+SECTIONS = ('number_ones', 'audio_best_sellers')
+
+
+class Book:
+    # In-memory form of a number one or audio best seller. Slots keep each
+    # record at a fraction of the size of the equivalent dict, and author,
+    # date and category are interned since they repeat across thousands of
+    # records. Books can still be read like the JSON dicts they are stored
+    # as (book['author'], book.get('isbns')) and compare equal to them.
+
+    __slots__ = ('author', 'title', 'date', 'category', 'isbns')
+
+    def __init__(self, author, title, date=None, category=None, isbns=()):
+        self.author = sys.intern(author)
+        self.title = title
+        self.date = None if date is None else sys.intern(date)
+        self.category = None if category is None else sys.intern(category)
+        self.isbns = tuple(isbns)
+
+    @classmethod
+    def from_dict(cls, book):
+        return cls(**book)
+
+    def to_dict(self):
+        book = {'author': self.author, 'title': self.title}
+        if self.date is not None:
+            book['date'] = self.date
+        if self.category is not None:
+            book['category'] = self.category
+        book['isbns'] = list(self.isbns)
+        return book
+
+    def __getitem__(self, field):
+        value = getattr(self, field, None) if field in self.__slots__ else None
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if isinstance(other, Book):
+            other = other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == {'isbns': [], **other}
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Book({self.to_dict()!r})'
+
+
+def to_books(books):
+    return [
+        book if isinstance(book, Book) else Book.from_dict(book)
+        for book in books
+    ]
+
+
+def to_json(value):
+    # default hook for json.dump, so Books are only turned back into dicts
+    # as they are written
+    if isinstance(value, Book):
+        return value.to_dict()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
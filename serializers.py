@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+from records import to_json
+
+# Both are optional: orjson speeds up every JSON load and save, and msgpack
+# makes snapshot sections smaller and faster to decode. Without them the
+# json module is used.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# orjson can only indent by 2 spaces, so the json module does the same and
+# a pretty-printed file is identical whichever encoded it
+PRETTY_INDENT = 2
+
+
+def dumps(value, pretty=False):
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(value, default=to_json, option=option)
+    return json.dumps(
+        value, sort_keys=True, indent=PRETTY_INDENT if pretty else None,
+        default=to_json
+    ).encode()
+
+
+def dump(value, outfile, pretty=False):
+    # Without orjson the document is encoded chunk by chunk straight into
+    # outfile instead of being built as one string first
+    if orjson is not None:
+        outfile.write(dumps(value, pretty))
+        return
+    encoder = json.JSONEncoder(
+        sort_keys=True, indent=PRETTY_INDENT if pretty else None,
+        default=to_json
+    )
+    for chunk in encoder.iterencode(value):
+        outfile.write(chunk.encode())
+
+
+def binary_format():
+    return 'msgpack' if msgpack is not None else 'json'
+
+
+def pack(value, format_):
+    if format_ == 'msgpack':
+        return msgpack.packb(value, default=to_json)
+    return dumps(value)
+
+
+def unpack(data, format_):
+    if format_ == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError('msgpack is needed to read this snapshot')
+        return msgpack.unpackb(data)
+    return loads(data)
+
+
+def atomic_write(path, content):
+    # content is bytes or a callable writing to the open binary file. The
+    # data is fsynced under a temporary name and renamed over path, so path
+    # always holds either the old or the new content in full.
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as outfile:
+            if callable(content):
+                content(outfile)
+            else:
+                outfile.write(content)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,612 @@
+import array
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from serializers import (
+    atomic_write, binary_format, dump, dumps, loads, pack, unpack
+)
+
+BEST_SELLER_FILE = 'best_sellers.json'
+JOURNAL_FILE = 'best_sellers.journal.jsonl'
+DATABASE_FILE = 'best_sellers.db'
+SNAPSHOT_FILE = 'best_sellers.snapshot'
+RANKINGS_FILE = 'rankings.jsonl'
+APPEND_ONLY_SECTIONS = ('number_ones', 'audio_best_sellers')
+
+
+def book_key(book):
+    return (book['author'], book['title'])
+
+
+class JsonStorage:
+
+    def __init__(self, path=BEST_SELLER_FILE):
+        self.path = path
+
+    def load(self, sections=None, seed=True):
+        # sections is a hint for backends that can load lazily; this one
+        # always reads the whole file. seed=False asks backends that are
+        # seeded from best_sellers.json on first use to only read it, for
+        # commands that must not write.
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, 'rb') as infile:
+            return loads(infile.read())
+
+    def save(self, best_sellers):
+        atomic_write(
+            self.path, lambda outfile: dump(best_sellers, outfile, pretty=True)
+        )
+
+    def reset(self):
+        pass
+
+    def compact(self, best_sellers=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullStorage:
+    # Stores nothing, for work that must not touch stored state until it is
+    # known to be complete
+
+    def load(self, sections=None, seed=True):
+        return None
+
+    def save(self, best_sellers):
+        pass
+
+    def reset(self):
+        pass
+
+    def compact(self, best_sellers=None):
+        pass
+
+    def close(self):
+        pass
+
+
+class JournalStorage(JsonStorage):
+    # best_sellers.json is kept as a base snapshot and every save appends a
+    # single JSON line holding only the books added since the previous save
+    # plus any other top-level keys (cursors, reading list) that changed.
+    # A line is the unit of atomicity: a torn last line is ignored on load,
+    # which leaves the cursors at the previous week exactly as a crash
+    # during a full rewrite would have. Only a writer drops the torn line,
+    # since a reader may be looking at a line a crawl is still appending.
+
+    def __init__(self, path=BEST_SELLER_FILE, journal_path=JOURNAL_FILE):
+        super().__init__(path)
+        self.journal_path = journal_path
+        self.saved_lengths = {}
+        self.saved_values = {}
+        self.journal = None
+        self.replayed_bytes = None
+
+    def load(self, sections=None, seed=True):
+        best_sellers = super().load()
+        if best_sellers is None and not os.path.isfile(self.journal_path):
+            return None
+        if best_sellers is None:
+            best_sellers = {section: [] for section in APPEND_ONLY_SECTIONS}
+        self.replay(best_sellers)
+        if seed:
+            self.drop_torn_tail()
+        self.mark_saved(best_sellers)
+        return best_sellers
+
+    def replay(self, best_sellers):
+        if not os.path.isfile(self.journal_path):
+            return
+        indexes = {}
+        good_bytes = 0
+        with open(self.journal_path, 'rb') as infile:
+            for line in infile:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                good_bytes += len(line)
+                for section, books in entry.get('append', {}).items():
+                    if section not in indexes:
+                        indexes[section] = {
+                            book_key(book)
+                            for book in best_sellers.setdefault(section, [])
+                        }
+                    for book in books:
+                        # Replaying over a base that was compacted before the
+                        # journal could be removed must not duplicate books
+                        if book_key(book) not in indexes[section]:
+                            indexes[section].add(book_key(book))
+                            best_sellers[section].append(book)
+                best_sellers.update(entry.get('set', {}))
+        self.replayed_bytes = good_bytes
+
+    def drop_torn_tail(self):
+        # Drop a torn tail so the next append starts on a fresh line
+        if self.replayed_bytes is None:
+            return
+        if self.replayed_bytes < os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as journal:
+                journal.truncate(self.replayed_bytes)
+        self.replayed_bytes = None
+
+    def mark_saved(self, best_sellers):
+        self.saved_lengths = {
+            section: len(best_sellers.get(section, []))
+            for section in APPEND_ONLY_SECTIONS
+        }
+        self.saved_values = {
+            key: dumps(value)
+            for key, value in best_sellers.items()
+            if key not in APPEND_ONLY_SECTIONS
+        }
+
+    def save(self, best_sellers):
+        entry = {}
+        for section in APPEND_ONLY_SECTIONS:
+            books = best_sellers.get(section, [])
+            new_books = books[self.saved_lengths.get(section, 0):]
+            if new_books:
+                entry.setdefault('append', {})[section] = new_books
+            self.saved_lengths[section] = len(books)
+        for key, value in best_sellers.items():
+            if key in APPEND_ONLY_SECTIONS:
+                continue
+            serialized = dumps(value)
+            if self.saved_values.get(key) != serialized:
+                entry.setdefault('set', {})[key] = value
+                self.saved_values[key] = serialized
+        if not entry:
+            return
+        if self.journal is None:
+            self.drop_torn_tail()
+            self.journal = open(self.journal_path, 'ab')
+        self.journal.write(dumps(entry) + b'\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def compact(self, best_sellers=None):
+        if best_sellers is None:
+            best_sellers = self.load()
+            if best_sellers is None:
+                return
+        self.close()
+        JsonStorage.save(self, best_sellers)
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.mark_saved(best_sellers)
+
+    def reset(self):
+        self.compact({section: [] for section in APPEND_ONLY_SECTIONS})
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+class SqliteStorage:
+    # Sections live in tables with a UNIQUE (author, title) index, so dedup
+    # is enforced by the database. WAL mode lets other tools read while a
+    # crawl is writing. Each save is one transaction holding the new books
+    # and the cursors.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS number_ones (
+            id INTEGER PRIMARY KEY,
+            author TEXT NOT NULL,
+            title TEXT NOT NULL,
+            date TEXT NOT NULL,
+            isbns TEXT NOT NULL DEFAULT '',
+            UNIQUE (author, title)
+        );
+        CREATE TABLE IF NOT EXISTS audio_best_sellers (
+            id INTEGER PRIMARY KEY,
+            author TEXT NOT NULL,
+            title TEXT NOT NULL,
+            date TEXT NOT NULL,
+            category TEXT NOT NULL,
+            isbns TEXT NOT NULL DEFAULT '',
+            UNIQUE (author, title)
+        );
+        CREATE TABLE IF NOT EXISTS cursors (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS reading_list (
+            id INTEGER PRIMARY KEY,
+            author TEXT NOT NULL,
+            title TEXT NOT NULL,
+            date TEXT NOT NULL,
+            category TEXT NOT NULL,
+            match TEXT NOT NULL DEFAULT 'exact',
+            confidence REAL NOT NULL DEFAULT 1.0
+        );
+    """
+    COLUMNS = {
+        'number_ones': ('author', 'title', 'date', 'isbns'),
+        'audio_best_sellers': ('author', 'title', 'date', 'category', 'isbns'),
+        'reading_list': (
+            'author', 'title', 'date', 'category', 'match', 'confidence'
+        ),
+    }
+    # Columns added since the first schema, added to older databases on
+    # connect
+    MIGRATIONS = {
+        'number_ones': {'isbns': "TEXT NOT NULL DEFAULT ''"},
+        'audio_best_sellers': {'isbns': "TEXT NOT NULL DEFAULT ''"},
+        'reading_list': {
+            'match': "TEXT NOT NULL DEFAULT 'exact'",
+            'confidence': 'REAL NOT NULL DEFAULT 1.0'
+        },
+    }
+    # List columns are stored space-separated
+    LIST_COLUMNS = {'isbns'}
+
+    def __init__(self, path=DATABASE_FILE, json_path=BEST_SELLER_FILE):
+        self.path = path
+        self.json_path = json_path
+        self.connection = None
+        self.lock = threading.Lock()
+        self.saved_lengths = {}
+        self.saved_reading_list = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(
+                self.path, check_same_thread=False
+            )
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(self.SCHEMA)
+            self.migrate()
+        return self.connection
+
+    def migrate(self):
+        with self.connection:
+            for table, migrations in self.MIGRATIONS.items():
+                existing = {
+                    row[1] for row in self.connection.execute(
+                        f'PRAGMA table_info({table})'
+                    )
+                }
+                for column, definition in migrations.items():
+                    if column not in existing:
+                        self.connection.execute(
+                            f'ALTER TABLE {table} ADD COLUMN {column} '
+                            f'{definition}'
+                        )
+
+    def select(self, table):
+        columns = self.COLUMNS[table]
+        rows = self.connect().execute(
+            f'SELECT {", ".join(columns)} FROM {table} ORDER BY id'
+        )
+        return [
+            {
+                column: value.split() if column in self.LIST_COLUMNS else value
+                for column, value in zip(columns, row)
+            }
+            for row in rows
+        ]
+
+    def to_row(self, columns, book):
+        return [
+            ' '.join(book.get(column, ()))
+            if column in self.LIST_COLUMNS else book[column]
+            for column in columns
+        ]
+
+    def load(self, sections=None, seed=True):
+        # Tables left out of sections are not read, and saves leave them
+        # untouched
+        if not os.path.isfile(self.path):
+            best_sellers = JsonStorage(self.json_path).load()
+            if best_sellers is not None and seed:
+                self.save(best_sellers)
+            return best_sellers
+        best_sellers = {
+            section: self.select(section) for section in APPEND_ONLY_SECTIONS
+            if sections is None or section in sections
+        }
+        best_sellers.update(
+            self.connect().execute('SELECT name, value FROM cursors')
+        )
+        if (sections is None or 'reading_list' in sections) and (
+            self.connect().execute(
+                'SELECT EXISTS (SELECT 1 FROM reading_list)'
+            ).fetchone()[0]
+        ):
+            best_sellers['reading_list'] = self.select('reading_list')
+            self.saved_reading_list = list(best_sellers['reading_list'])
+        self.saved_lengths = {
+            section: len(best_sellers.get(section, []))
+            for section in APPEND_ONLY_SECTIONS
+        }
+        return best_sellers
+
+    def insert(self, table, books):
+        columns = self.COLUMNS[table]
+        self.connect().executemany(
+            f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) '
+            f'VALUES ({", ".join("?" * len(columns))})',
+            [self.to_row(columns, book) for book in books]
+        )
+
+    def save(self, best_sellers):
+        with self.lock, self.connect():
+            for section in APPEND_ONLY_SECTIONS:
+                books = best_sellers.get(section, [])
+                saved_length = self.saved_lengths.get(section, 0)
+                self.insert(section, books[saved_length:])
+                self.saved_lengths[section] = len(books)
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO cursors (name, value) VALUES (?, ?)',
+                [
+                    (key, value) for key, value in best_sellers.items()
+                    if key.startswith('_')
+                ]
+            )
+            reading_list = best_sellers.get('reading_list')
+            if (
+                reading_list is not None and
+                reading_list != self.saved_reading_list
+            ):
+                self.connection.execute('DELETE FROM reading_list')
+                self.insert('reading_list', reading_list)
+                self.saved_reading_list = list(reading_list)
+
+    def reset(self):
+        with self.lock, self.connect():
+            for table in self.COLUMNS:
+                self.connection.execute(f'DELETE FROM {table}')
+            self.connection.execute('DELETE FROM cursors')
+        self.saved_lengths = {}
+        self.saved_reading_list = None
+
+    def compact(self, best_sellers=None):
+        pass
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class RankingStore:
+    # Full ranked lists are kept out of best_sellers.json because they are
+    # roughly 15 times larger. On disk every crawled week is one appended
+    # line holding its lists as parallel columns, with books and list names
+    # dictionary-encoded: a book's (isbn13, author, title) is only written
+    # the first time it is seen and referred to by position afterwards. In
+    # memory the same columns are kept as typed arrays.
+
+    COLUMNS = ('list', 'date', 'book', 'rank', 'weeks_on_list')
+
+    def __init__(self, path=RANKINGS_FILE):
+        self.path = path
+        self.books = []
+        self.book_ids = {}
+        self.lists = []
+        self.list_ids = {}
+        self.dates = []
+        self.date_ids = {}
+        self.columns = {column: array.array('I') for column in self.COLUMNS}
+        self.latest = {}
+        self.file = None
+
+    def encode(self, values, ids, value):
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return self
+        good_bytes = 0
+        with open(self.path, 'rb') as infile:
+            for line in infile:
+                try:
+                    week = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                good_bytes += len(line)
+                for book in week['books']:
+                    self.encode(self.books, self.book_ids, tuple(book))
+                for list_name, ranks in week['lists'].items():
+                    self.add_ranks(list_name, ranks)
+        if good_bytes < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as rankings:
+                rankings.truncate(good_bytes)
+        return self
+
+    def add_ranks(self, list_name, ranks):
+        list_id = self.encode(self.lists, self.list_ids, list_name)
+        date_id = self.encode(self.dates, self.date_ids, ranks['date'])
+        for book_id, rank, weeks_on_list in zip(
+            ranks['book'], ranks['rank'], ranks['weeks_on_list']
+        ):
+            self.columns['list'].append(list_id)
+            self.columns['date'].append(date_id)
+            self.columns['book'].append(book_id)
+            self.columns['rank'].append(rank)
+            self.columns['weeks_on_list'].append(weeks_on_list)
+        self.latest[list_name] = max(
+            self.latest.get(list_name, ''), ranks['date']
+        )
+
+    def has(self, list_name, published_date):
+        return self.latest.get(list_name, '') >= published_date
+
+    def append_week(self, published_date, lists):
+        # lists maps a list name to (list published date, ranked rows); a
+        # list already stored for that date, e.g. when a week is refetched
+        # on resume, is skipped
+        week = {'published_date': published_date, 'books': [], 'lists': {}}
+        for list_name, (list_date, rows) in lists.items():
+            if self.has(list_name, list_date):
+                continue
+            ranks = {
+                'date': list_date,
+                'book': [],
+                'rank': [],
+                'weeks_on_list': []
+            }
+            for row in rows:
+                book = (row['isbn13'], row['author'], row['title'])
+                if book not in self.book_ids:
+                    week['books'].append(book)
+                ranks['book'].append(
+                    self.encode(self.books, self.book_ids, book)
+                )
+                ranks['rank'].append(row['rank'])
+                ranks['weeks_on_list'].append(row['weeks_on_list'])
+            week['lists'][list_name] = ranks
+            self.add_ranks(list_name, ranks)
+        if not week['lists']:
+            return
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps(week) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def __len__(self):
+        return len(self.columns['rank'])
+
+    def rows(self):
+        for list_id, date_id, book_id, rank, weeks_on_list in zip(
+            *(self.columns[column] for column in self.COLUMNS)
+        ):
+            isbn13, author, title = self.books[book_id]
+            yield {
+                'list': self.lists[list_id],
+                'date': self.dates[date_id],
+                'rank': rank,
+                'weeks_on_list': weeks_on_list,
+                'isbn13': isbn13,
+                'author': author,
+                'title': title
+            }
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SnapshotStorage:
+    # Binary snapshot: an 8-byte magic, the length of a JSON header, the
+    # header and then one serialized blob per list-valued section. The
+    # header holds every other top-level value (cursors, checkpoints) and
+    # the offset and length of each section, so a reader memory-maps the
+    # file and decodes only the sections it asks for. Sections that were
+    # not loaded are copied over unchanged by the next save. Every save
+    # replaces the whole file atomically.
+
+    MAGIC = b'NYTSNAP1'
+    HEADER_LENGTH = struct.Struct('>I')
+
+    def __init__(self, path=SNAPSHOT_FILE, json_path=BEST_SELLER_FILE):
+        self.path = path
+        self.json_path = json_path
+
+    def read(self, sections=None, raw=False):
+        # Returns the header and the requested sections, decoded or as raw
+        # bytes
+        with open(self.path, 'rb') as infile, mmap.mmap(
+            infile.fileno(), 0, access=mmap.ACCESS_READ
+        ) as snapshot:
+            if snapshot[:len(self.MAGIC)] != self.MAGIC:
+                raise ValueError(f'{self.path} is not a snapshot')
+            start = len(self.MAGIC) + self.HEADER_LENGTH.size
+            (header_length,) = self.HEADER_LENGTH.unpack(
+                snapshot[len(self.MAGIC):start]
+            )
+            header = loads(snapshot[start:start + header_length])
+            data_start = start + header_length
+            blobs = {
+                section: snapshot[
+                    data_start + offset:data_start + offset + length
+                ]
+                for section, (offset, length) in header['sections'].items()
+                if sections is None or section in sections
+            }
+        if not raw:
+            blobs = {
+                section: unpack(blob, header['format'])
+                for section, blob in blobs.items()
+            }
+        return header, blobs
+
+    def load(self, sections=None, seed=True):
+        if not os.path.isfile(self.path):
+            best_sellers = JsonStorage(self.json_path).load()
+            if best_sellers is not None and seed:
+                self.save(best_sellers)
+            return best_sellers
+        header, blobs = self.read(sections)
+        return {**header['values'], **blobs}
+
+    def save(self, best_sellers):
+        format_ = binary_format()
+        values = {}
+        blobs = {}
+        for key, value in best_sellers.items():
+            if isinstance(value, list):
+                blobs[key] = pack(value, format_)
+            else:
+                values[key] = value
+        if os.path.isfile(self.path):
+            saved_header, saved_blobs = self.read(raw=True)
+            saved_format = saved_header['format']
+            for section, blob in saved_blobs.items():
+                if section not in blobs:
+                    blobs[section] = (
+                        blob if saved_format == format_
+                        else pack(unpack(blob, saved_format), format_)
+                    )
+        header = {'format': format_, 'values': values, 'sections': {}}
+        offset = 0
+        for section, blob in blobs.items():
+            header['sections'][section] = [offset, len(blob)]
+            offset += len(blob)
+        header = dumps(header)
+
+        def write(outfile):
+            outfile.write(self.MAGIC)
+            outfile.write(self.HEADER_LENGTH.pack(len(header)))
+            outfile.write(header)
+            for blob in blobs.values():
+                outfile.write(blob)
+
+        atomic_write(self.path, write)
+
+    def reset(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+        self.save({section: [] for section in APPEND_ONLY_SECTIONS})
+
+    def compact(self, best_sellers=None):
+        pass
+
+    def close(self):
+        pass
+
+
+STORAGE_BACKENDS = {
+    'json': JsonStorage,
+    'journal': JournalStorage,
+    'snapshot': SnapshotStorage,
+    'sqlite': SqliteStorage,
+}
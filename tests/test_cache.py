@@ -0,0 +1,127 @@
+import datetime
+import os
+import tempfile
+import unittest
+import cache
+
+URL = (
+    'https://api.nytimes.com/svc/books/v3/lists/overview.json'
+    '?published_date=2008-06-07&api-key=secret'
+)
+PUBLISHED = datetime.datetime(
+    2008, 6, 7, tzinfo=datetime.timezone.utc
+).timestamp()
+DAY = datetime.timedelta(days=1).total_seconds()
+
+
+class FakeClock:
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RequestKeyTest(unittest.TestCase):
+
+    def test_drops_api_key_and_sorts_params(self):
+        self.assertEqual(
+            cache.request_key('https://host/path.json?b=2&api-key=x&a=1'),
+            '/path.json?a=1&b=2'
+        )
+
+    def test_api_key_does_not_change_the_key(self):
+        self.assertEqual(
+            cache.request_key(URL),
+            cache.request_key(URL.replace('secret', 'other'))
+        )
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.clock = FakeClock(PUBLISHED + 365 * DAY)
+        self.response_cache = cache.ResponseCache(self.tmpdir.name, self.clock)
+
+    def test_miss_returns_none(self):
+        self.assertIsNone(self.response_cache.get(URL))
+
+    def test_round_trips_content_without_storing_api_key(self):
+        self.response_cache.put(URL, b'{"results": {}}')
+        self.assertEqual(self.response_cache.get(URL), b'{"results": {}}')
+        for root, _, files in os.walk(self.tmpdir.name):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as infile:
+                    self.assertNotIn(b'secret', infile.read())
+
+    def test_identical_content_is_stored_once(self):
+        other_url = URL.replace('2008-06-07', '2008-06-14')
+        self.response_cache.put(URL, b'same')
+        self.response_cache.put(other_url, b'same')
+        objects = [
+            name
+            for _, _, files in os.walk(
+                os.path.join(self.tmpdir.name, 'objects')
+            )
+            for name in files
+        ]
+        self.assertEqual(len(objects), 1)
+
+    def test_historical_week_never_expires(self):
+        self.response_cache.put(URL, b'content', results={
+            'published_date': '2008-06-08',
+            'next_published_date': '2008-06-15'
+        })
+        self.clock.now += 1000 * DAY
+        self.assertEqual(self.response_cache.get(URL), b'content')
+
+    def test_newest_list_expires_however_late_it_was_fetched(self):
+        self.response_cache.put(URL, b'content', results={
+            'published_date': '2008-06-08',
+            'next_published_date': ''
+        })
+        self.clock.now += DAY / 2
+        self.assertEqual(self.response_cache.get(URL), b'content')
+        self.clock.now += DAY
+        self.assertIsNone(self.response_cache.get(URL))
+
+    def test_recent_week_expires_after_ttl(self):
+        self.clock.now = PUBLISHED + DAY
+        self.response_cache.put(URL, b'content')
+        self.clock.now += DAY / 2
+        self.assertEqual(self.response_cache.get(URL), b'content')
+        self.clock.now += 1000 * DAY
+        self.assertIsNone(self.response_cache.get(URL))
+        self.assertEqual(
+            self.response_cache.get(URL, allow_stale=True), b'content'
+        )
+
+    def test_entry_is_also_filed_under_its_published_date(self):
+        self.response_cache.put(URL, b'content', results={
+            'published_date': '2008-06-08',
+            'next_published_date': '2008-06-15'
+        })
+        self.assertEqual(
+            self.response_cache.get(URL.replace('2008-06-07', '2008-06-08')),
+            b'content'
+        )
+
+    def test_validators_become_conditional_headers(self):
+        self.assertEqual(cache.conditional_headers(None), {})
+        self.response_cache.put(URL, b'content', {
+            'ETag': '"abc"', 'Last-Modified': 'Sat, 07 Jun 2008 00:00:00 GMT'
+        })
+        self.assertEqual(
+            cache.conditional_headers(self.response_cache.entry(URL)),
+            {
+                'If-None-Match': '"abc"',
+                'If-Modified-Since': 'Sat, 07 Jun 2008 00:00:00 GMT'
+            }
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
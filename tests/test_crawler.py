@@ -1,70 +1,284 @@
+import asyncio
+import contextlib
 import datetime
+import io
 import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import mock_open, patch
+from unittest.mock import AsyncMock, Mock, call, mock_open, patch
+import httpx
+import requests
 import crawler
+import metrics
+import storage
+from ratelimit import KeyPool
 
 
-@patch('requests.get')
-@patch('crawler.datetime')
+class NewBooksTest(unittest.TestCase):
+
+    def test_returns_only_books_missing_from_index(self):
+        old = {'author': 'author', 'title': 'Title', 'date': '2008-06-07'}
+        new = {'author': 'author', 'title': 'Other', 'date': '2018-03-11'}
+        best_sellers = crawler.BestSellers({'number_ones': [old]})
+        index = best_sellers.index('number_ones')
+        books = crawler.new_books([dict(old, date='2018-03-11'), new], index)
+        self.assertEqual(books, [new])
+        self.assertIs(best_sellers.index('number_ones'), index)
+        self.assertEqual(index, {
+            ('author', 'Title'): old,
+            ('author', 'Other'): new
+        })
+
+    def test_dedups_within_a_stream_of_weeks(self):
+        book = {'author': 'author', 'title': 'Title'}
+        weeks = [('2008-06-07', [book]), ('2008-06-14', [dict(book)])]
+        self.assertEqual(
+            list(crawler.iter_new_books(weeks, {})),
+            [('2008-06-07', [book]), ('2008-06-14', [])]
+        )
+
+    def test_counts_added_and_deduped_records_per_section(self):
+        book = {'author': 'author', 'title': 'Title'}
+        weeks = [('2008-06-07', [book]), ('2008-06-14', [dict(book)])]
+        with patch('crawler.METRICS', metrics.Metrics()):
+            list(crawler.iter_new_books(weeks, {}, 'number_ones'))
+            self.assertEqual(crawler.METRICS.value(
+                'crawl_records_total', section='number_ones', outcome='added'
+            ), 1)
+            self.assertEqual(crawler.METRICS.value(
+                'crawl_records_total', section='number_ones',
+                outcome='deduped'
+            ), 1)
+
+    def test_index_keeps_earliest_duplicate(self):
+        first = {'author': 'author', 'title': 'Title', 'date': '2008-06-07'}
+        second = {'author': 'author', 'title': 'Title', 'date': '2018-03-11'}
+        index = crawler.index_books([first, second])
+        self.assertIs(index[('author', 'Title')], first)
+
+
+class SessionTest(unittest.TestCase):
+
+    @patch.multiple(crawler, SESSION=None, WORKERS=4)
+    def test_pool_fits_both_stages_at_once(self):
+        adapter = crawler.get_session().get_adapter('https://api.nytimes.com')
+        self.assertEqual(adapter._pool_maxsize, 8)
+
+
+@patch('crawler.get_session')
+@patch('crawler.RATE_LIMITER', **{'acquire.return_value': None})
 @patch('builtins.print')
 @patch('time.sleep')
 class ApiCallTest(unittest.TestCase):
 
-    def setUp(self):
-        crawler.API_CALLS = []
+    def response(self, status_code, content=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers.update(headers or {})
+        return response
 
-    def test_requests_page(
-        self, mock_sleep, mock_print, mock_datetime, mock_get
+    def test_requests_page_after_acquiring_rate_limit(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
     ):
-        mock_get.return_value.text = json.dumps({'key': 'value'})
+        mock_get_session.return_value.get.return_value = self.response(
+            200, b'{"key": "value"}'
+        )
         response = crawler.api_call('url')
+        mock_rate_limiter.acquire.assert_called_once_with()
+        mock_get_session.return_value.get.assert_called_once_with(
+            'url', timeout=(crawler.CONNECT_TIMEOUT, crawler.READ_TIMEOUT)
+        )
         mock_sleep.assert_not_called()
-        mock_print.assert_not_called()
-        mock_datetime.datetime.now.assert_called_once()
-        mock_get.assert_called_once_with('url')
         self.assertEqual(response, {'key': 'value'})
 
-    def test_requests_page_when_no_need_to_rate_limit(
-        self, mock_sleep, mock_print, mock_datetime, mock_get
+    def test_retries_honoring_retry_after(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
     ):
-        mock_get.return_value.text = json.dumps({'key': 'value'})
-        mock_datetime.datetime.now.return_value = datetime.datetime.now()
-        for call in range(crawler.MAX_CALLS):
-            crawler.api_call('url')
-        future = datetime.datetime.now() + crawler.RATE_LIMIT_PERIOD
-        mock_datetime.datetime.now.return_value = future
+        mock_get_session.return_value.get.side_effect = [
+            self.response(429, headers={'Retry-After': '7'}),
+            self.response(200, b'{"key": "value"}')
+        ]
         response = crawler.api_call('url')
+        self.assertEqual(mock_rate_limiter.acquire.call_count, 2)
+        mock_sleep.assert_called_once_with(7.0)
+        mock_print.assert_called_once_with(
+            'HTTP 429, retrying in 7.0 seconds'
+        )
+        self.assertEqual(response, {'key': 'value'})
+
+    def test_records_calls_bytes_and_retries(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
+    ):
+        mock_get_session.return_value.get.side_effect = [
+            self.response(429, headers={'Retry-After': '7'}),
+            self.response(200, b'{"key": "value"}')
+        ]
+        with patch('crawler.METRICS', metrics.Metrics()):
+            crawler.api_call(crawler.overview_url('2008-06-07'))
+            self.assertEqual(crawler.METRICS.value(
+                'nyt_api_calls_total', endpoint='overview', status=429
+            ), 1)
+            self.assertEqual(crawler.METRICS.value(
+                'nyt_api_calls_total', endpoint='overview', status=200
+            ), 1)
+            self.assertEqual(
+                crawler.METRICS.value('nyt_api_response_bytes_total'), 16
+            )
+            self.assertEqual(crawler.METRICS.value(
+                'nyt_api_retries_total', reason='HTTP 429'
+            ), 1)
+
+    @patch('random.uniform')
+    def test_retries_connection_errors_with_backoff(
+        self, mock_uniform, mock_sleep, mock_print, mock_rate_limiter,
+        mock_get_session
+    ):
+        mock_uniform.side_effect = lambda low, high: high
+        mock_get_session.return_value.get.side_effect = [
+            requests.ConnectionError(),
+            self.response(503),
+            self.response(200, b'{"key": "value"}')
+        ]
+        response = crawler.api_call('url')
+        self.assertEqual(
+            mock_sleep.call_args_list,
+            [call(crawler.BACKOFF_BASE), call(crawler.BACKOFF_BASE * 2)]
+        )
+        self.assertEqual(response, {'key': 'value'})
+
+    def test_raises_on_non_retryable_status(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
+    ):
+        mock_get_session.return_value.get.return_value = self.response(401)
+        with self.assertRaises(requests.HTTPError):
+            crawler.api_call('url')
         mock_sleep.assert_not_called()
-        mock_print.assert_not_called()
-        mock_datetime.datetime.now.assert_called()
-        mock_get.assert_called_with('url')
+
+    def test_cached_response_skips_network_and_rate_limit(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
+    ):
+        with patch('crawler.RESPONSE_CACHE') as mock_response_cache:
+            mock_response_cache.get.return_value = b'{"key": "value"}'
+            response = crawler.api_call('url')
+        mock_rate_limiter.acquire.assert_not_called()
+        mock_get_session.assert_not_called()
         self.assertEqual(response, {'key': 'value'})
 
-    def test_rate_limits_when_necessary(
-        self, mock_sleep, mock_print, mock_datetime, mock_get
+    def test_fetched_response_is_cached(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
     ):
-        mock_get.return_value.text = json.dumps({'key': 'value'})
-        now = datetime.datetime.now()
-        mock_datetime.datetime.now.return_value = now
-        for call in range(crawler.MAX_CALLS):
+        content = b'{"results": {"next_published_date": ""}}'
+        mock_get_session.return_value.get.return_value = self.response(
+            200, content
+        )
+        with patch('crawler.RESPONSE_CACHE') as mock_response_cache:
+            mock_response_cache.get.return_value = None
             crawler.api_call('url')
-        future = now + crawler.RATE_LIMIT_PERIOD
-        mock_datetime.datetime.now.side_effect = [now, future, future]
-        response = crawler.api_call('url')
-        mock_sleep.assert_called_once_with(
-            crawler.RATE_LIMIT_PERIOD.total_seconds()
+        mock_response_cache.put.assert_called_once_with(
+            'url', content, results={'next_published_date': ''}
         )
-        mock_print.assert_called_once_with(
-            f'Sleeping {crawler.RATE_LIMIT_PERIOD.total_seconds()} seconds to '
-            f'avoid being rate-limited'
+
+    @patch('crawler.OFFLINE', True)
+    def test_offline_miss_raises_without_network(
+        self, mock_sleep, mock_print, mock_rate_limiter, mock_get_session
+    ):
+        with patch('crawler.RESPONSE_CACHE') as mock_response_cache:
+            mock_response_cache.get.return_value = None
+            with self.assertRaises(crawler.CacheMiss):
+                crawler.api_call('https://host/path?api-key=secret')
+        mock_response_cache.get.assert_called_once_with(
+            'https://host/path?api-key=secret', allow_stale=True
+        )
+        mock_get_session.assert_not_called()
+
+    @patch('crawler.retry_delay', return_value=0)
+    def test_raises_when_retries_are_exhausted(
+        self, mock_retry_delay, mock_sleep, mock_print, mock_rate_limiter,
+        mock_get_session
+    ):
+        mock_get_session.return_value.get.return_value = self.response(500)
+        with self.assertRaises(requests.HTTPError):
+            crawler.api_call('url')
+        self.assertEqual(
+            mock_get_session.return_value.get.call_count,
+            crawler.MAX_RETRIES + 1
+        )
+
+
+@patch('crawler.get_session')
+@patch('builtins.print')
+@patch('time.sleep')
+class KeyPoolApiCallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.key_pool = KeyPool(['key-a', 'key-b'], [(100, 1)])
+        patcher = patch('crawler.RATE_LIMITER', self.key_pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def response(self, status_code, content=b'', headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = content
+        response.headers.update(headers or {})
+        return response
+
+    def requested_keys(self, mock_get_session):
+        return [
+            args[0].rsplit('api-key=', 1)[-1]
+            for args, _ in mock_get_session.return_value.get.call_args_list
+        ]
+
+    def test_rejected_key_is_benched_and_call_moves_on(
+        self, mock_sleep, mock_print, mock_get_session
+    ):
+        mock_get_session.return_value.get.side_effect = [
+            self.response(401),
+            self.response(200, b'{"key": "value"}'),
+            self.response(200, b'{"key": "value"}')
+        ]
+        url = crawler.overview_url('2008-06-07')
+        self.assertEqual(crawler.api_call(url), {'key': 'value'})
+        crawler.api_call(crawler.overview_url('2008-06-14'))
+        self.assertEqual(
+            self.requested_keys(mock_get_session), ['key-a', 'key-b', 'key-b']
+        )
+        self.assertEqual(self.key_pool.usable(), ['key-b'])
+        mock_sleep.assert_called_once_with(0)
+
+    def test_throttled_key_is_benched_for_its_retry_after(
+        self, mock_sleep, mock_print, mock_get_session
+    ):
+        mock_get_session.return_value.get.side_effect = [
+            self.response(429, headers={'Retry-After': '30'}),
+            self.response(200, b'{"key": "value"}')
+        ]
+        crawler.api_call(crawler.overview_url('2008-06-07'))
+        self.assertEqual(
+            self.requested_keys(mock_get_session), ['key-a', 'key-b']
+        )
+        self.assertGreater(
+            self.key_pool.benched['key-a'], self.key_pool.clock() + 29
+        )
+
+    def test_raises_once_every_key_is_rejected(
+        self, mock_sleep, mock_print, mock_get_session
+    ):
+        mock_get_session.return_value.get.return_value = self.response(401)
+        with self.assertRaises(requests.HTTPError):
+            crawler.api_call(crawler.overview_url('2008-06-07'))
+        self.assertEqual(
+            self.requested_keys(mock_get_session), ['key-a', 'key-b']
         )
-        mock_datetime.datetime.now.assert_called()
-        mock_get.assert_called_with('url')
-        self.assertEqual(response, {'key': 'value'})
 
 
-@patch('crawler.retrieve_number_ones')
 @patch('os.path.isfile')
 @patch(
     'builtins.open',
@@ -74,45 +288,145 @@ class ApiCallTest(unittest.TestCase):
 class LoadBestSellerFileTest(unittest.TestCase):
 
     def test_initialize_file_if_it_does_not_exits(
-        self, mock_with_open, mock_isfile, mock_retrieve_number_ones
+        self, mock_with_open, mock_isfile
     ):
         mock_isfile.return_value = False
-        crawler.load_best_seller_file()
+        best_sellers = crawler.load_best_seller_file()
         mock_with_open.assert_not_called()
-        mock_retrieve_number_ones.assert_called_once_with({
+        self.assertEqual(best_sellers, {
             'number_ones': [],
             'audio_best_sellers': []
         })
 
-    def test_loads_file_if_present(
-        self, mock_with_open, mock_isfile, mock_retrieve_number_ones
-    ):
+    def test_loads_file_if_present(self, mock_with_open, mock_isfile):
         mock_isfile.return_value = True
-        crawler.load_best_seller_file()
-        mock_with_open.assert_called_with('best_sellers.json')
-        mock_retrieve_number_ones.assert_called_once_with({'key': 'value'})
+        best_sellers = crawler.load_best_seller_file()
+        mock_with_open.assert_called_with('best_sellers.json', 'rb')
+        self.assertEqual(best_sellers, {'key': 'value'})
+        self.assertIsInstance(best_sellers, crawler.BestSellers)
+
+
+class WeeklyScheduleTest(unittest.TestCase):
+
+    def test_yields_every_week_until_end(self):
+        self.assertEqual(
+            list(crawler.weekly_schedule('2008-06-07', '2008-06-22')),
+            ['2008-06-07', '2008-06-14', '2008-06-21']
+        )
+
+
+@patch('crawler.api_call')
+class FetchInOrderTest(unittest.TestCase):
+
+    def test_yields_responses_in_url_order(self, mock_api_call):
+        def slow_first(url):
+            if url == 'url 0':
+                time.sleep(0.05)
+            return url
+        mock_api_call.side_effect = slow_first
+        urls = [f'url {i}' for i in range(5)]
+        self.assertEqual(list(crawler.fetch_in_order(urls, 3)), urls)
+
+
+class NormalizeBookTest(unittest.TestCase):
+
+    def setUp(self):
+        crawler.normalize_book.cache_clear()
+
+    def test_strips_by_prefix_and_titlecases(self):
+        self.assertEqual(
+            crawler.normalize_book(' by author ', ' the title '),
+            ('author', 'The Title')
+        )
+
+    def test_repeated_books_hit_the_cache(self):
+        crawler.normalize_book('author', 'title')
+        crawler.normalize_book('author', 'title')
+        crawler.normalize_book('author', 'other title')
+        self.assertEqual(crawler.normalization_stats(), {
+            'hits': 1,
+            'misses': 2,
+            'hit_rate': 1 / 3,
+            'size': 2
+        })
+
+
+@patch('crawler.api_call')
+@patch('builtins.print')
+class IterWeeksTest(unittest.TestCase):
+
+    def page(self, published_date, next_published_date, *books):
+        return {
+            'results': {
+                'lists': [{'books': [book]} for book in books],
+                'books': list(books),
+                'published_date': published_date,
+                'next_published_date': next_published_date
+            }
+        }
+
+    def test_iter_overview_weeks_yields_normalized_records_per_week(
+        self, mock_print, mock_api_call
+    ):
+        mock_api_call.side_effect = [
+            self.page('2008-06-08', '2008-06-15',
+                      {'contributor': 'by a', 'title': 't'}),
+            self.page('2008-06-15', '', {'contributor': 'b', 'title': 'u'})
+        ]
+        weeks = crawler.iter_overview_weeks('2008-06-07')
+        self.assertEqual(next(weeks), ('2008-06-08', [
+            {'author': 'a', 'title': 'T', 'date': '2008-06-08', 'isbns': []}
+        ]))
+        mock_api_call.assert_called_once()
+        self.assertEqual(next(weeks), ('2008-06-15', [
+            {'author': 'b', 'title': 'U', 'date': '2008-06-15', 'isbns': []}
+        ]))
+        self.assertEqual(list(weeks), [])
+
+    def test_iter_overview_weeks_stops_after_end(
+        self, mock_print, mock_api_call
+    ):
+        mock_api_call.return_value = self.page(
+            '2008-06-07', '2008-06-14', {'contributor': 'a', 'title': 't'}
+        )
+        weeks = list(crawler.iter_overview_weeks('2008-06-07', '2008-06-10'))
+        self.assertEqual([date for date, _ in weeks], ['2008-06-07'])
+
+    def test_iter_audio_weeks_fetches_a_single_category(
+        self, mock_print, mock_api_call
+    ):
+        mock_api_call.return_value = self.page(
+            '2018-03-11', '', {'contributor': 'a', 'title': 't'}
+        )
+        weeks = list(crawler.iter_audio_weeks('Nonfiction', '2018-03-11'))
+        self.assertEqual(weeks, [('2018-03-11', [{
+            'author': 'a',
+            'title': 'T',
+            'date': '2018-03-11',
+            'category': 'Nonfiction',
+            'isbns': []
+        }])])
+        mock_api_call.assert_called_once_with(
+            crawler.audio_url('2018-03-11', 'Nonfiction')
+        )
 
 
-@patch('crawler.retrieve_audio_best_sellers')
 @patch('crawler.api_call')
 @patch('crawler.save_best_seller_file')
 @patch('builtins.print')
 class RetrieveNumberOnesTest(unittest.TestCase):
 
-    def test_passes_best_sellers_dict_on(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_retrieve_audio_best_sellers
+    def test_does_nothing_without_published_date(
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         best_sellers = {'_number_ones_last_updated': ""}
         crawler.retrieve_number_ones(best_sellers)
         mock_print.assert_not_called()
         mock_save_best_seller_file.assert_not_called()
         mock_api_call.assert_not_called()
-        mock_retrieve_audio_best_sellers.assert_called_once_with(best_sellers)
 
     def test_gets_number_ones_until_no_published_date(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_retrieve_audio_best_sellers
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         mock_api_call.return_value = {
             'results': {
@@ -122,6 +436,7 @@ class RetrieveNumberOnesTest(unittest.TestCase):
                         'title': 'title'
                     }]
                 }],
+                'published_date': crawler.FIRST_NYT_N1_DATE,
                 'next_published_date': ""
             }
         }
@@ -134,7 +449,8 @@ class RetrieveNumberOnesTest(unittest.TestCase):
             'number_ones': [{
                 'author': 'author',
                 'title': 'Title',
-                'date': crawler.FIRST_NYT_N1_DATE
+                'date': crawler.FIRST_NYT_N1_DATE,
+                'isbns': []
             }]
         }
         mock_save_best_seller_file.assert_called_once_with(best_sellers)
@@ -143,20 +459,24 @@ class RetrieveNumberOnesTest(unittest.TestCase):
             f'?published_date={crawler.FIRST_NYT_N1_DATE}'
             f'&api-key={crawler.API_KEY}'
         )
-        mock_retrieve_audio_best_sellers.assert_called_once_with(best_sellers)
 
     def test_processes_author_name_correctly(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_retrieve_audio_best_sellers
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         mock_api_call.return_value = {
             'results': {
                 'lists': [{
                     'books': [{
                         'contributor': 'by author',
-                        'title': 'title'
+                        'title': 'title',
+                        'primary_isbn13': '9780000000002',
+                        'isbns': [
+                            {'isbn13': '9780000000001'},
+                            {'isbn13': '9780000000002'}
+                        ]
                     }]
                 }],
+                'published_date': crawler.FIRST_NYT_N1_DATE,
                 'next_published_date': ""
             }
         }
@@ -169,7 +489,8 @@ class RetrieveNumberOnesTest(unittest.TestCase):
             'number_ones': [{
                 'author': 'author',
                 'title': 'Title',
-                'date': crawler.FIRST_NYT_N1_DATE
+                'date': crawler.FIRST_NYT_N1_DATE,
+                'isbns': ['9780000000001', '9780000000002']
             }]
         }
         mock_save_best_seller_file.assert_called_once_with(best_sellers)
@@ -178,11 +499,9 @@ class RetrieveNumberOnesTest(unittest.TestCase):
             f'?published_date={crawler.FIRST_NYT_N1_DATE}'
             f'&api-key={crawler.API_KEY}'
         )
-        mock_retrieve_audio_best_sellers.assert_called_once_with(best_sellers)
 
     def test_ignores_duplicates(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_retrieve_audio_best_sellers
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         mock_api_call.return_value = {
             'results': {
@@ -192,6 +511,7 @@ class RetrieveNumberOnesTest(unittest.TestCase):
                         'title': 'title'
                     }]
                 }],
+                'published_date': crawler.FIRST_NYT_N1_DATE,
                 'next_published_date': ""
             }
         }
@@ -213,29 +533,69 @@ class RetrieveNumberOnesTest(unittest.TestCase):
             f'?published_date={crawler.FIRST_NYT_N1_DATE}'
             f'&api-key={crawler.API_KEY}'
         )
-        mock_retrieve_audio_best_sellers.assert_called_once_with(best_sellers)
+
+    def test_stops_at_first_uncached_week_when_offline(
+        self, mock_print, mock_save_best_seller_file, mock_api_call
+    ):
+        mock_api_call.side_effect = crawler.CacheMiss('overview not cached')
+        best_sellers = {'number_ones': []}
+        crawler.retrieve_number_ones(best_sellers)
+        mock_print.assert_called_with(
+            'Stopping number ones: overview not cached'
+        )
+        mock_save_best_seller_file.assert_not_called()
+
+    @patch('crawler.WORKERS', 2)
+    @patch('crawler.weekly_schedule')
+    def test_concurrent_mode_applies_weeks_in_date_order(
+        self, mock_weekly_schedule, mock_print, mock_save_best_seller_file,
+        mock_api_call
+    ):
+        dates = ['2008-06-07', '2008-06-14', '2008-06-21']
+        mock_weekly_schedule.return_value = iter(dates)
+
+        def overview(url):
+            published_date = url.split('published_date=')[1][:10]
+            next_published_date = "" if published_date == dates[1] else 'next'
+            return {
+                'results': {
+                    'lists': [{
+                        'books': [{
+                            'contributor': 'author',
+                            'title': f'title {published_date}'
+                        }]
+                    }],
+                    'published_date': published_date,
+                    'next_published_date': next_published_date
+                }
+            }
+        mock_api_call.side_effect = overview
+        best_sellers = {'number_ones': []}
+        crawler.retrieve_number_ones(best_sellers)
+        self.assertEqual(
+            [number_one['date'] for number_one in best_sellers['number_ones']],
+            dates[:2]
+        )
+        self.assertEqual(best_sellers['_number_ones_last_updated'], dates[1])
+        self.assertEqual(mock_save_best_seller_file.call_count, 2)
 
 
-@patch('crawler.create_reading_list')
 @patch('crawler.api_call')
 @patch('crawler.save_best_seller_file')
 @patch('builtins.print')
 class RetrieveAudioBestSellers(unittest.TestCase):
 
-    def test_passes_best_sellers_on(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_create_reading_list
+    def test_does_nothing_without_published_date(
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         best_sellers = {'_audio_best_sellers_last_updated': ""}
         crawler.retrieve_audio_best_sellers(best_sellers)
         mock_print.assert_not_called()
         mock_save_best_seller_file.assert_not_called()
         mock_api_call.assert_not_called()
-        mock_create_reading_list.assert_called_once_with(best_sellers)
 
     def test_gets_audio_best_sellers_until_no_published_date(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_create_reading_list
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         mock_api_call.side_effect = [
             {
@@ -244,6 +604,7 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                         'contributor': 'author 1',
                         'title': 'title 1'
                     }],
+                    'published_date': crawler.FIRST_NYT_ABS_DATE,
                     'next_published_date': ""
                 }
             },
@@ -253,6 +614,7 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                         'contributor': 'author 2',
                         'title': 'title 2'
                     }],
+                    'published_date': crawler.FIRST_NYT_ABS_DATE,
                     'next_published_date': ""
                 }
             }
@@ -268,13 +630,15 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                     'author': 'author 1',
                     'title': 'Title 1',
                     'date': crawler.FIRST_NYT_ABS_DATE,
-                    'category': 'Fiction'
+                    'category': 'Fiction',
+                    'isbns': []
                 },
                 {
                     'author': 'author 2',
                     'title': 'Title 2',
                     'date': crawler.FIRST_NYT_ABS_DATE,
-                    'category': 'Nonfiction'
+                    'category': 'Nonfiction',
+                    'isbns': []
                 },
             ]
         }
@@ -284,11 +648,9 @@ class RetrieveAudioBestSellers(unittest.TestCase):
             f'{crawler.FIRST_NYT_ABS_DATE}/audio-Nonfiction.json'
             f'?api-key={crawler.API_KEY}'
         )
-        mock_create_reading_list.assert_called_once_with(best_sellers)
 
     def test_processes_author_name_correctly(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_create_reading_list
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         mock_api_call.side_effect = [
             {
@@ -297,6 +659,7 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                         'contributor': 'by author 1',
                         'title': 'title 1'
                     }],
+                    'published_date': crawler.FIRST_NYT_ABS_DATE,
                     'next_published_date': ""
                 }
             },
@@ -306,6 +669,7 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                         'contributor': 'by author 2',
                         'title': 'title 2'
                     }],
+                    'published_date': crawler.FIRST_NYT_ABS_DATE,
                     'next_published_date': ""
                 }
             }
@@ -321,13 +685,15 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                     'author': 'author 1',
                     'title': 'Title 1',
                     'date': crawler.FIRST_NYT_ABS_DATE,
-                    'category': 'Fiction'
+                    'category': 'Fiction',
+                    'isbns': []
                 },
                 {
                     'author': 'author 2',
                     'title': 'Title 2',
                     'date': crawler.FIRST_NYT_ABS_DATE,
-                    'category': 'Nonfiction'
+                    'category': 'Nonfiction',
+                    'isbns': []
                 },
             ]
         }
@@ -337,11 +703,9 @@ class RetrieveAudioBestSellers(unittest.TestCase):
             f'{crawler.FIRST_NYT_ABS_DATE}/audio-Nonfiction.json'
             f'?api-key={crawler.API_KEY}'
         )
-        mock_create_reading_list.assert_called_once_with(best_sellers)
 
     def test_ignores_duplicates(
-        self, mock_print, mock_save_best_seller_file, mock_api_call,
-        mock_create_reading_list
+        self, mock_print, mock_save_best_seller_file, mock_api_call
     ):
         mock_api_call.side_effect = [
             {
@@ -350,6 +714,7 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                         'contributor': 'author 1',
                         'title': 'title 1'
                     }],
+                    'published_date': crawler.FIRST_NYT_ABS_DATE,
                     'next_published_date': ""
                 }
             },
@@ -359,6 +724,7 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                         'contributor': 'author 2',
                         'title': 'title 2'
                     }],
+                    'published_date': crawler.FIRST_NYT_ABS_DATE,
                     'next_published_date': ""
                 }
             }
@@ -370,13 +736,15 @@ class RetrieveAudioBestSellers(unittest.TestCase):
                     'author': 'author 1',
                     'title': 'Title 1',
                     'date': crawler.FIRST_NYT_ABS_DATE,
-                    'category': 'Fiction'
+                    'category': 'Fiction',
+                    'isbns': []
                 },
                 {
                     'author': 'author 2',
                     'title': 'Title 2',
                     'date': crawler.FIRST_NYT_ABS_DATE,
-                    'category': 'Nonfiction'
+                    'category': 'Nonfiction',
+                    'isbns': []
                 },
             ]
         }
@@ -390,7 +758,129 @@ class RetrieveAudioBestSellers(unittest.TestCase):
             f'{crawler.FIRST_NYT_ABS_DATE}/audio-Nonfiction.json'
             f'?api-key={crawler.API_KEY}'
         )
-        mock_create_reading_list.assert_called_once_with(best_sellers)
+
+
+class AsyncApiTest(unittest.IsolatedAsyncioTestCase):
+
+    @patch('crawler.RATE_LIMITER')
+    async def test_call_decodes_json_response(self, mock_rate_limiter):
+        mock_rate_limiter.acquire_async = AsyncMock(return_value=None)
+        client = AsyncMock()
+        client.get.return_value = Mock(
+            status_code=200, content=b'{"key": "value"}'
+        )
+        api = crawler.AsyncApi(client, 2)
+        self.assertEqual(await api.call('url'), {'key': 'value'})
+        client.get.assert_called_once_with('url')
+        mock_rate_limiter.acquire_async.assert_awaited_once_with()
+
+    @patch('asyncio.sleep')
+    @patch('builtins.print')
+    @patch('crawler.RATE_LIMITER')
+    async def test_call_shares_the_retry_decision_of_the_sync_engine(
+        self, mock_rate_limiter, mock_print, mock_sleep
+    ):
+        mock_rate_limiter.acquire_async = AsyncMock(return_value=None)
+        request = httpx.Request('GET', 'url')
+        client = AsyncMock()
+        client.get.side_effect = [
+            httpx.Response(429, headers={'Retry-After': '7'},
+                           request=request),
+            httpx.Response(200, content=b'{"key": "value"}',
+                           request=request)
+        ]
+        api = crawler.AsyncApi(client, 2)
+        self.assertEqual(await api.call('url'), {'key': 'value'})
+        mock_sleep.assert_awaited_once_with(7.0)
+        mock_print.assert_called_once_with(
+            'HTTP 429, retrying in 7.0 seconds'
+        )
+
+    async def test_fetch_in_order_yields_responses_in_url_order(self):
+        api = crawler.AsyncApi(AsyncMock(), 3)
+
+        async def slow_first(url):
+            if url == 'url 0':
+                await asyncio.sleep(0.01)
+            return url
+        api.call = slow_first
+        urls = [f'url {i}' for i in range(5)]
+        self.assertEqual([url async for url in api.fetch_in_order(urls)], urls)
+
+
+def overview_page(url, last='2008-06-21'):
+    # An overview page published on the url's date, the last one without a
+    # next_published_date
+    published_date = url.split('published_date=')[1][:10]
+    next_published_date = ''
+    if published_date != last:
+        next_published_date = (
+            datetime.date.fromisoformat(published_date) +
+            datetime.timedelta(days=7)
+        ).isoformat()
+    return {
+        'results': {
+            'lists': [{
+                'books': [{
+                    'contributor': 'by author',
+                    'title': f'title {published_date}'
+                }]
+            }],
+            'published_date': published_date,
+            'next_published_date': next_published_date
+        }
+    }
+
+
+class FakeAsyncApi:
+
+    def __init__(self, client, workers):
+        pass
+
+    async def fetch_in_order(self, urls):
+        for url in urls:
+            await asyncio.sleep(0)
+            yield overview_page(url)
+
+
+@patch('crawler.api_call', side_effect=overview_page)
+@patch('crawler.save_best_seller_file')
+@patch('builtins.print')
+@patch.multiple(crawler, ENGINE='async', AsyncApi=FakeAsyncApi)
+class AsyncEngineTest(unittest.TestCase):
+
+    def test_number_ones_run_the_shared_crawl_loop(
+        self, mock_print, mock_save_best_seller_file, mock_api_call
+    ):
+        dates = ['2008-06-07', '2008-06-14', '2008-06-21']
+        best_sellers = {'number_ones': []}
+        crawler.retrieve_number_ones(best_sellers)
+        self.assertEqual(best_sellers, {
+            '_number_ones_last_updated': dates[-1],
+            'number_ones': [
+                {
+                    'author': 'author',
+                    'title': f'Title {date}',
+                    'date': date,
+                    'isbns': []
+                }
+                for date in dates
+            ]
+        })
+        self.assertEqual(mock_save_best_seller_file.call_count, 3)
+        mock_api_call.assert_called_once_with(
+            crawler.overview_url(dates[0])
+        )
+
+    def test_scheduled_crawl_stops_at_end(
+        self, mock_print, mock_save_best_seller_file, mock_api_call
+    ):
+        best_sellers = {'number_ones': []}
+        crawler.retrieve_number_ones(best_sellers, end='2008-06-20')
+        self.assertEqual(
+            [book['date'] for book in best_sellers['number_ones']],
+            ['2008-06-07', '2008-06-14']
+        )
 
 
 @patch('crawler.save_best_seller_file')
@@ -432,7 +922,9 @@ class CreateReadingListTest(unittest.TestCase):
             }]
         }
         crawler.create_reading_list(best_sellers)
-        mock_print.assert_called_once_with('author, Title, 2018-03-11, Fiction')
+        mock_print.assert_called_once_with(
+            'author, Title, 2018-03-11, Fiction', file=None
+        )
         best_sellers['reading_list'] = [{
             'author': 'author',
             'title': 'Title',
@@ -442,6 +934,613 @@ class CreateReadingListTest(unittest.TestCase):
         }]
         mock_save_best_seller_file.assert_called_once_with(best_sellers)
 
+    def test_reading_list_keeps_audio_order_and_first_number_one(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        best_sellers = {
+            'audio_best_sellers': [
+                {
+                    'author': 'author 2',
+                    'title': 'Title 2',
+                    'date': '2018-03-11',
+                    'category': 'Nonfiction'
+                },
+                {
+                    'author': 'author 1',
+                    'title': 'Title 1',
+                    'date': '2018-03-11',
+                    'category': 'Fiction'
+                }
+            ],
+            'number_ones': [
+                {'author': 'author 1', 'title': 'Title 1', 'date': '2019'},
+                {'author': 'author 2', 'title': 'Title 2', 'date': '2008'},
+                {'author': 'author 1', 'title': 'Title 1', 'date': '2020'}
+            ]
+        }
+        crawler.create_reading_list(best_sellers)
+        self.assertEqual(best_sellers['reading_list'], [
+            {
+                'author': 'author 2',
+                'title': 'Title 2',
+                'date': '2018-03-11',
+                'category': 'Nonfiction',
+                'match': 'exact',
+                'confidence': 1.0
+            },
+            {
+                'author': 'author 1',
+                'title': 'Title 1',
+                'date': '2019',
+                'category': 'Fiction',
+                'match': 'exact',
+                'confidence': 1.0
+            }
+        ])
+
+    def test_reading_list_matches_on_isbn_then_fuzzy_with_confidence(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        best_sellers = {
+            'audio_best_sellers': [
+                {
+                    'author': 'Jane Doe; read by Sam Roe',
+                    'title': 'Something Else',
+                    'date': '2018-03-11',
+                    'category': 'Fiction',
+                    'isbns': ['9780000000001']
+                },
+                {
+                    'author': 'Tom Clancy and Mark Greaney',
+                    'title': 'Command Authority: A Novel',
+                    'date': '2018-03-11',
+                    'category': 'Fiction',
+                    'isbns': []
+                }
+            ],
+            'number_ones': [
+                {
+                    'author': 'Jane Doe',
+                    'title': 'Some Title',
+                    'date': '2019',
+                    'isbns': ['9780000000001', '9780000000002']
+                },
+                {
+                    'author': 'Tom Clancy with Mark Greaney',
+                    'title': 'Command Authority',
+                    'date': '2013',
+                    'isbns': ['9780000000003']
+                }
+            ]
+        }
+        crawler.create_reading_list(best_sellers)
+        self.assertEqual(
+            [
+                (book['match'], book['confidence'], book['date'])
+                for book in best_sellers['reading_list']
+            ],
+            [('isbn', 1.0, '2019'), ('fuzzy', 0.86, '2018-03-11')]
+        )
+        mock_print.assert_called_with(
+            'Tom Clancy and Mark Greaney, Command Authority: A Novel, '
+            '2018-03-11, Fiction (fuzzy match, confidence 0.86)',
+            file=None
+        )
+
+    def test_reading_list_is_streamed_to_outfile(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        best_sellers = {
+            'audio_best_sellers': [{
+                'author': 'author',
+                'title': 'Title',
+                'date': '2008-06-07',
+                'category': 'Fiction'
+            }],
+            'number_ones': [{
+                'author': 'author',
+                'title': 'Title',
+                'date': '2018-03-11'
+            }]
+        }
+        outfile = io.StringIO()
+        crawler.create_reading_list(best_sellers, outfile)
+        mock_print.assert_called_once_with(
+            'author, Title, 2018-03-11, Fiction', file=outfile
+        )
+
+    def test_reading_list_only_joins_new_books(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        def audio(number, isbns=()):
+            return {
+                'author': 'author', 'title': f'Title {number}',
+                'date': '2018-03-11', 'category': 'Fiction', 'isbns': isbns
+            }
+
+        def number_one(number, date, isbns=()):
+            return {
+                'author': 'author', 'title': f'Title {number}', 'date': date,
+                'isbns': isbns
+            }
+
+        best_sellers = {
+            'audio_best_sellers': [audio(1), audio(2, ['9780000000002'])],
+            'number_ones': [number_one(1, '2019')]
+        }
+        crawler.create_reading_list(best_sellers)
+        mock_print.reset_mock()
+        best_sellers['audio_best_sellers'].append(audio(3))
+        best_sellers['number_ones'].extend([
+            number_one(3, '2021'),
+            number_one('1 (Reissue)', '2022', ['9780000000002'])
+        ])
+        with patch('crawler.BookMatcher', wraps=crawler.BookMatcher) as (
+            mock_book_matcher
+        ):
+            crawler.create_reading_list(best_sellers)
+        self.assertEqual(
+            [len(args[0]) for args, _ in mock_book_matcher.call_args_list],
+            [2, 2, 3]
+        )
+        self.assertEqual(mock_print.call_args_list, [
+            call('author, Title 2, 2022, Fiction', file=None),
+            call('author, Title 3, 2021, Fiction', file=None)
+        ])
+        self.assertEqual(
+            best_sellers['reading_list'],
+            list(crawler.iter_reading_list(best_sellers))
+        )
+        self.assertEqual(best_sellers['_reading_list_number_ones'], 3)
+        self.assertEqual(best_sellers['_reading_list_audio_best_sellers'], 3)
+
+    def test_newly_matched_audio_best_seller_keeps_audio_order(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        best_sellers = {
+            'audio_best_sellers': [
+                {
+                    'author': f'author {number}', 'title': 'Title',
+                    'date': '2018-03-11', 'category': 'Fiction'
+                }
+                for number in range(1, 5)
+            ],
+            'number_ones': [
+                {'author': 'author 1', 'title': 'Title', 'date': '2008'},
+                {'author': 'author 3', 'title': 'Title', 'date': '2008'}
+            ]
+        }
+        crawler.create_reading_list(best_sellers)
+        best_sellers['number_ones'].append(
+            {'author': 'author 2', 'title': 'Title', 'date': '2019'}
+        )
+        with patch.object(
+            crawler.BookMatcher, 'match', autospec=True,
+            side_effect=crawler.BookMatcher.match
+        ) as mock_match:
+            crawler.create_reading_list(best_sellers)
+        self.assertEqual(
+            [args[1]['author'] for args, _ in mock_match.call_args_list],
+            ['author 2']
+        )
+        self.assertEqual(
+            [book['author'] for book in best_sellers['reading_list']],
+            ['author 1', 'author 2', 'author 3']
+        )
+        self.assertEqual(
+            best_sellers['reading_list'],
+            list(crawler.iter_reading_list(best_sellers))
+        )
+
+    def test_better_match_updates_entry_in_place(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        best_sellers = {
+            'audio_best_sellers': [{
+                'author': 'author', 'title': 'Title', 'date': '2018-03-11',
+                'category': 'Fiction', 'isbns': ['9780000000001']
+            }],
+            'number_ones': [
+                {'author': 'author', 'title': 'Title', 'date': '2008'}
+            ],
+            'reading_list': [{
+                'author': 'author', 'title': 'Title', 'date': '2018-03-11',
+                'category': 'Fiction', 'match': 'exact', 'confidence': 1.0
+            }],
+            '_reading_list_number_ones': '1',
+            '_reading_list_audio_best_sellers': '1'
+        }
+        reading_list = best_sellers['reading_list']
+        best_sellers['number_ones'].append({
+            'author': 'Author', 'title': 'Title', 'date': '2019',
+            'isbns': ['9780000000001']
+        })
+        crawler.create_reading_list(best_sellers)
+        self.assertIs(best_sellers['reading_list'], reading_list)
+        self.assertEqual(
+            [(book['match'], book['date']) for book in reading_list],
+            [('isbn', '2019')]
+        )
+        mock_print.assert_called_once_with(
+            'author, Title, 2019, Fiction (updated)', file=None
+        )
+
+
+@patch('crawler.api_call')
+class FetchRankedListsTest(unittest.TestCase):
+
+    def book(self, rank):
+        return {
+            'rank': rank,
+            'weeks_on_list': 1,
+            'primary_isbn13': '978000000000' + str(rank),
+            'contributor': 'by author',
+            'title': 'TITLE'
+        }
+
+    def row(self, rank):
+        return {
+            'rank': rank,
+            'weeks_on_list': 1,
+            'isbn13': '978000000000' + str(rank),
+            'author': 'author',
+            'title': 'Title'
+        }
+
+    def test_single_list_uses_its_own_endpoint(self, mock_api_call):
+        mock_api_call.return_value = {'results': {
+            'published_date': '2008-06-08',
+            'next_published_date': '2008-06-15',
+            'books': [self.book(1)]
+        }}
+        rankings = storage.RankingStore(None)
+        self.assertEqual(
+            crawler.fetch_ranked_lists(
+                '2008-06-07', ['hardcover-fiction'], rankings
+            ),
+            ('2008-06-15', {
+                'hardcover-fiction': ('2008-06-08', [self.row(1)])
+            })
+        )
+        self.assertIn(
+            '/lists/2008-06-07/hardcover-fiction.json',
+            mock_api_call.call_args.args[0]
+        )
+
+    def test_several_lists_share_one_full_overview_call(self, mock_api_call):
+        mock_api_call.return_value = {'results': {
+            'published_date': '2008-06-08',
+            'next_published_date': '2008-06-15',
+            'lists': [
+                {'list_name_encoded': 'a', 'books': [self.book(1)]},
+                {'list_name_encoded': 'b', 'books': [self.book(2)]},
+                {'list_name_encoded': 'c', 'books': [self.book(3)]}
+            ]
+        }}
+        rankings = storage.RankingStore(None)
+        next_published_date, fetched = crawler.fetch_ranked_lists(
+            '2008-06-07', ['a', 'c'], rankings
+        )
+        self.assertEqual(sorted(fetched), ['a', 'c'])
+        mock_api_call.assert_called_once()
+        self.assertIn('full-overview.json', mock_api_call.call_args.args[0])
+
+    def test_lists_missing_from_overview_are_fetched_unless_stored(
+        self, mock_api_call
+    ):
+        mock_api_call.side_effect = [
+            {'results': {
+                'published_date': '2008-06-08',
+                'next_published_date': '2008-06-15',
+                'lists': [{'list_name_encoded': 'a', 'books': []}]
+            }},
+            {'results': {
+                'published_date': '2008-06-01',
+                'next_published_date': '2008-07-06',
+                'books': [self.book(1)]
+            }}
+        ]
+        rankings = storage.RankingStore(None)
+        rankings.latest['c'] = '2008-07-06'
+        next_published_date, fetched = crawler.fetch_ranked_lists(
+            '2008-06-07', ['a', 'b', 'c'], rankings
+        )
+        self.assertEqual(next_published_date, '2008-06-15')
+        self.assertEqual(fetched['b'], ('2008-06-01', [self.row(1)]))
+        self.assertNotIn('c', fetched)
+        self.assertEqual(mock_api_call.call_count, 2)
+
+    @patch('crawler.save_best_seller_file')
+    @patch('builtins.print')
+    def test_single_list_crawl_advances_on_resume(
+        self, mock_print, mock_save_best_seller_file, mock_api_call
+    ):
+        mock_api_call.side_effect = [
+            {'results': {
+                'published_date': '2008-06-08',
+                'next_published_date': '2008-06-15',
+                'books': [self.book(1)]
+            }},
+            {'results': {
+                'published_date': '2008-06-15',
+                'next_published_date': '',
+                'books': [self.book(2)]
+            }}
+        ]
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        rankings = storage.RankingStore(
+            os.path.join(tmpdir.name, 'rankings.jsonl')
+        )
+        rankings.append_week('2008-06-08', {
+            'hardcover-fiction': ('2008-06-08', [self.row(1)])
+        })
+        self.addCleanup(rankings.close)
+        best_sellers = {'_rankings_last_updated': '2008-06-08'}
+        with patch.multiple(
+            crawler, RANKED_LISTS=['hardcover-fiction'],
+            get_rankings=Mock(return_value=rankings)
+        ):
+            crawler.retrieve_rankings(best_sellers)
+        self.assertEqual(best_sellers['_rankings_last_updated'], '2008-06-15')
+        self.assertEqual(len(rankings), 2)
+
+
+@patch('crawler.save_best_seller_file')
+@patch('builtins.print')
+class RunPipelineTest(unittest.TestCase):
+
+    def stages(self, calls, barrier=None):
+        def stage(name):
+            def run(best_sellers):
+                if barrier is not None and name != 'reading-list':
+                    barrier.wait(timeout=5)
+                calls.append(name)
+            return run
+        return {
+            name: stage_._replace(run=stage(name))
+            for name, stage_ in crawler.STAGES.items()
+        }
+
+    def test_runs_independent_crawls_concurrently_before_reading_list(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        calls = []
+        barrier = threading.Barrier(2)
+        best_sellers = {}
+        with patch.dict(crawler.STAGES, self.stages(calls, barrier)):
+            crawler.run_pipeline(best_sellers)
+        self.assertEqual(
+            sorted(calls[:2]), ['audio-best-sellers', 'number-ones']
+        )
+        self.assertEqual(calls[2], 'reading-list')
+        self.assertEqual(best_sellers, {})
+        mock_save_best_seller_file.assert_not_called()
+
+    def test_stage_sections_are_the_lists_a_run_needs(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        self.assertEqual(
+            crawler.stage_sections(['number-ones', 'rankings']),
+            {'number_ones'}
+        )
+        self.assertEqual(
+            crawler.stage_sections(['reading-list']),
+            {'number_ones', 'audio_best_sellers', 'reading_list'}
+        )
+
+    def test_only_runs_selected_stages(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        calls = []
+        with patch.dict(crawler.STAGES, self.stages(calls)):
+            crawler.run_pipeline({}, only=['reading-list'])
+        self.assertEqual(calls, ['reading-list'])
+        mock_print.assert_called_once_with('Running stage reading-list')
+
+
+class ShardRangesTest(unittest.TestCase):
+
+    def test_splits_weeks_into_adjacent_ranges(self):
+        self.assertEqual(
+            crawler.shard_ranges('2008-06-07', '2008-07-05', 2),
+            [('2008-06-07', '2008-06-20'), ('2008-06-21', '2008-07-05')]
+        )
+
+    def test_never_makes_empty_shards(self):
+        self.assertEqual(
+            crawler.shard_ranges('2008-06-07', '2008-06-10', 3),
+            [('2008-06-07', '2008-06-10')]
+        )
+
+
+@patch('crawler.save_best_seller_file')
+@patch('builtins.print')
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        patcher = patch('crawler.SHARD_DIR', tmpdir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('crawler.STORAGE')
+        self.mock_storage = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_shard(self, shard, state):
+        storage.JsonStorage(crawler.shard_path(shard)).save(state)
+
+    @patch('crawler.retrieve_audio_best_sellers')
+    @patch('crawler.retrieve_number_ones')
+    def test_run_shard_crawls_its_own_date_range(
+        self, mock_retrieve_number_ones, mock_retrieve_audio_best_sellers,
+        mock_print, mock_save_best_seller_file
+    ):
+        crawler.run_shard(1, 2, '2019-01-05')
+        best_sellers = mock_retrieve_number_ones.call_args[0][0]
+        mock_retrieve_number_ones.assert_called_once_with(
+            best_sellers, '2019-01-05'
+        )
+        mock_retrieve_audio_best_sellers.assert_called_once_with(
+            best_sellers, '2019-01-05'
+        )
+        number_ones_ranges = crawler.shard_ranges(
+            crawler.FIRST_NYT_N1_DATE, '2019-01-05', 2
+        )
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], number_ones_ranges[1][0]
+        )
+        self.assertTrue(best_sellers['_completed'])
+        self.assertEqual(crawler.STORAGE.path, crawler.shard_path(1))
+
+    def test_worker_keeps_the_rate_limit_file_of_a_normal_crawl(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        state_file = os.path.join(crawler.SHARD_DIR, 'rate_limit.json')
+        for api_keys in [['a'], ['a', 'b']]:
+            pool = KeyPool(api_keys, [(5, 60)])
+            pool.persist_to(state_file)
+            queue = multiprocessing.Queue()
+            queue.put('a')
+            with patch.multiple(
+                crawler, RATE_LIMIT_FILE=state_file, API_KEY=None,
+                RATE_LIMITER=pool, RESPONSE_CACHE=None, WORKERS=1
+            ):
+                crawler.init_shard_worker(queue, len(api_keys), 1, False)
+                self.assertEqual(
+                    crawler.RATE_LIMITER.state_file,
+                    pool.limiters['a'].state_file
+                )
+
+    def test_merge_keeps_earliest_date_and_advances_cursor_over_prefix(
+        self, mock_print, mock_save_best_seller_file
+    ):
+        self.write_shard(0, {
+            'number_ones': [{'author': 'a', 'title': 'T', 'date': '2009'}],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2009',
+            '_audio_best_sellers_last_updated': '2018',
+            '_completed': True
+        })
+        self.write_shard(2, {
+            'number_ones': [{'author': 'b', 'title': 'U', 'date': '2012'}],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2012',
+            '_audio_best_sellers_last_updated': '2020',
+            '_completed': True
+        })
+        best_sellers = crawler.BestSellers({
+            'number_ones': [{'author': 'a', 'title': 'T', 'date': '2010'}],
+            'audio_best_sellers': []
+        })
+        crawler.merge_shards(best_sellers, 3)
+        self.assertEqual(best_sellers, {
+            'number_ones': [
+                {'author': 'a', 'title': 'T', 'date': '2009'},
+                {'author': 'b', 'title': 'U', 'date': '2012'}
+            ],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2009',
+            '_audio_best_sellers_last_updated': '2018'
+        })
+        self.mock_storage.reset.assert_called_once_with()
+        mock_save_best_seller_file.assert_called_once_with(best_sellers)
+
+
+@patch('crawler.STORAGE')
+class CommandsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = tmpdir.name
+        with open(os.path.join(self.path, 'best_sellers.json'), 'w') as file:
+            json.dump({
+                'number_ones': [{
+                    'author': 'author', 'title': 'Title', 'date': '2019',
+                    'isbns': ['9780000000001', '9780000000002']
+                }],
+                'audio_best_sellers': [],
+                'reading_list': [{
+                    'author': 'author', 'title': 'Title', 'date': '2019',
+                    'category': 'Fiction', 'match': 'fuzzy',
+                    'confidence': 0.9
+                }],
+                '_number_ones_last_updated': '2019'
+            }, file)
+
+    def run_command(self, *argv):
+        output = io.StringIO()
+        with contextlib.chdir(self.path):
+            with contextlib.redirect_stdout(output):
+                crawler.main(list(argv))
+        return output.getvalue()
+
+    def test_bare_options_run_a_crawl(self, mock_storage):
+        mock_crawl = Mock()
+        with patch.dict(crawler.COMMANDS, {'crawl': mock_crawl}):
+            self.run_command('--only', 'reading-list')
+        args = mock_crawl.call_args.args[0]
+        self.assertEqual(args.command, 'crawl')
+        self.assertEqual(args.only, ['reading-list'])
+
+    @patch('crawler.API_KEYS', [])
+    def test_crawling_needs_an_api_key(self, mock_storage):
+        with patch('sys.stderr', io.StringIO()) as mock_stderr:
+            with self.assertRaises(SystemExit):
+                self.run_command('crawl')
+        self.assertIn('NYT_API_KEY', mock_stderr.getvalue())
+
+    def test_reading_list_prints_the_stored_entries(self, mock_storage):
+        self.assertEqual(
+            self.run_command('reading-list'),
+            'author, Title, 2019, Fiction (fuzzy match, confidence 0.9)\n'
+        )
+
+    def test_export_writes_csv(self, mock_storage):
+        self.assertEqual(
+            self.run_command('export', 'number_ones').splitlines(),
+            ['author,title,date,isbns',
+             'author,Title,2019,9780000000001 9780000000002']
+        )
+
+    def test_stats_counts_lists_and_shows_cursors(self, mock_storage):
+        self.assertEqual(json.loads(self.run_command('stats')), {
+            'number_ones': 1,
+            'audio_best_sellers': 0,
+            'reading_list': 1,
+            '_number_ones_last_updated': '2019'
+        })
+
+    def test_read_commands_do_not_seed_other_backends(self, mock_storage):
+        for backend in ['snapshot', 'sqlite']:
+            for command in [
+                ['reading-list'], ['export', 'number_ones'], ['stats']
+            ]:
+                self.assertNotEqual(
+                    self.run_command(command[0], '--storage', backend,
+                                     *command[1:]),
+                    ''
+                )
+        self.assertEqual(os.listdir(self.path), ['best_sellers.json'])
+
+    def test_import_needs_no_key_and_no_network_stack(self, mock_storage):
+        env = {
+            name: value for name, value in os.environ.items()
+            if not name.startswith('NYT_API_KEY')
+        }
+        result = subprocess.run(
+            [
+                sys.executable, '-c',
+                'import sys, crawler; print(sorted({"requests", '
+                '"titlecase", "asyncio"} & set(sys.modules)))'
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=env, capture_output=True, text=True, check=True
+        )
+        self.assertEqual(result.stdout, '[]\n')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,387 @@
+import datetime
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import call, patch
+import crawler
+import fake_api
+import metrics
+from cache import ResponseCache
+from ratelimit import RateLimiter
+from storage import JsonStorage
+
+
+class FakeNytBooksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fake_api.FakeNytBooks('2008-06-08', '2008-06-22', lists=3)
+
+    def results(self, url):
+        status, headers, body = self.fake.respond(url)
+        self.assertEqual(status, 200)
+        return json.loads(body)['results']
+
+    def test_published_date_is_searched_forward(self):
+        results = self.results(
+            '/svc/books/v3/lists/overview.json?published_date=2008-06-09'
+        )
+        self.assertEqual(results['published_date'], '2008-06-15')
+        self.assertEqual(results['next_published_date'], '2008-06-22')
+        self.assertEqual(len(results['lists']), 3)
+        self.assertEqual(len(results['lists'][0]['books']), 1)
+
+    def test_last_week_has_no_next_published_date(self):
+        results = self.results(
+            '/svc/books/v3/lists/2008-06-22/audio-Fiction.json'
+        )
+        self.assertEqual(results['next_published_date'], '')
+        self.assertEqual(len(results['books']), 15)
+
+    def test_dates_after_the_last_week_are_not_found(self):
+        status, headers, body = self.fake.respond(
+            '/svc/books/v3/lists/2008-06-23/list-0.json'
+        )
+        self.assertEqual(status, 404)
+
+    def test_current_lists_are_the_newest_week_with_an_etag(self):
+        results = self.results('/svc/books/v3/lists/overview.json')
+        self.assertEqual(results['published_date'], '2008-06-22')
+        self.assertEqual(results['previous_published_date'], '2008-06-15')
+        status, headers, body = self.fake.respond(
+            '/svc/books/v3/lists/current/audio-Fiction.json'
+        )
+        self.assertEqual(json.loads(body)['results']['published_date'],
+                         '2008-06-22')
+        self.assertEqual(
+            self.fake.respond(
+                '/svc/books/v3/lists/current/audio-Fiction.json',
+                {'If-None-Match': headers['ETag']}
+            ),
+            (304, {'ETag': headers['ETag']}, b'')
+        )
+
+    def test_throttles_the_configured_share_of_calls(self):
+        fake = fake_api.FakeNytBooks(error_rate=1.0, retry_after=2)
+        self.assertEqual(
+            fake.respond('/svc/books/v3/lists/overview.json'),
+            (429, {'Retry-After': '2'}, b'{}')
+        )
+        self.assertEqual(fake.errors, 1)
+
+
+@patch('builtins.print')
+class ServeTest(unittest.TestCase):
+
+    def test_crawler_backfills_from_the_fake_server(self, mock_print):
+        fake = fake_api.FakeNytBooks('2008-06-08', '2008-06-22', lists=2)
+        server = fake.serve()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        best_sellers = {
+            'number_ones': [],
+            '_number_ones_last_updated': '2008-06-07'
+        }
+        with patch.multiple(
+            crawler,
+            API_BASE=fake_api.base_url(server),
+            SESSION=None,
+            RESPONSE_CACHE=None,
+            RATE_LIMITER=RateLimiter([(100, 1)]),
+            STORAGE=JsonStorage(os.path.join(tmpdir.name, 'state.json'))
+        ):
+            crawler.retrieve_number_ones(best_sellers)
+        self.assertEqual(fake.calls, 3)
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2008-06-22'
+        )
+        self.assertEqual(
+            [book['title'] for book in best_sellers['number_ones']],
+            ['Book 0-0', 'Book 1-0']
+        )
+
+    def crawl(self, fake, **patches):
+        server = fake.serve()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        best_sellers = {
+            'number_ones': [],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2008-06-07',
+            '_audio_best_sellers_last_updated': '2008-06-07'
+        }
+        with patch.multiple(
+            crawler,
+            API_BASE=fake_api.base_url(server),
+            SESSION=None,
+            RESPONSE_CACHE=None,
+            RATE_LIMITER=RateLimiter([(1000, 1)]),
+            STORAGE=JsonStorage(os.path.join(tmpdir.name, 'state.json')),
+            **patches
+        ):
+            crawler.crawl_number_ones(best_sellers)
+            crawler.crawl_audio_best_sellers(best_sellers)
+        return best_sellers
+
+    def test_concurrent_crawl_labels_weeks_with_their_published_date(
+        self, mock_print
+    ):
+        sequential = self.crawl(
+            fake_api.FakeNytBooks('2008-06-08', '2008-08-31', lists=2)
+        )
+        self.assertEqual(
+            sequential['_number_ones_last_updated'], '2008-08-31'
+        )
+        self.assertEqual(
+            sequential['number_ones'][0]['date'], '2008-06-08'
+        )
+        concurrent = self.crawl(
+            fake_api.FakeNytBooks('2008-06-08', '2008-08-31', lists=2),
+            WORKERS=4
+        )
+        self.assertEqual(concurrent, sequential)
+
+    def test_concurrent_crawl_skips_pages_of_an_applied_week(
+        self, mock_print
+    ):
+        sequential = self.crawl(
+            fake_api.FakeNytBooks('2008-06-08', '2008-06-29', lists=2)
+        )
+        concurrent = self.crawl(
+            fake_api.FakeNytBooks('2008-06-08', '2008-06-29', lists=2),
+            WORKERS=4,
+            SCHEDULE_INTERVAL=datetime.timedelta(days=3)
+        )
+        self.assertEqual(concurrent, sequential)
+        for published_date in ['2008-06-15', '2008-06-22', '2008-06-29']:
+            self.assertEqual(mock_print.call_args_list.count(
+                call(f'Getting number ones from {published_date}')
+            ), 2)
+
+    def test_async_crawl_labels_weeks_with_their_published_date(
+        self, mock_print
+    ):
+        sequential = self.crawl(
+            fake_api.FakeNytBooks('2008-06-08', '2008-06-29', lists=2)
+        )
+        concurrent = self.crawl(
+            fake_api.FakeNytBooks('2008-06-08', '2008-06-29', lists=2),
+            WORKERS=4,
+            ENGINE='async',
+            SCHEDULE_INTERVAL=datetime.timedelta(days=3)
+        )
+        self.assertEqual(concurrent, sequential)
+
+    def test_cached_newest_week_does_not_stop_the_next_crawl(
+        self, mock_print
+    ):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        clock = [time.time()]
+        response_cache = ResponseCache(
+            os.path.join(tmpdir.name, 'cache'), lambda: clock[0]
+        )
+        best_sellers = {
+            'number_ones': [],
+            '_number_ones_last_updated': '2008-06-07'
+        }
+        for end in ['2008-06-22', '2008-07-06']:
+            fake = fake_api.FakeNytBooks('2008-06-08', end, lists=2)
+            server = fake.serve()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            with patch.multiple(
+                crawler,
+                API_BASE=fake_api.base_url(server),
+                SESSION=None,
+                RESPONSE_CACHE=response_cache,
+                RATE_LIMITER=RateLimiter([(100, 1)]),
+                STORAGE=JsonStorage(os.path.join(tmpdir.name, 'state.json'))
+            ):
+                crawler.retrieve_number_ones(best_sellers)
+            clock[0] += 2 * 24 * 60 * 60
+        self.assertEqual(fake.calls, 3)
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2008-07-06'
+        )
+
+
+@patch('builtins.print')
+class RefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = fake_api.FakeNytBooks('2018-03-04', '2018-03-25', lists=2)
+        server = self.fake.serve()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        patcher = patch.multiple(
+            crawler,
+            API_BASE=fake_api.base_url(server),
+            SESSION=None,
+            RESPONSE_CACHE=ResponseCache(os.path.join(tmpdir.name, 'cache')),
+            RATE_LIMITER=RateLimiter([(100, 1)]),
+            STORAGE=JsonStorage(os.path.join(tmpdir.name, 'state.json')),
+            METRICS=metrics.Metrics()
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def refresh(self, best_sellers):
+        crawler.refresh_number_ones(best_sellers)
+        crawler.refresh_audio_best_sellers(best_sellers)
+
+    def test_routine_refresh_costs_three_calls(self, mock_print):
+        best_sellers = crawler.BestSellers({
+            'number_ones': [],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2018-03-18',
+            '_audio_best_sellers_last_updated': '2018-03-18'
+        })
+        self.refresh(best_sellers)
+        self.assertEqual(self.fake.calls, 3)
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2018-03-25'
+        )
+        self.assertEqual(
+            best_sellers['_audio_best_sellers_last_updated'], '2018-03-25'
+        )
+        audio_best_sellers = list(best_sellers['audio_best_sellers'])
+        self.refresh(best_sellers)
+        self.assertEqual(self.fake.calls, 6)
+        self.assertEqual(crawler.METRICS.value(
+            'nyt_api_calls_total', endpoint='overview', status=304
+        ), 1)
+        self.assertEqual(crawler.METRICS.value(
+            'nyt_api_calls_total', endpoint='audio-Fiction', status=304
+        ), 1)
+        self.assertEqual(
+            best_sellers['audio_best_sellers'], audio_best_sellers
+        )
+        mock_print.assert_any_call('Number ones are up to date (2018-03-25)')
+
+    def test_missed_weeks_are_walked_before_the_newest(self, mock_print):
+        best_sellers = crawler.BestSellers({
+            'number_ones': [],
+            '_number_ones_last_updated': '2018-03-04'
+        })
+        crawler.refresh_number_ones(best_sellers)
+        self.assertEqual(self.fake.calls, 4)
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2018-03-25'
+        )
+        for published_date in ['2018-03-04', '2018-03-11', '2018-03-18']:
+            mock_print.assert_any_call(
+                f'Getting number ones from {published_date}'
+            )
+
+    def test_newest_week_waits_for_missed_weeks(self, mock_print):
+        best_sellers = crawler.BestSellers({
+            'number_ones': [],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2018-03-04',
+            '_audio_best_sellers_last_updated': '2018-03-04'
+        })
+        with patch('crawler.retrieve_number_ones'), \
+                patch('crawler.retrieve_audio_best_sellers'):
+            self.refresh(best_sellers)
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2018-03-04'
+        )
+        self.assertEqual(
+            best_sellers['_audio_best_sellers_last_updated'], '2018-03-04'
+        )
+        self.assertEqual(best_sellers['number_ones'], [])
+        self.assertEqual(best_sellers['audio_best_sellers'], [])
+        mock_print.assert_any_call(
+            'Missed weeks stop at 2018-03-04, before 2018-03-18; '
+            'not applying the newest week'
+        )
+
+
+@patch('builtins.print')
+class OfflineRebuildTest(unittest.TestCase):
+
+    def setUp(self):
+        fake = fake_api.FakeNytBooks('2008-06-08', '2008-06-22', lists=2)
+        server = fake.serve()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.state_file = os.path.join(tmpdir.name, 'state.json')
+        self.cache_dir = os.path.join(tmpdir.name, 'cache')
+        patcher = patch.multiple(
+            crawler,
+            API_BASE=fake_api.base_url(server),
+            SESSION=None,
+            RESPONSE_CACHE=ResponseCache(self.cache_dir),
+            RATE_LIMITER=RateLimiter([(100, 1)]),
+            STORAGE=JsonStorage(self.state_file)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        crawler.retrieve_number_ones(crawler.BestSellers({
+            'number_ones': [],
+            '_number_ones_last_updated': '2008-06-07'
+        }))
+        with open(self.state_file, 'rb') as infile:
+            self.saved = infile.read()
+
+    def rebuild(self, **patches):
+        with patch.multiple(crawler, OFFLINE=True, **patches):
+            return crawler.rebuild_offline(['number-ones'])
+
+    def test_rebuild_with_workers_reads_a_sequential_cache(
+        self, mock_print
+    ):
+        best_sellers = self.rebuild(WORKERS=4)
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2008-06-22'
+        )
+
+    def test_sequential_rebuild_reads_a_cache_filled_by_workers(
+        self, mock_print
+    ):
+        crawler.RESPONSE_CACHE = ResponseCache(self.cache_dir + '-workers')
+        crawler.STORAGE = JsonStorage(self.state_file + '-workers')
+        with patch.multiple(
+            crawler, WORKERS=4, SCHEDULE_INTERVAL=datetime.timedelta(days=3)
+        ):
+            crawler.retrieve_number_ones(crawler.BestSellers({
+                'number_ones': [],
+                '_number_ones_last_updated': '2008-06-07'
+            }))
+        best_sellers = self.rebuild()
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2008-06-22'
+        )
+
+    def test_rebuild_replaces_state_once_it_catches_up(self, mock_print):
+        best_sellers = self.rebuild()
+        self.assertEqual(
+            best_sellers['_number_ones_last_updated'], '2008-06-22'
+        )
+        self.assertEqual(
+            crawler.STORAGE.load()['number_ones'],
+            json.loads(self.saved)['number_ones']
+        )
+
+    def test_incomplete_cache_leaves_state_untouched(self, mock_print):
+        crawler.RESPONSE_CACHE = ResponseCache(self.cache_dir + '-empty')
+        with self.assertRaises(SystemExit) as context:
+            self.rebuild()
+        self.assertIn('number_ones (nothing of 2008-06-22)',
+                      str(context.exception.code))
+        with open(self.state_file, 'rb') as infile:
+            self.assertEqual(infile.read(), self.saved)
+
+
+if __name__ == '__main__':
+    unittest.main()
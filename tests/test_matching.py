@@ -0,0 +1,98 @@
+import unittest
+import matching
+
+
+class TokensTest(unittest.TestCase):
+
+    def test_folds_case_accents_punctuation_and_stopwords(self):
+        self.assertEqual(
+            matching.tokens("The Girl's Café: A Novel"),
+            {'girls', 'cafe', 'novel'}
+        )
+
+    def test_author_tokens_drop_narrators_and_separators(self):
+        self.assertEqual(
+            matching.author_tokens('Tom Clancy & Mark Greaney; read by Lou'),
+            {'tom', 'clancy', 'mark', 'greaney'}
+        )
+
+    def test_surnames_skip_name_suffixes(self):
+        self.assertEqual(
+            matching.surnames('Martin Luther King Jr. and Jane Doe'),
+            {'king', 'doe'}
+        )
+
+
+class BookMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.first = {
+            'author': 'Jane Doe',
+            'title': 'The Long Road',
+            'isbns': ['9780000000001']
+        }
+        self.second = {
+            'author': 'John Doe',
+            'title': 'Short Stories',
+            'isbns': []
+        }
+        self.matcher = matching.BookMatcher([self.first, self.second])
+
+    def test_isbn_match_wins_over_title(self):
+        self.assertEqual(
+            self.matcher.match({
+                'author': 'John Doe',
+                'title': 'Short Stories',
+                'isbns': ['9780000000001']
+            }),
+            (self.first, 1.0, 'isbn')
+        )
+
+    def test_exact_match_without_isbns(self):
+        self.assertEqual(
+            self.matcher.match(
+                {'author': 'John Doe', 'title': 'Short Stories'}
+            ),
+            (self.second, 1.0, 'exact')
+        )
+
+    def test_fuzzy_match_reports_confidence(self):
+        book, confidence, method = self.matcher.match({
+            'author': 'Jane Doe; narrated by Sam Roe',
+            'title': 'Long Road'
+        })
+        self.assertIs(book, self.first)
+        self.assertEqual(method, 'fuzzy')
+        self.assertEqual(confidence, 1.0)
+
+    def test_only_books_sharing_a_surname_are_compared(self):
+        self.assertIsNone(
+            self.matcher.match({'author': 'Jane Roe', 'title': 'Long Road'})
+        )
+
+    def test_weak_similarity_is_not_a_match(self):
+        self.assertIsNone(
+            self.matcher.match({'author': 'Jane Doe', 'title': 'Far Away'})
+        )
+
+    def test_matched_by_finds_every_book_that_would_match(self):
+        audio_best_sellers = [
+            {'author': 'Jane Doe', 'title': 'Long Road'},
+            {'author': 'Sam Roe', 'title': 'Other', 'isbns': ['1']},
+            {'author': 'Jane Doe', 'title': 'Far Away'}
+        ]
+        matcher = matching.BookMatcher(audio_best_sellers)
+        number_one = {
+            'author': 'Jane Doe', 'title': 'The Long Road', 'isbns': ['1']
+        }
+        self.assertCountEqual(
+            matcher.matched_by(number_one), audio_best_sellers[:2]
+        )
+        for audio_best_seller in audio_best_sellers[:2]:
+            self.assertIsNotNone(
+                matching.BookMatcher([number_one]).match(audio_best_seller)
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
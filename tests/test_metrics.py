@@ -0,0 +1,79 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import urllib.request
+import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.metrics = metrics.Metrics(
+            clock=lambda: self.now, wall_clock=lambda: 1000.0
+        )
+
+    def test_counters_are_rendered_per_label_set(self):
+        self.metrics.describe('calls_total', 'Calls made')
+        self.metrics.inc('calls_total', status=200)
+        self.metrics.inc('calls_total', 2, status=200)
+        self.metrics.inc('calls_total', status=429)
+        self.assertEqual(self.metrics.render(), (
+            '# HELP calls_total Calls made\n'
+            '# TYPE calls_total counter\n'
+            'calls_total{status="200"} 3\n'
+            'calls_total{status="429"} 1\n'
+        ))
+
+    def test_histograms_are_cumulative(self):
+        self.metrics.observe('seconds', 0.2, buckets=(0.1, 1))
+        self.metrics.observe('seconds', 0.1, buckets=(0.1, 1))
+        self.metrics.observe('seconds', 5, buckets=(0.1, 1))
+        self.assertEqual(self.metrics.render(), (
+            '# TYPE seconds histogram\n'
+            'seconds_bucket{le="0.1"} 1\n'
+            'seconds_bucket{le="1"} 2\n'
+            'seconds_bucket{le="+Inf"} 3\n'
+            'seconds_sum 5.3\n'
+            'seconds_count 3\n'
+        ))
+
+    def test_timer_adds_elapsed_time_even_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('phase_seconds_total', phase='save'):
+                self.now += 1.5
+                raise ValueError
+        self.assertEqual(
+            self.metrics.value('phase_seconds_total', phase='save'), 1.5
+        )
+
+    def test_log_writes_json_lines_only_with_a_stream(self):
+        self.metrics.log('week', added=1)
+        self.metrics.log_stream = io.StringIO()
+        self.metrics.log('week', added=2)
+        self.assertEqual(
+            json.loads(self.metrics.log_stream.getvalue()),
+            {'time': 1000.0, 'event': 'week', 'added': 2}
+        )
+
+    def test_write_textfile_and_serve(self):
+        self.metrics.inc('calls_total')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'crawler.prom')
+            self.metrics.write_textfile(path)
+            with open(path) as infile:
+                self.assertEqual(infile.read(), self.metrics.render())
+        server = self.metrics.serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        port = server.server_address[1]
+        with urllib.request.urlopen(
+            f'http://127.0.0.1:{port}/metrics'
+        ) as response:
+            self.assertEqual(response.read().decode(), self.metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
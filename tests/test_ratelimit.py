@@ -0,0 +1,170 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from ratelimit import KeyPool, RateLimiter, key_state_file
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@patch('builtins.print')
+@patch('time.sleep')
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.wall_clock = FakeClock(1600000000.0)
+        self.rate_limiter = RateLimiter(
+            [(2, 60), (3, 3600)], self.clock, self.wall_clock
+        )
+
+    def test_does_not_sleep_under_the_limit(self, mock_sleep, mock_print):
+        self.rate_limiter.acquire()
+        self.rate_limiter.acquire()
+        mock_sleep.assert_not_called()
+        mock_print.assert_not_called()
+
+    def test_sleeps_until_oldest_call_leaves_the_window(
+        self, mock_sleep, mock_print
+    ):
+        self.rate_limiter.acquire()
+        self.clock.now += 10
+        self.rate_limiter.acquire()
+        self.rate_limiter.acquire()
+        mock_sleep.assert_called_once_with(50.0)
+        mock_print.assert_called_once_with(
+            'Sleeping 50.0 seconds to avoid being rate-limited'
+        )
+
+    def test_enforces_every_limit(self, mock_sleep, mock_print):
+        for _ in range(3):
+            self.rate_limiter.acquire()
+            self.clock.now += 60
+        self.rate_limiter.acquire()
+        mock_sleep.assert_called_once_with(3600.0 - 180.0)
+
+    def test_concurrent_reservations_queue_up(self, mock_sleep, mock_print):
+        waits = [self.rate_limiter.reserve() for _ in range(4)]
+        self.assertEqual(waits, [0.0, 0.0, 60.0, 3600.0])
+
+    def test_forgets_calls_older_than_longest_period(
+        self, mock_sleep, mock_print
+    ):
+        for _ in range(3):
+            self.rate_limiter.acquire()
+        mock_sleep.reset_mock()
+        self.clock.now += 3600 + 60
+        self.rate_limiter.acquire()
+        mock_sleep.assert_not_called()
+        self.assertEqual(len(self.rate_limiter.calls), 1)
+
+    def test_state_survives_a_restart(self, mock_sleep, mock_print):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_file = os.path.join(tmpdir, 'rate_limit.json')
+            self.rate_limiter.persist_to(state_file)
+            self.rate_limiter.acquire()
+            self.rate_limiter.acquire()
+            with open(state_file) as infile:
+                self.assertEqual(
+                    json.load(infile),
+                    {'calls': [1600000000.0, 1600000000.0]}
+                )
+            restarted_rate_limiter = RateLimiter(
+                [(2, 60)], FakeClock(5.0), FakeClock(1600000030.0)
+            )
+            restarted_rate_limiter.persist_to(state_file)
+            restarted_rate_limiter.acquire()
+        mock_sleep.assert_called_once_with(30.0)
+
+
+@patch('builtins.print')
+@patch('time.sleep')
+class KeyPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.key_pool = KeyPool(
+            ['a', 'b', 'c'], [(2, 60), (3, 3600)], self.clock,
+            FakeClock(1600000000.0)
+        )
+
+    def test_spreads_calls_over_keys(self, mock_sleep, mock_print):
+        self.assertEqual(
+            [self.key_pool.acquire() for _ in range(6)],
+            ['a', 'b', 'c', 'a', 'b', 'c']
+        )
+        mock_sleep.assert_not_called()
+
+    def test_picks_the_key_with_the_most_headroom(
+        self, mock_sleep, mock_print
+    ):
+        for _ in range(2):
+            self.key_pool.limiters['a'].reserve()
+        self.key_pool.limiters['b'].reserve()
+        self.assertEqual(self.key_pool.acquire(), 'c')
+        self.assertEqual(self.key_pool.acquire(), 'b')
+        self.assertEqual(self.key_pool.acquire(), 'c')
+        self.clock.now += 60
+        self.assertEqual(self.key_pool.acquire(), 'a')
+
+    def test_waits_for_the_first_key_with_a_free_slot(
+        self, mock_sleep, mock_print
+    ):
+        for _ in range(6):
+            self.key_pool.acquire()
+        self.clock.now += 10
+        self.key_pool.acquire()
+        mock_sleep.assert_called_once_with(50.0)
+
+    def test_benched_keys_are_skipped_until_they_return(
+        self, mock_sleep, mock_print
+    ):
+        self.key_pool.bench('a', 30)
+        self.key_pool.bench('b', 30)
+        self.assertEqual(self.key_pool.usable(), ['c'])
+        self.assertEqual(self.key_pool.acquire(), 'c')
+        self.assertEqual(self.key_pool.acquire(), 'c')
+        mock_sleep.assert_not_called()
+        self.assertEqual(self.key_pool.acquire(), 'a')
+        mock_sleep.assert_called_once_with(30.0)
+        self.clock.now += 30
+        self.assertEqual(self.key_pool.usable(), ['a', 'b', 'c'])
+
+    def test_each_key_keeps_its_own_state_file(self, mock_sleep, mock_print):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            state_file = os.path.join(tmpdir, 'rate_limit.json')
+            self.key_pool.persist_to(state_file)
+            self.key_pool.acquire()
+            self.assertTrue(
+                os.path.isfile(key_state_file(state_file, 'a'))
+            )
+            self.assertFalse(os.path.isfile(state_file))
+            single_key_pool = KeyPool(['a'], [(2, 60)], self.clock)
+            single_key_pool.persist_to(state_file)
+            single_key_pool.acquire()
+            self.assertTrue(os.path.isfile(state_file))
+
+
+class AsyncRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+    @patch('builtins.print')
+    @patch('asyncio.sleep')
+    async def test_acquire_async_sleeps_without_blocking(
+        self, mock_sleep, mock_print
+    ):
+        rate_limiter = RateLimiter([(1, 60)], FakeClock())
+        await rate_limiter.acquire_async()
+        await rate_limiter.acquire_async()
+        mock_sleep.assert_awaited_once_with(60.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
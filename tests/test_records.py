@@ -0,0 +1,55 @@
+import json
+import unittest
+import records
+
+
+class BookTest(unittest.TestCase):
+
+    def test_round_trips_through_dict(self):
+        book = {
+            'author': 'a',
+            'title': 'T',
+            'date': '2018-03-11',
+            'category': 'Fiction',
+            'isbns': ['9780000000001']
+        }
+        self.assertEqual(records.Book.from_dict(book).to_dict(), book)
+
+    def test_number_ones_have_no_category(self):
+        book = records.Book('a', 'T', '2008-06-07')
+        self.assertEqual(
+            book.to_dict(),
+            {'author': 'a', 'title': 'T', 'date': '2008-06-07', 'isbns': []}
+        )
+        self.assertIsNone(book.get('category'))
+        with self.assertRaises(KeyError):
+            book['category']
+
+    def test_repeated_strings_are_interned(self):
+        first = records.Book.from_dict(json.loads(
+            '{"author": "a b", "title": "T", "category": "Fiction"}'
+        ))
+        second = records.Book.from_dict(json.loads(
+            '{"author": "a b", "title": "U", "category": "Fiction"}'
+        ))
+        self.assertIs(first.author, second.author)
+        self.assertIs(first.category, second.category)
+
+    def test_equals_its_json_form(self):
+        book = records.Book('a', 'T', '2008-06-07')
+        self.assertEqual(
+            book, {'author': 'a', 'title': 'T', 'date': '2008-06-07'}
+        )
+        self.assertNotEqual(book, {'author': 'a', 'title': 'U'})
+
+    def test_to_json_serializes_books_only(self):
+        self.assertEqual(
+            json.dumps([records.Book('a', 'T')], default=records.to_json),
+            '[{"author": "a", "title": "T", "isbns": []}]'
+        )
+        with self.assertRaises(TypeError):
+            json.dumps(object(), default=records.to_json)
+
+
+if __name__ == '__main__':
+    unittest.main()
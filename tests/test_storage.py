@@ -0,0 +1,427 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+import records
+import storage
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'best_sellers.json')
+        self.journal_path = os.path.join(
+            self.tmpdir.name, 'best_sellers.journal.jsonl'
+        )
+
+    def journal_storage(self):
+        journal_storage = storage.JournalStorage(self.path, self.journal_path)
+        self.addCleanup(journal_storage.close)
+        return journal_storage
+
+
+class JsonStorageTest(StorageTestCase):
+
+    def test_load_returns_none_if_file_does_not_exist(self):
+        self.assertIsNone(storage.JsonStorage(self.path).load())
+
+    def test_save_writes_sorted_indented_json(self):
+        storage.JsonStorage(self.path).save({'b': [], 'a': 1})
+        with open(self.path) as infile:
+            self.assertEqual(
+                json.loads(infile.read()), {'a': 1, 'b': []}
+            )
+            infile.seek(0)
+            self.assertRegex(
+                infile.read(), r'^\{\n +"a": 1,\n +"b": \[\]\n\}$'
+            )
+
+    def test_save_streams_json_without_orjson(self):
+        with patch('serializers.orjson', None):
+            storage.JsonStorage(self.path).save({'b': [], 'a': 1})
+        with open(self.path) as infile:
+            self.assertEqual(
+                infile.read(),
+                json.dumps({'a': 1, 'b': []}, sort_keys=True, indent=2)
+            )
+
+    def test_pretty_json_does_not_depend_on_orjson(self):
+        best_sellers = {'number_ones': [{'title': 'T', 'isbns': []}], 'a': 1}
+        storage.JsonStorage(self.path).save(best_sellers)
+        with open(self.path, 'rb') as infile:
+            with_orjson = infile.read()
+        with patch('serializers.orjson', None):
+            storage.JsonStorage(self.path).save(best_sellers)
+        with open(self.path, 'rb') as infile:
+            self.assertEqual(infile.read(), with_orjson)
+
+    def test_failed_save_leaves_previous_file_intact(self):
+        json_storage = storage.JsonStorage(self.path)
+        json_storage.save({'a': 1})
+        with self.assertRaises(TypeError):
+            json_storage.save({'a': object()})
+        self.assertEqual(json_storage.load(), {'a': 1})
+        self.assertEqual(os.listdir(self.tmpdir.name), ['best_sellers.json'])
+
+    def test_save_writes_books_as_dicts(self):
+        storage.JsonStorage(self.path).save(
+            {'number_ones': [records.Book('a', 'T', '2008')]}
+        )
+        self.assertEqual(storage.JsonStorage(self.path).load(), {
+            'number_ones': [
+                {'author': 'a', 'title': 'T', 'date': '2008', 'isbns': []}
+            ]
+        })
+
+
+class JournalStorageTest(StorageTestCase):
+
+    def test_save_appends_only_new_books_and_changed_keys(self):
+        journal_storage = self.journal_storage()
+        best_sellers = {'number_ones': [], 'audio_best_sellers': []}
+        best_sellers['number_ones'].append({'author': 'a', 'title': 'T'})
+        best_sellers['_number_ones_last_updated'] = '2008-06-07'
+        journal_storage.save(best_sellers)
+        best_sellers['_number_ones_last_updated'] = '2008-06-14'
+        journal_storage.save(best_sellers)
+        journal_storage.save(best_sellers)
+        with open(self.journal_path) as infile:
+            entries = [json.loads(line) for line in infile]
+        self.assertEqual(entries, [
+            {
+                'append': {'number_ones': [{'author': 'a', 'title': 'T'}]},
+                'set': {'_number_ones_last_updated': '2008-06-07'}
+            },
+            {'set': {'_number_ones_last_updated': '2008-06-14'}}
+        ])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_load_replays_journal_over_base_file(self):
+        storage.JsonStorage(self.path).save({
+            'number_ones': [{'author': 'a', 'title': 'T'}],
+            'audio_best_sellers': []
+        })
+        journal_storage = self.journal_storage()
+        best_sellers = journal_storage.load()
+        best_sellers['number_ones'].append({'author': 'b', 'title': 'U'})
+        best_sellers['_number_ones_last_updated'] = '2008-06-07'
+        journal_storage.save(best_sellers)
+        journal_storage.close()
+        self.assertEqual(self.journal_storage().load(), best_sellers)
+
+    def test_load_ignores_and_truncates_torn_last_line(self):
+        journal_storage = self.journal_storage()
+        best_sellers = {'number_ones': [], 'audio_best_sellers': []}
+        best_sellers['_number_ones_last_updated'] = '2008-06-07'
+        journal_storage.save(best_sellers)
+        journal_storage.close()
+        with open(self.journal_path, 'a') as journal:
+            journal.write('{"set": {"_number_ones_last_updated": "2008-')
+        reloaded_storage = self.journal_storage()
+        self.assertEqual(reloaded_storage.load(), best_sellers)
+        best_sellers['_number_ones_last_updated'] = '2008-06-14'
+        reloaded_storage.save(best_sellers)
+        reloaded_storage.close()
+        self.assertEqual(self.journal_storage().load(), best_sellers)
+
+    def test_read_only_load_leaves_torn_last_line(self):
+        journal_storage = self.journal_storage()
+        best_sellers = {'number_ones': [], 'audio_best_sellers': []}
+        best_sellers['_number_ones_last_updated'] = '2008-06-07'
+        journal_storage.save(best_sellers)
+        journal_storage.close()
+        torn_line = '{"set": {"_number_ones_last_updated": "2008-'
+        with open(self.journal_path, 'a') as journal:
+            journal.write(torn_line)
+        reader = self.journal_storage()
+        self.assertEqual(reader.load(seed=False), best_sellers)
+        with open(self.journal_path) as infile:
+            self.assertTrue(infile.read().endswith(torn_line))
+        best_sellers['_number_ones_last_updated'] = '2008-06-14'
+        reader.save(best_sellers)
+        reader.close()
+        self.assertEqual(self.journal_storage().load(), best_sellers)
+
+    def test_compact_writes_base_file_and_removes_journal(self):
+        journal_storage = self.journal_storage()
+        best_sellers = {
+            'number_ones': [{'author': 'a', 'title': 'T'}],
+            'audio_best_sellers': []
+        }
+        journal_storage.save(best_sellers)
+        journal_storage.close()
+        self.journal_storage().compact()
+        self.assertFalse(os.path.exists(self.journal_path))
+        self.assertEqual(storage.JsonStorage(self.path).load(), best_sellers)
+
+    def test_reset_empties_base_file_and_journal(self):
+        journal_storage = self.journal_storage()
+        journal_storage.save({
+            'number_ones': [{'author': 'a', 'title': 'T'}],
+            'audio_best_sellers': []
+        })
+        journal_storage.reset()
+        self.assertEqual(
+            self.journal_storage().load(),
+            {'number_ones': [], 'audio_best_sellers': []}
+        )
+
+    def test_replay_does_not_duplicate_books_already_compacted(self):
+        best_sellers = {
+            'number_ones': [{'author': 'a', 'title': 'T'}],
+            'audio_best_sellers': []
+        }
+        journal_storage = self.journal_storage()
+        journal_storage.save(best_sellers)
+        journal_storage.close()
+        storage.JsonStorage(self.path).save(best_sellers)
+        self.assertEqual(self.journal_storage().load(), best_sellers)
+
+
+class SqliteStorageTest(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.db_path = os.path.join(self.tmpdir.name, 'best_sellers.db')
+
+    def sqlite_storage(self):
+        sqlite_storage = storage.SqliteStorage(self.db_path, self.path)
+        self.addCleanup(sqlite_storage.close)
+        return sqlite_storage
+
+    def test_load_returns_none_without_database_or_json_file(self):
+        self.assertIsNone(self.sqlite_storage().load())
+
+    def test_load_imports_existing_json_file(self):
+        best_sellers = {
+            'number_ones': [{'author': 'a', 'title': 'T', 'date': '2008'}],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2008'
+        }
+        storage.JsonStorage(self.path).save(best_sellers)
+        self.assertEqual(self.sqlite_storage().load(), best_sellers)
+        best_sellers['number_ones'][0]['isbns'] = []
+        self.assertEqual(self.sqlite_storage().load(), best_sellers)
+
+    def test_connect_adds_columns_missing_from_older_databases(self):
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(
+            'CREATE TABLE number_ones (id INTEGER PRIMARY KEY, '
+            'author TEXT NOT NULL, title TEXT NOT NULL, date TEXT NOT NULL, '
+            'UNIQUE (author, title))'
+        )
+        connection.execute(
+            "INSERT INTO number_ones (author, title, date) "
+            "VALUES ('a', 'T', '2008')"
+        )
+        connection.commit()
+        connection.close()
+        self.assertEqual(
+            self.sqlite_storage().load()['number_ones'],
+            [{'author': 'a', 'title': 'T', 'date': '2008', 'isbns': []}]
+        )
+
+    def test_save_and_load_round_trip(self):
+        sqlite_storage = self.sqlite_storage()
+        best_sellers = {
+            'number_ones': [{
+                'author': 'a',
+                'title': 'T',
+                'date': '2008',
+                'isbns': ['9780000000001']
+            }],
+            'audio_best_sellers': [{
+                'author': 'a',
+                'title': 'T',
+                'date': '2018',
+                'category': 'Fiction',
+                'isbns': ['9780000000002', '9780000000003']
+            }],
+            '_number_ones_last_updated': '2008',
+            '_audio_best_sellers_last_updated': '2018'
+        }
+        sqlite_storage.save(best_sellers)
+        best_sellers['number_ones'].append(
+            {'author': 'b', 'title': 'U', 'date': '2009', 'isbns': []}
+        )
+        best_sellers['_number_ones_last_updated'] = '2009'
+        best_sellers['reading_list'] = [{
+            'author': 'a',
+            'title': 'T',
+            'date': '2018',
+            'category': 'Fiction',
+            'match': 'isbn',
+            'confidence': 1.0
+        }]
+        sqlite_storage.save(best_sellers)
+        sqlite_storage.close()
+        self.assertEqual(self.sqlite_storage().load(), best_sellers)
+
+    def test_reset_deletes_all_rows(self):
+        sqlite_storage = self.sqlite_storage()
+        sqlite_storage.save({
+            'number_ones': [{'author': 'a', 'title': 'T', 'date': '2008'}],
+            'audio_best_sellers': [],
+            '_number_ones_last_updated': '2008'
+        })
+        sqlite_storage.reset()
+        self.assertEqual(
+            sqlite_storage.load(),
+            {'number_ones': [], 'audio_best_sellers': []}
+        )
+
+    def test_unique_index_ignores_duplicate_books(self):
+        sqlite_storage = self.sqlite_storage()
+        sqlite_storage.save({
+            'number_ones': [
+                {'author': 'a', 'title': 'T', 'date': '2008'},
+                {'author': 'a', 'title': 'T', 'date': '2009'}
+            ],
+            'audio_best_sellers': []
+        })
+        self.assertEqual(
+            sqlite_storage.load()['number_ones'],
+            [{'author': 'a', 'title': 'T', 'date': '2008', 'isbns': []}]
+        )
+
+
+class SnapshotStorageTest(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.snapshot_path = os.path.join(
+            self.tmpdir.name, 'best_sellers.snapshot'
+        )
+        self.best_sellers = {
+            'number_ones': [
+                records.Book('a', 'T', '2008', isbns=['9780000000001'])
+            ],
+            'audio_best_sellers': [
+                records.Book('a', 'T', '2018', 'Fiction')
+            ],
+            'reading_list': [{'author': 'a', 'title': 'T'}],
+            '_number_ones_last_updated': '2008',
+            '_completed': True
+        }
+
+    def snapshot_storage(self):
+        return storage.SnapshotStorage(self.snapshot_path, self.path)
+
+    def test_save_and_load_round_trip(self):
+        self.snapshot_storage().save(self.best_sellers)
+        self.assertEqual(self.snapshot_storage().load(), self.best_sellers)
+
+    def test_load_decodes_only_requested_sections(self):
+        self.snapshot_storage().save(self.best_sellers)
+        self.assertEqual(
+            self.snapshot_storage().load({'audio_best_sellers'}),
+            {
+                'audio_best_sellers': self.best_sellers['audio_best_sellers'],
+                '_number_ones_last_updated': '2008',
+                '_completed': True
+            }
+        )
+
+    def test_save_keeps_sections_that_were_not_loaded(self):
+        self.snapshot_storage().save(self.best_sellers)
+        best_sellers = self.snapshot_storage().load({'number_ones'})
+        best_sellers['number_ones'].append(records.Book('b', 'U', '2009'))
+        best_sellers['_number_ones_last_updated'] = '2009'
+        self.snapshot_storage().save(best_sellers)
+        self.best_sellers['number_ones'] = best_sellers['number_ones']
+        self.best_sellers['_number_ones_last_updated'] = '2009'
+        self.assertEqual(self.snapshot_storage().load(), self.best_sellers)
+
+    def test_load_imports_existing_json_file(self):
+        storage.JsonStorage(self.path).save(self.best_sellers)
+        self.assertEqual(self.snapshot_storage().load(), self.best_sellers)
+        self.assertTrue(os.path.isfile(self.snapshot_path))
+
+    def test_reset_empties_sections(self):
+        self.snapshot_storage().save(self.best_sellers)
+        self.snapshot_storage().reset()
+        self.assertEqual(
+            self.snapshot_storage().load(),
+            {'number_ones': [], 'audio_best_sellers': []}
+        )
+
+    def test_load_rejects_other_files(self):
+        with open(self.snapshot_path, 'wb') as outfile:
+            outfile.write(b'{"number_ones": []}')
+        with self.assertRaises(ValueError):
+            self.snapshot_storage().load()
+
+
+class RankingStoreTest(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rankings_path = os.path.join(self.tmpdir.name, 'rankings.jsonl')
+
+    def ranking_store(self):
+        ranking_store = storage.RankingStore(self.rankings_path).load()
+        self.addCleanup(ranking_store.close)
+        return ranking_store
+
+    def row(self, rank, isbn13):
+        return {
+            'rank': rank,
+            'weeks_on_list': 1,
+            'isbn13': isbn13,
+            'author': 'a',
+            'title': isbn13
+        }
+
+    def test_books_are_written_once_and_referenced_afterwards(self):
+        ranking_store = self.ranking_store()
+        ranking_store.append_week('2008-06-07', {
+            'a': ('2008-06-08', [self.row(1, 'X'), self.row(2, 'Y')])
+        })
+        ranking_store.append_week('2008-06-14', {
+            'a': ('2008-06-15', [self.row(1, 'Y'), self.row(2, 'X')])
+        })
+        with open(self.rankings_path) as infile:
+            weeks = [json.loads(line) for line in infile]
+        self.assertEqual(weeks[0]['books'], [['X', 'a', 'X'], ['Y', 'a', 'Y']])
+        self.assertEqual(weeks[1]['books'], [])
+        self.assertEqual(weeks[1]['lists']['a']['book'], [1, 0])
+        self.assertEqual(len(ranking_store), 4)
+
+    def test_load_round_trips_rows_and_skips_stored_lists(self):
+        ranking_store = self.ranking_store()
+        ranking_store.append_week('2008-06-07', {
+            'a': ('2008-06-08', [self.row(1, 'X')]),
+            'b': ('2008-06-01', [self.row(1, 'Y')])
+        })
+        ranking_store.close()
+        reloaded_store = self.ranking_store()
+        self.assertEqual(list(reloaded_store.rows()), [
+            {'list': 'a', 'date': '2008-06-08', **self.row(1, 'X')},
+            {'list': 'b', 'date': '2008-06-01', **self.row(1, 'Y')}
+        ])
+        reloaded_store.append_week('2008-06-07', {
+            'a': ('2008-06-08', [self.row(1, 'X')])
+        })
+        self.assertEqual(len(reloaded_store), 2)
+        self.assertTrue(reloaded_store.has('b', '2008-06-01'))
+        self.assertFalse(reloaded_store.has('b', '2008-06-02'))
+
+    def test_load_ignores_and_truncates_torn_last_line(self):
+        ranking_store = self.ranking_store()
+        ranking_store.append_week('2008-06-07', {
+            'a': ('2008-06-08', [self.row(1, 'X')])
+        })
+        ranking_store.close()
+        with open(self.rankings_path, 'a') as rankings:
+            rankings.write('{"published_date": "2008-')
+        self.assertEqual(len(self.ranking_store()), 1)
+        with open(self.rankings_path) as infile:
+            self.assertEqual(len(infile.readlines()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()